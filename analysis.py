@@ -0,0 +1,282 @@
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from database import db
+from export import MOOD_FIELDS, LIFESTYLE_FIELDS, day_query
+from models import (FoodItem, KitCode, MealItem, StoolEvent, TrackingEntry,
+                    MEAL_TYPES)
+
+DEFAULT_LAGS = (0, 1, 2)
+# Features seen on fewer participant-days than this are not tested
+MIN_SUPPORT = 5
+FDR_ALPHA = 0.05
+CACHE_SIZE = 8
+
+OUTCOMES = ['bristol_mean', 'stool_count', 'mood', 'mood_overall_mood']
+NUMERIC_FEATURES = ([f'mood_{field}' for field in MOOD_FIELDS] +
+                    [f'lifestyle_{field}' for field in LIFESTYLE_FIELDS] +
+                    [f'{meal}_item_count' for meal in MEAL_TYPES] +
+                    ['meals_logged', 'bristol_mean', 'stool_count', 'mood'])
+# Columns computed from the same same-day record; at lag 0 they correlate by
+# construction (mood is the mean of the mood_* answers), so those pairs are
+# not tested. Any other column is its own family
+FAMILIES = {
+    'mood': 'mood',
+    **{f'mood_{field}': 'mood' for field in MOOD_FIELDS},
+    'bristol_mean': 'stool',
+    'stool_count': 'stool',
+}
+
+
+def data_version():
+    # Cheap fingerprint of everything the matrix is built from; any save
+    # changes at least one of these
+    row = db.session.execute(
+        db.select(
+            db.select(db.func.count(TrackingEntry.id)).scalar_subquery(),
+            db.select(db.func.max(TrackingEntry.updated_at)).scalar_subquery(),
+            db.select(db.func.max(StoolEvent.id)).scalar_subquery(),
+            db.select(db.func.count(MealItem.id)).scalar_subquery(),
+            db.select(db.func.max(MealItem.id)).scalar_subquery())).one()
+    return tuple(str(value) for value in row)
+
+
+def _cohort_kits(cohort):
+    return set(
+        db.session.execute(
+            db.select(KitCode.code).where(
+                KitCode.batch_name == cohort)).scalars())
+
+
+def _json_columns(values, fields, prefix):
+    # Expand a column of JSON dicts into one numeric column per known field
+    records = [value if isinstance(value, dict) else {} for value in values]
+    frame = pd.DataFrame.from_records(records, columns=fields)
+    return frame.apply(pd.to_numeric, errors='coerce').astype(
+        'float64').add_prefix(prefix)
+
+
+def _load_days():
+    # The day export without the meals JSON; meal counts come from MealItem
+    query = day_query()
+    query = query.with_only_columns(
+        *[column for column in query.selected_columns if column.key != 'meals'])
+    rows = db.session.execute(query).all()
+    if not rows:
+        return pd.DataFrame()
+
+    days = pd.DataFrame(rows, columns=list(rows[0]._fields))
+    lifestyle = _json_columns(days['lifestyle_log'], LIFESTYLE_FIELDS,
+                              'lifestyle_')
+    # Days logged without a lifestyle entry stay missing, not False
+    lifestyle[days['lifestyle_log'].isna().to_numpy()] = np.nan
+    days = pd.concat([
+        days.drop(columns=['mood_details', 'lifestyle_log']),
+        _json_columns(days['mood_details'], MOOD_FIELDS, 'mood_'), lifestyle
+    ],
+                     axis=1)
+    days['stool_count'] = days['stool_count'].fillna(0)
+    return days.set_index(['kit_id', 'study_day'])
+
+
+def _load_foods():
+    rows = db.session.execute(
+        db.select(MealItem.kit_id, MealItem.study_day, MealItem.meal_type,
+                  FoodItem.category, FoodItem.name).join(
+                      FoodItem, FoodItem.id == MealItem.food_id)).all()
+    return pd.DataFrame(
+        rows, columns=['kit_id', 'study_day', 'meal_type', 'category', 'food'])
+
+
+def _scatter(index, foods, labels):
+    # Count long-format rows straight into an array aligned with the day
+    # rows; crosstab would aggregate group by group in Python
+    rows = index.get_indexer(
+        pd.MultiIndex.from_arrays([foods['kit_id'], foods['study_day']]))
+    codes, names = pd.factorize(labels)
+    counts = np.zeros((len(index), len(names)))
+    known = rows >= 0
+    np.add.at(counts, (rows[known], codes[known]), 1.0)
+    return pd.DataFrame(counts, index=index, columns=list(names))
+
+
+def build_feature_matrix(cohort=None):
+    """Participant-day by feature matrix, indexed by (kit_id, study_day).
+
+    Food columns are 0/1 indicators of each catalogue item eaten that day,
+    next to meal counts, mood components, lifestyle flags and stool data.
+    """
+    days = _load_days()
+    if days.empty:
+        return pd.DataFrame()
+    if cohort:
+        kits = _cohort_kits(cohort)
+        days = days[days.index.get_level_values('kit_id').isin(kits)]
+
+    foods = _load_foods()
+    meals = _scatter(days.index, foods, foods['meal_type']).reindex(
+        columns=MEAL_TYPES, fill_value=0.0)
+    days = days.join(meals.add_suffix('_item_count'))
+    days['meals_logged'] = (meals > 0).sum(axis=1).astype('float64')
+
+    matrix = days[NUMERIC_FEATURES].astype('float64')
+    eaten = _scatter(days.index, foods,
+                     'food:' + foods['category'] + '/' + foods['food'])
+    matrix = matrix.join(eaten.clip(upper=1.0))
+    return matrix.sort_index()
+
+
+def shift_days(outcomes, lag):
+    # Outcome on day d + lag lined up against features on day d, for the
+    # same participant only
+    shifted = outcomes.reset_index()
+    shifted['study_day'] = pd.to_datetime(
+        shifted['study_day']) - pd.Timedelta(days=lag)
+    shifted['study_day'] = shifted['study_day'].dt.date
+    return shifted.set_index(['kit_id', 'study_day'])
+
+
+def _demean(frame):
+    # Removes each participant's own average so the correlations describe
+    # day-to-day variation rather than differences between people
+    return frame - frame.groupby(level='kit_id').transform('mean')
+
+
+def _pairwise_corr(x, y):
+    """Pearson r and pair counts for every column of ``x`` against ``y``.
+
+    Missing values are dropped pairwise; everything is a handful of matrix
+    products, so cost grows with the matrix size, not with the pair count.
+    """
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    x0, y0 = np.where(mx, x, 0.0), np.where(my, y, 0.0)
+    mxf, myf = mx.astype('float64'), my.astype('float64')
+
+    n = mxf.T @ myf
+    sx, sy = x0.T @ myf, mxf.T @ y0
+    sxx, syy = (x0 * x0).T @ myf, mxf.T @ (y0 * y0)
+    sxy = x0.T @ y0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * sxy - sx * sy
+        var = (n * sxx - sx * sx) * (n * syy - sy * sy)
+        r = np.where(var > 0, cov / np.sqrt(np.where(var > 0, var, 1.0)),
+                     np.nan)
+    return np.clip(r, -1.0, 1.0), n
+
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+
+
+def _p_values(r, n):
+    # Two-sided p-values from the Fisher z-transform
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.arctanh(np.clip(r, -0.999999, 0.999999)) * np.sqrt(n - 3)
+    p = _erfc(np.abs(z) / math.sqrt(2)).astype('float64')
+    return np.where(n > 3, p, np.nan)
+
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (q-values), NaNs left as is."""
+    p_values = np.asarray(p_values, dtype='float64')
+    q = np.full_like(p_values, np.nan)
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    if not len(p):
+        return q
+    order = np.argsort(p)
+    ranked = p[order] * len(p) / np.arange(1, len(p) + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = np.empty_like(ranked)
+    adjusted[order] = np.minimum(ranked, 1.0)
+    q[valid] = adjusted
+    return q
+
+
+def _family(column):
+    return FAMILIES.get(column, column)
+
+
+def lagged_correlations(matrix, lags=DEFAULT_LAGS, outcomes=OUTCOMES,
+                        demean=True, min_support=MIN_SUPPORT):
+    """Correlate every feature with every outcome ``lag`` days later.
+
+    Returns one row per (feature, outcome, lag) with r, n, the p-value and
+    the Benjamini-Hochberg q-value computed across all the tests together.
+    """
+    columns = ['feature', 'outcome', 'lag', 'n', 'r', 'p', 'q']
+    if matrix.empty:
+        return pd.DataFrame(columns=columns)
+
+    support = (matrix.fillna(0) != 0).sum()
+    features = matrix.loc[:, support >= min_support]
+    outcome_frame = matrix[[column for column in outcomes
+                            if column in matrix]]
+    if demean:
+        features, outcome_frame = _demean(features), _demean(outcome_frame)
+
+    x = features.to_numpy(dtype='float64')
+    frames = []
+    for lag in lags:
+        y = shift_days(outcome_frame, lag).reindex(features.index).to_numpy(
+            dtype='float64')
+        r, n = _pairwise_corr(x, y)
+        result = pd.DataFrame({
+            'feature': np.repeat(features.columns, len(outcome_frame.columns)),
+            'outcome': np.tile(outcome_frame.columns, len(features.columns)),
+            'lag': lag,
+            'n': n.ravel().astype('int64'),
+            'r': r.ravel(),
+            'p': _p_values(r, n).ravel()
+        })
+        if lag == 0:
+            # Dropped before the FDR correction, so identities neither rank
+            # nor count towards the number of tests
+            same_family = (result['feature'].map(_family) ==
+                           result['outcome'].map(_family))
+            result = result[~same_family]
+        frames.append(result)
+
+    results = pd.concat(frames, ignore_index=True)
+    results = results[results['r'].notna()].reset_index(drop=True)
+    results['q'] = benjamini_hochberg(results['p'].to_numpy())
+    return results.sort_values(['q', 'p']).reset_index(drop=True)[columns]
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def cohort_correlations(cohort=None, lags=DEFAULT_LAGS):
+    """Cached correlations for a cohort (kit-code batch, None for everyone).
+
+    Entries are keyed on the data version, so a new save is picked up by
+    the next call and stale entries simply age out of the LRU.
+    """
+    key = (cohort, tuple(lags), data_version())
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    results = lagged_correlations(build_feature_matrix(cohort), lags)
+    with _lock:
+        _cache[key] = results
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return results
+
+
+def significant(results, alpha=FDR_ALPHA, limit=50):
+    rows = results[results['q'] <= alpha].head(limit)
+    return [{
+        'feature': row.feature,
+        'outcome': row.outcome,
+        'lag': int(row.lag),
+        'n': int(row.n),
+        'r': round(float(row.r), 4),
+        'p': float(row.p),
+        'q': float(row.q)
+    } for row in rows.itertuples()]
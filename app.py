@@ -1,18 +1,32 @@
 import os
+import csv
+import json
+import hashlib
+import tempfile
 import logging
 import random
-import uuid
-from datetime import datetime, timedelta, time
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session, flash
+import click
+from datetime import datetime, timedelta
+from flask import Flask, current_app, render_template, jsonify, request, redirect, url_for, session, flash, Response, send_file, stream_with_context
+from flask.cli import AppGroup
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from database import db
-from sqlalchemy import update
-from models import Admin, AnonymousUser, KitCode, TrackingEntry, DailyMenu # Added DailyMenu import
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-
+from models import (Admin, KitCode, TrackingEntry,
+                    DailyRollup, StoolEvent, FoodItem, CommunityStats,
+                    get_study_day, get_today_status, in_new_day_window,
+                    MEAL_TYPES, RESET_TIME)
+import assets
+import export
+import kit_codes
+import logging_config
+import menu_service
+import metrics
+import responses
+import sheets_sync
+import tracking
+import write_behind
+from migrations import run_migrations
 
 # Admin authentication decorator
 def admin_required(f):
@@ -27,252 +41,302 @@ def admin_required(f):
     return decorated_function
 
 
-app = Flask(__name__)
+# Views and CLI commands are collected here and attached by create_app, so
+# importing this module touches neither the database nor an app
+_routes = []
+commands = AppGroup('commands')
+
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_ADMIN_USERNAME = 'Microbiome'
+
+
+def route(rule, **options):
+    # Same signature as app.route; endpoints keep the view function's name
+    def decorator(view):
+        _routes.append((rule, options, view))
+        return view
+
+    return decorator
+
+
+def database_url():
+    # Get the DATABASE_URL from environment and fix potential "postgres://" issue
+    db_url = os.environ.get("DATABASE_URL")
+    if db_url and db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+    return db_url
+
+
+def start_request_log():
+    logging_config.start_request()
+
+
+def finish_request_log(response):
+    return logging_config.finish_request(response)
+
+
+def start_request_metrics():
+    metrics.start_request()
+
+
+def finish_request_metrics(response):
+    return metrics.finish_request(response, db.engine)
+
 
-app.secret_key = os.environ.get(
-    "FLASK_SECRET_KEY") or "health_tracking_secret_key"
-# Get the DATABASE_URL from environment and fix potential "postgres://" issue
-db_url = os.environ.get("DATABASE_URL")
-if db_url and db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
-app.config["SQLALCHEMY_DATABASE_URI"] = db_url
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+def add_asset_version(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        asset_hash = current_app.config["ASSET_MANIFEST"]["assets"].get(
+            values.get('filename'))
+        if asset_hash:
+            values['v'] = asset_hash
 
-db.init_app(app)
 
-# Import models after db initialization to avoid circular imports
-with app.app_context():
+def cache_versioned_assets(response):
+    # A hashed URL never changes content, so browsers need not revalidate it
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.headers['Cache-Control'] = STATIC_CACHE_CONTROL
+    return response
+
+
+def compress(response):
+    return responses.compress_response(response, request.accept_encodings)
+
+
+@commands.command('db-init')
+def db_init_command():
+    """Create any missing tables; existing tables are left as they are."""
     db.create_all()
+    click.echo('Database tables created')
+
+
+@commands.command('seed-admin')
+@click.option('--username', default=DEFAULT_ADMIN_USERNAME, show_default=True)
+@click.option('--password', envvar='ADMIN_PASSWORD', prompt=True,
+              hide_input=True, confirmation_prompt=True)
+def seed_admin_command(username, password):
+    """Create an admin account, or reset the password of an existing one."""
+    admin = Admin.query.filter_by(username=username).first()
+    if admin:
+        admin.password_hash = generate_password_hash(password)
+        click.echo(f'Updated admin {username}')
+    else:
+        db.session.add(
+            Admin(username=username,
+                  password_hash=generate_password_hash(password),
+                  is_active=True))
+        click.echo(f'Created admin {username}')
+    db.session.commit()
 
-    # Create default admin account if it doesn't exist
-    default_admin = Admin.query.filter_by(username='Microbiome').first()
-    if not default_admin:
-        admin = Admin(username='Microbiome',
-                      password_hash=generate_password_hash('MBDao'),
-                      is_active=True)
-        db.session.add(admin)
-        db.session.commit()
-        logging.info('Default admin account created')
+@commands.command('replay-spool')
+def replay_spool_command():
+    """Apply write-behind saves spooled by processes that have exited."""
+    buffer = write_behind.WriteBehind(current_app)
+    buffer.drain()
+    if buffer.pending:
+        raise click.ClickException(
+            f'{len(buffer.pending)} saves could not be applied and stay spooled')
+    click.echo('Write-behind spool replayed')
+
+
+@commands.command('migrate')
+def migrate_command():
+    """Apply schema migrations and backfills to an existing database."""
+    run_migrations()
+
+
+@commands.command('build-assets')
+def build_assets_command():
+    """Write static/asset-manifest.json with the content hash of every asset."""
+    manifest = assets.write_manifest(current_app.static_folder)
+    click.echo(f"Hashed {len(manifest['assets'])} assets, version {manifest['version']}")
+
+
+@commands.command('export')
+@click.option('--table', type=click.Choice(export.EXPORT_TABLES), default='days')
+@click.option('--format', 'export_format', type=click.Choice(export.EXPORT_FORMATS),
+              default='csv')
+@click.option('--output', type=click.Path(dir_okay=False), required=True)
+def export_command(table, export_format, output):
+    """Export flattened tracking data for analysis."""
+    if export_format == 'parquet':
+        rows = export.write_parquet(table, output)
+    else:
+        with open(output, 'w', newline='') as f:
+            rows = export.write_csv(table, f)
+    click.echo(f'Exported {rows} rows to {output}')
+
+
+@commands.command('sync-sheets')
+@click.option('--full', is_flag=True, help='Resend every row, not just changes.')
+def sync_sheets_command(full):
+    """Push new and changed tracking days to the research spreadsheet."""
+    sent = sheets_sync.sync_days(sheets_sync.open_worksheet(), full=full)
+    click.echo(f'Synced {sent} tracking days')
+
+
+@commands.command('correlations')
+@click.option('--cohort', help='Kit-code batch name; defaults to everyone.')
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Write every result as CSV instead of printing the significant ones.')
+def correlations_command(cohort, output):
+    """Lagged food, mood and stool correlations with FDR correction."""
+    import analysis
+    results = analysis.cohort_correlations(cohort)
+    if output:
+        results.to_csv(output, index=False)
+        click.echo(f'Wrote {len(results)} correlations to {output}')
+        return
+    for row in analysis.significant(results):
+        click.echo(f"{row['feature']} -> {row['outcome']} (lag {row['lag']}): "
+                   f"r={row['r']} n={row['n']} q={row['q']:.3g}")
+
+
+@commands.command('train-model')
+@click.option('--full', is_flag=True, help='Retrain from scratch instead of warm-starting.')
+def train_model_command(full):
+    """Fold completed days into the next-day prediction model."""
+    import prediction
+    model = prediction.train(full=full)
+    if model is None:
+        click.echo('No new days to train on')
+        return
+    click.echo(f'Model v{model.version} trained through {model.trained_through} '
+               f'on {int(model.n.max())} days')
+
+
+@commands.command('score-kits')
+@click.option('--output', type=click.Path(dir_okay=False), required=True)
+def score_kits_command(output):
+    """Write next-day predictions for every active kit to a CSV file."""
+    import prediction
+    results = prediction.score_active_kits()
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=[
+            'kit_id', 'based_on', 'model_version'
+        ] + [f'predicted_{target}' for target in prediction.TARGETS])
+        writer.writeheader()
+        writer.writerows(results)
+    click.echo(f'Scored {len(results)} kits')
+
+
+@commands.command('rebuild-community-stats')
+@click.option('--start', 'start_day', type=click.DateTime(['%Y-%m-%d']),
+              required=True)
+@click.option('--end', 'end_day', type=click.DateTime(['%Y-%m-%d']))
+def rebuild_community_stats_command(start_day, end_day):
+    """Recompute CommunityStats for a date range from the tracking tables."""
+    start_day = start_day.date()
+    end_day = end_day.date() if end_day else get_study_day()
+    rebuilt = CommunityStats.rebuild(start_day, end_day)
+    db.session.commit()
+    click.echo(f'Rebuilt community stats for {rebuilt} days')
 
 
-@app.route('/save-lifestyle', methods=['POST'])
-def save_lifestyle():
-    if 'kit_id' not in session:
-        return jsonify({"success": False, "error": "Not logged in"}), 401
+@commands.command('prune-sync-events')
+def prune_sync_events_command():
+    """Delete idempotency keys older than the offline sync retention."""
+    deleted = tracking.prune_sync_events()
+    click.echo(f'Deleted {deleted} sync events')
 
-    try:
-        entry = TrackingEntry.query.filter_by(
-            kit_id=session['kit_id'], date=datetime.now().date()).first()
 
-        if not entry:
-            entry = TrackingEntry(kit_id=session['kit_id'],
-                                  date=datetime.now().date())
-            db.session.add(entry)
+def _save(kind, kit_id, payload):
+    # Clients may send an Idempotency-Key so a retried save is applied once
+    event_id = request.headers.get('Idempotency-Key')
+    if event_id and len(event_id) > tracking.EVENT_ID_MAX_LENGTH:
+        return jsonify({"success": False, "error": "Invalid idempotency key"}), 400
 
-        # Save lifestyle data
-        if entry.lifestyle_log:
-            return jsonify({
-                "success": False,
-                "error": "Lifestyle already logged for today"
-            }), 400
-
-        entry.lifestyle_log = request.json
-        stmt3 = update(TrackingEntry).where(
-            TrackingEntry.kit_id == entry.kit_id).values(
-                lifestyle_log=entry.lifestyle_log)
-        updt3 = db.session.execute(stmt3)
+    buffer = current_app.extensions.get('write_behind')
+    if buffer is not None:
+        body, status = buffer.accept(kit_id, kind, payload, event_id)
+        return jsonify(body), status, write_behind.headers(status)
+
+    try:
+        body, status = tracking.apply_event(kit_id, kind, payload, event_id)
         db.session.commit()
-        return jsonify({"success": True})
+        return jsonify(body), status
     except Exception as e:
-        logging.error(f"Error saving lifestyle data: {str(e)}")
+        db.session.rollback()
+        logging.error("Error saving %s data: %s", kind, e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-@app.route('/save-meal', methods=['POST'])
-def save_meal():
+@route('/save-lifestyle', methods=['POST'])
+def save_lifestyle():
     if 'kit_id' not in session:
         return jsonify({"success": False, "error": "Not logged in"}), 401
+    return _save('lifestyle', session['kit_id'], request.json)
 
-    data = request.json
-    kit_id = data.get('kitId')
-    meal_type = data.get('type')
-    foods = data.get('foods', {})
-    if not kit_id or not meal_type:
-        return jsonify({
-            "success": False,
-            "error": "Missing required data"
-        }), 400
-
-    if meal_type not in ['breakfast', 'lunch', 'dinner']:
-        return jsonify({"success": False, "error": "Invalid meal type"}), 400
-
-    try:
-        today = datetime.now().date()
-        current_time = datetime.now().time()
-        reset_time = time(3, 0)  # 3 AM reset time
-
-        # If it's before reset time, we should look at yesterday's entry
-        if current_time < reset_time:
-            today = today - timedelta(days=1)
-
-        # Get or create today's entry
-        entry = TrackingEntry.query.filter_by(kit_id=kit_id,
-                                              date=today).first()
-        if not entry:
-            print("ADDING NEW ENTRY")
-            entry = TrackingEntry(
-                kit_id=kit_id,
-                date=today,
-                meals={},
-                stool_entries=[],
-            )
-            db.session.add(entry)
-
-        # Initialize meals if None
-        if entry.meals is None:
-            entry.meals = {"breakfast": {}, "lunch": {}, "dinner": {}}
-
-        # Check meal sequence and save data
-        is_new_day = current_time >= reset_time and current_time <= time(12, 0)
-
-        # Log detailed information for debugging
-        logging.debug(
-            f"Saving meal - Type: {meal_type}, Is new day: {is_new_day}")
-        logging.debug(f"Current meals: {entry.meals}")
-
-        if meal_type == 'breakfast' and (is_new_day
-                                         or 'breakfast' not in entry.meals):
-            # Always allow breakfast during new day or if not logged
-            entry.meals['breakfast'] = foods
-        elif meal_type == 'lunch':
-            print(f"Current mealsjlasflsajf: {entry.meals}")
-            if 'breakfast' not in entry.meals:
-                return jsonify({
-                    "success": False,
-                    "error": "Please log breakfast first"
-                }), 400
-            if 'lunch' in entry.meals:
-                return jsonify({
-                    "success": False,
-                    "error": "Lunch already logged for today"
-                }), 400
-            print(f"FOODS: {foods}")
-            entry.meals['lunch'] = foods
-            print(f"Current meals final: {entry.meals}")
-        elif meal_type == 'dinner':
-            if 'breakfast' not in entry.meals or 'lunch' not in entry.meals:
-                return jsonify({
-                    "success": False,
-                    "error": "Please log breakfast and lunch first"
-                }), 400
-            if 'dinner' in entry.meals:
-                return jsonify({
-                    "success": False,
-                    "error": "Dinner already logged for today"
-                }), 400
-            entry.meals['dinner'] = foods
-
-        # Update streak
-        entry.update_streak()
-
-        # Log the final state before committing
-        logging.debug(f"Final meals state: {entry.meals}")
-        # db.session.commit()
-        print(kit_id)
-        print(entry.meals)
-        stmt = update(TrackingEntry).where(
-            TrackingEntry.kit_id == entry.kit_id).values(meals=entry.meals)
-        updt = db.session.execute(stmt)
-        db.session.commit()
 
-        #TrackingEntry.kit_id == kit_id, ).values(meals=entry.meals)
-        #print(f"responseeeee.....{response}")
-        # db.session.commit()
-        return jsonify({"success": entry.meals})
-    except Exception as e:
-        logging.error(f"Error saving meal data: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+@route('/save-meal', methods=['POST'])
+def save_meal():
+    if 'kit_id' not in session:
+        return jsonify({"success": False, "error": "Not logged in"}), 401
+    data = request.json
+    return _save('meal', data.get('kitId'), data)
 
 
-@app.route('/save-stool', methods=['POST'])
+@route('/save-stool', methods=['POST'])
 def save_stool():
     data = request.json
-    kit_id = data.get('kitId')
+    return _save('stool', data.get('kitId'), data)
 
-    try:
-        today = datetime.now().date()
-        current_time = datetime.now().time()
-        reset_time = time(3, 0)  # 3 AM reset time
-
-        # If it's before reset time, we should look at yesterday's entry
-        if current_time < reset_time:
-            today = today - timedelta(days=1)
-
-        # Get today's entry
-        entry = TrackingEntry.query.filter_by(kit_id=kit_id,
-                                              date=today).first()
-
-        if not entry:
-            entry = TrackingEntry(
-                kit_id=kit_id,
-                date=today,
-                stool_entries=[]  # Initialize empty list for stool entries
-            )
-            db.session.add(entry)
-
-        # Initialize stool_entries if None
-        if entry.stool_entries is None:
-            entry.stool_entries = []
-
-        # Create new stool entry with timestamp
-        new_stool_entry = {
-            'type': data.get('type'),
-            'timestamp': datetime.now().isoformat(),
-            'details': {
-                'relief': data.get('relief'),
-                'smell': data.get('smell')
-            }
-        }
 
-        # Append new entry to the list
-        entry.stool_entries.append(new_stool_entry)
+@route('/api/sync', methods=['POST'])
+def api_sync():
+    # Applies a batch of queued offline saves in one transaction
+    if 'kit_id' not in session:
+        return jsonify({"success": False, "error": "Not logged in"}), 401
 
-        # Update streak
-        entry.update_streak()
+    events = (request.get_json(silent=True) or {}).get('events')
+    if not isinstance(events, list) or len(events) > tracking.SYNC_MAX_BATCH:
+        return jsonify({
+            "success": False,
+            "error": f"Expected a list of at most {tracking.SYNC_MAX_BATCH} events"
+        }), 400
 
-        stmt1 = update(TrackingEntry).where(
-            TrackingEntry.kit_id == entry.kit_id).values(
-                stool_entries=entry.stool_entries)
-        updt1 = db.session.execute(stmt1)
+    try:
+        results = tracking.apply_batch(session['kit_id'], events)
         db.session.commit()
-        return jsonify({"success": True})
+        return jsonify({"success": True, "results": results})
     except Exception as e:
-        logging.error(f"Error saving stool data: {str(e)}")
+        db.session.rollback()
+        logging.error("Error syncing events: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-@app.route('/track/stool')
+@route('/sw.js')
+def service_worker():
+    # Served from the root so the worker's scope covers the save endpoints.
+    # The asset manifest is injected so every deploy changes the worker's
+    # bytes, which is what makes browsers install the new version
+    manifest = current_app.config["ASSET_MANIFEST"]
+    precache = [
+        url_for('static', filename=name) for name in manifest['assets']
+    ]
+    with open(os.path.join(current_app.static_folder, 'js', 'sw.js')) as f:
+        script = f.read()
+    body = 'self.__ASSET_MANIFEST__ = {};\n{}'.format(
+        json.dumps({
+            'version': manifest['version'],
+            'precache': precache
+        }), script)
+
+    response = current_app.response_class(body, mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
+
+
+@route('/track/stool')
 def track_stool():
     if 'kit_id' not in session:
         return redirect(url_for('index'))
 
-    today = datetime.now().date()
-    current_time = datetime.now().time()
-    reset_time = time(3, 0)  # 3 AM reset time
-
-    # If it's before reset time, we should look at yesterday's entry
-    if current_time < reset_time:
-        today = today - timedelta(days=1)
-
     # Get today's entry
-    entry = TrackingEntry.query.filter_by(kit_id=session['kit_id'],
-                                          date=today).first()
+    entry = TrackingEntry.get_for_day(session['kit_id'])
 
     # If it's after reset time but before noon, treat as new day
-    is_new_day = current_time >= reset_time and current_time <= time(12, 0)
+    is_new_day = in_new_day_window()
 
     # During new day, don't require breakfast and allow new stool entry
     if is_new_day:
@@ -286,97 +350,65 @@ def track_stool():
     return render_template('track_stool.html')
 
 
-@app.route('/dashboard')
+@route('/dashboard')
 def dashboard():
     if 'kit_id' not in session:
         return redirect(url_for('index'))
 
-    today = datetime.now().date()
-    current_time = datetime.now().time()
-    reset_time = time(3, 0)  # 3 AM reset time
-
-    # If it's before reset time, we should look at yesterday's entry
-    if current_time < reset_time:
-        today = today - timedelta(days=1)
-
-    # Get today's entry
-    entry = TrackingEntry.query.filter_by(kit_id=session['kit_id'],
-                                          date=today).first()
+    status = get_today_status(session['kit_id'])
+    streak_info = status['streak']
 
-    # Check if it's a new day (after reset time and before noon)
-    is_new_day = current_time >= reset_time and current_time <= time(12, 0)
+    return render_template('dashboard.html',
+                           mood_logged=status['mood_logged'],
+                           breakfast_logged=status['breakfast_logged'],
+                           lunch_logged=status['lunch_logged'],
+                           dinner_logged=status['dinner_logged'],
+                           stool_logged=status['stool_logged'],
+                           lifestyle_logged=status['lifestyle_logged'],
+                           current_streak=streak_info['current_streak'],
+                           best_streak=streak_info['best_streak'],
+                           next_milestone=streak_info['next_milestone'],
+                           achievement_unlocked=streak_info['achievement_unlocked'])
 
-    # Initialize meals dictionary
-    meals = entry.meals if entry and entry.meals else {}
 
-    # Check meal logging status
-    breakfast_logged = 'breakfast' in meals
-    lunch_logged = 'lunch' in meals
-    dinner_logged = 'dinner' in meals
+def today_etag(status):
+    # Also used by the ASGI tier, so either one answers a revalidation
+    return hashlib.sha1(json.dumps(status, sort_keys=True).encode()).hexdigest()
 
-    # Reset unlogged meals during new day
-    if is_new_day and not breakfast_logged:
-        lunch_logged = False
-        dinner_logged = False
 
-    stool_logged = bool(entry and entry.stool_entries)
-    lifestyle_logged = bool(entry and entry.lifestyle_log)
-    mood_logged = bool(entry and entry.mood_details)
+@route('/api/today')
+def api_today():
+    if 'kit_id' not in session:
+        return jsonify({"success": False, "error": "Not logged in"}), 401
 
-    # Get streak information
-    streak_info = TrackingEntry.get_user_streaks(session['kit_id'])
-    current_streak = streak_info['current_streak']
-    best_streak = streak_info['best_streak']
-    achievement_unlocked = streak_info['achievement_unlocked']
+    status = get_today_status(session['kit_id'])
+    response = jsonify(status)
+    # Clients revalidate on every refresh and get a bodiless 304 when nothing changed
+    response.set_etag(today_etag(status))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
-    # Calculate next milestone
-    milestones = [7, 30, 100]
-    next_milestone = next((m for m in milestones if m > current_streak),
-                          milestones[-1])
 
-    return render_template('dashboard.html',
-                           mood_logged=mood_logged,
-                           breakfast_logged=breakfast_logged,
-                           lunch_logged=lunch_logged,
-                           dinner_logged=dinner_logged,
-                           stool_logged=stool_logged,
-                           lifestyle_logged=lifestyle_logged,
-                           current_streak=current_streak,
-                           best_streak=best_streak,
-                           next_milestone=next_milestone,
-                           achievement_unlocked=achievement_unlocked)
-
-
-@app.route('/')
+@route('/')
 def index():
     if 'kit_id' in session:
         return redirect(url_for('dashboard'))
     return render_template('index.html')
 
 
-@app.route('/track/meal/<meal_type>')
+@route('/track/meal/<meal_type>')
 def track_meal(meal_type):
-    print("meal_type:", meal_type)
     if 'kit_id' not in session:
         return redirect(url_for('index'))
 
     if meal_type not in ['breakfast', 'lunch', 'dinner']:
         return redirect(url_for('dashboard'))
 
-    today = datetime.now().date()
-    current_time = datetime.now().time()
-    reset_time = time(3, 0)  # 3 AM reset time
-
-    # If it's before reset time, we should look at yesterday's entry
-    if current_time < reset_time:
-        today = today - timedelta(days=1)
-
     # Get today's entry
-    entry = TrackingEntry.query.filter_by(kit_id=session['kit_id'],
-                                          date=today).first()
+    entry = TrackingEntry.get_for_day(session['kit_id'])
 
     # If it's after reset time but before noon, treat as new day
-    is_new_day = current_time >= reset_time and current_time <= time(12, 0)
+    is_new_day = in_new_day_window()
 
     # During new day (after reset time and before noon), allow breakfast
     if is_new_day and meal_type == 'breakfast':
@@ -402,14 +434,14 @@ def track_meal(meal_type):
     return render_template('track_meal.html', meal_type=meal_type)
 
 
-@app.route('/track/mood')
+@route('/track/mood')
 def track_mood():
     if 'kit_id' not in session:
         return redirect(url_for('index'))
     return render_template('track_mood.html')
 
 
-@app.route('/get-menu-data')
+@route('/get-menu-data')
 def get_menu_data():
     meal_type = request.args.get('meal_type')
 
@@ -417,182 +449,68 @@ def get_menu_data():
         logging.debug("No meal type provided in get-menu-data request")
         return jsonify({"error": "No meal type provided"}), 400
 
-    # Get current date considering reset time
-    current_time = datetime.now().time()
-    reset_time = time(3, 0)
-    current_date = datetime.now().date()
-
-    # If before reset time, use previous day's menu
-    if current_time < reset_time:
-        current_date = current_date - timedelta(days=1)
-
-    logging.debug(f"Fetching menu data for date: {current_date}")
-    daily_menu = DailyMenu.get_menu_for_date(current_date)
-
-    # Default menu data if no menu is set for today
-    default_menu_data = {
-        "breakfast": {
-            "Beverages": {
-                "Coffee": {},
-                "Tea": {},
-                "Water": {}
-            },
-            "Cereals": {
-                "Oatmeal": {},
-                "Granola": {},
-                "Muesli": {}
-            },
-            "Protein": {
-                "Eggs": {},
-                "Greek Yogurt": {},
-                "Tofu Scramble": {}
-            }
-        },
-        "lunch": {
-            "Main Course": {
-                "Grilled Chicken": {},
-                "Vegetable Stir Fry": {},
-                "Quinoa Bowl": {}
-            },
-            "Sides": {
-                "Mixed Salad": {},
-                "Steamed Vegetables": {},
-                "Brown Rice": {}
-            }
-        },
-        "dinner": {
-            "Main Course": {
-                "Baked Fish": {},
-                "Lentil Curry": {},
-                "Tofu Steak": {}
-            },
-            "Sides": {
-                "Roasted Vegetables": {},
-                "Quinoa": {},
-                "Sweet Potato": {}
-            }
-        }
-    }
-
-    if daily_menu and daily_menu.menu_data:
-        logging.debug(f"Found menu data for date {current_date}: {daily_menu.menu_data}")
-        return jsonify({"menu_data": daily_menu.menu_data})
+    if meal_type not in MEAL_TYPES:
+        return jsonify({"error": "Invalid meal type"}), 400
 
-    logging.debug(f"No menu data found for date: {current_date}, returning default menu")
-    return jsonify({"menu_data": default_menu_data})
-
-
-@app.route('/validate-kit/<kit_id>', methods=['GET', 'POST'])
+    # Get current date considering reset time
+    current_date = get_study_day()
+
+    # Served from the per-worker cache; only a stale cache entry costs a query
+    menu = menu_service.get_menu(current_date)
+    etag = menu.etags[meal_type]
+    # Weak comparison, since compressed responses carry the ETag as weak
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        logging.debug("Serving %s menu for date: %s", meal_type, current_date)
+        response = current_app.response_class(menu.bodies[meal_type],
+                                      mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = menu_service.MENU_CACHE_CONTROL
+    return response
+
+
+@route('/validate-kit/<kit_id>', methods=['GET', 'POST'])
 def validate_kit(kit_id):
-    logging.debug(f"Validating kit ID: {kit_id}")
+    logging.debug("Validating kit ID: %s", kit_id)
 
     try:
-        # Check if it's an admin code
-        admin = Admin.query.filter_by(username=kit_id).first()
-        if admin and admin.is_active:
-            session['admin_id'] = admin.id
-            logging.debug(f"Admin login successful for: {kit_id}")
+        # Admin, kit, participant and last tracked day in one round trip
+        state = kit_codes.load_login_state(kit_id)
+        if state.admin_id is not None:
+            session['admin_id'] = state.admin_id
+            logging.debug("Admin login successful for: %s", kit_id)
             return jsonify({"valid": True, "is_admin": True})
 
-        # Check if kit code exists and is active
-        kit_code = KitCode.query.filter_by(code=kit_id, is_active=True).first()
-        logging.debug(f"Kit code found: {kit_code is not None}")
-
-        if not kit_code:
-            logging.debug(f"Kit code {kit_id} not found or inactive")
+        if not state.kit_active:
+            logging.debug("Kit code %s not found or inactive", kit_id)
             return jsonify({
                 "valid": False,
                 "error": "Invalid or inactive kit code"
             })
 
-        # Check if user exists or create new one
-        user = AnonymousUser.query.filter_by(kit_id=kit_id).first()
-        logging.debug(f"User found: {user is not None}")
-
-        if not user:
-            # Create new anonymous user
-            user = AnonymousUser(kit_id=kit_id)
-            db.session.add(user)
-            db.session.commit()
-            logging.debug(f"Created new anonymous user for kit ID: {kit_id}")
-
-        # Generate username
-        username = f"{kit_id}"
-        if not user.name:
-            user.name = username
-            db.session.commit()
-            logging.debug(f"Updated username : {username}")
+        username = kit_codes.register_participant(kit_id, state)
 
         # Store in session
         session['kit_id'] = kit_id
         session['username'] = username
 
-        # Check tracking status
-        today = datetime.now().date()
-        entry = TrackingEntry.query.filter_by(kit_id=kit_id,
-                                              date=today).first()
-        last_entry = None if entry else TrackingEntry.query.filter_by(
-            kit_id=kit_id).order_by(TrackingEntry.date.desc()).first()
-
-        response_data = {
-            "valid":
-            True,
-            "is_admin":
-            False,
-            "username":
-            username,
-            "has_tracked":
-            entry is not None,
-            "has_previous_entries":
-            last_entry is not None,
-            "last_entry_date":
-            last_entry.date.strftime('%Y-%m-%d') if last_entry else None,
-            "show_username_warning":
-            True
-        }
-        logging.debug(f"Validation successful. Response data: {response_data}")
+        response_data = kit_codes.login_response(username, state)
+        logging.debug("Validation successful. Response data: %s", response_data)
         return jsonify(response_data)
 
     except Exception as e:
-        logging.error(f"Error during kit validation: {str(e)}")
+        logging.error("Error during kit validation: %s", e)
         return jsonify({"valid": False, "error": "Internal server error"}), 500
 
 
-@app.route('/save-mood', methods=['POST'])
+@route('/save-mood', methods=['POST'])
 def save_mood():
     data = request.json
-    kit_id = data.get('kitId')
-    mood_data = data.get('mood', {})
-
-    try:
-        entry = TrackingEntry.query.filter_by(
-            kit_id=kit_id, date=datetime.now().date()).first()
-
-        if not entry:
-            entry = TrackingEntry(kit_id=kit_id, date=datetime.now().date())
-            db.session.add(entry)
-
-        # Calculate overall mood average
-        mood_values = [
-            mood_data.get('morning_mood', 0),
-            mood_data.get('meal_mood', 0),
-            mood_data.get('energy_level', 0),
-            mood_data.get('evening_mood', 0),
-            mood_data.get('overall_mood', 0)
-        ]
-        non_zero_values = [v for v in mood_values if v != 0]
-        entry.mood = sum(non_zero_values) / len(
-            non_zero_values) if non_zero_values else 0
-        entry.mood_details = mood_data
-
-        db.session.commit()
-        return jsonify({"success": True})
-    except Exception as e:
-        logging.error(f"Error saving mood data: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+    return _save('mood', data.get('kitId'), data)
 
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -611,7 +529,7 @@ def admin_login():
     return render_template('admin/login.html')
 
 
-@app.route('/admin/logout')
+@route('/admin/logout')
 @admin_required
 def admin_logout():
     session.pop('admin_id', None)
@@ -619,89 +537,180 @@ def admin_logout():
     return redirect(url_for('admin_login'))
 
 
-@app.route('/admin/dashboard')
+@route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    kit_codes = KitCode.query.order_by(KitCode.created_at.desc()).all()
-    return render_template('admin/dashboard.html', kit_codes=kit_codes)
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'batch': request.args.get('batch', ''),
+        'status': request.args.get('status', '')
+    }
+    is_active = {'active': True, 'inactive': False}.get(filters['status'])
+
+    codes, next_cursor = kit_codes.browse_codes(search=filters['q'],
+                                                batch_name=filters['batch'],
+                                                is_active=is_active,
+                                                after=request.args.get('after'))
+    return render_template('admin/dashboard.html',
+                           kit_codes=codes,
+                           next_cursor=next_cursor,
+                           batches=kit_codes.batch_summaries(),
+                           filters=filters)
 
 
-@app.route('/admin/import-kit-codes', methods=['POST'])
+@route('/admin/import-kit-codes', methods=['POST'])
 @admin_required
 def import_kit_codes():
     batch_name = request.form.get('batch_name')
-    codes = request.form.get('codes').strip().split('\n')
     admin_id = session.get('admin_id')
 
-    for code in codes:
-        code = code.strip()
-        if code:
-            kit_code = KitCode(code=code,
-                               batch_name=batch_name,
-                               created_by=admin_id)
-            db.session.add(kit_code)
+    # Prefer a streamed file upload, fall back to the textarea
+    codes_file = request.files.get('codes_file')
+    if codes_file and codes_file.filename:
+        codes = kit_codes.iter_uploaded_codes(codes_file.stream)
+    else:
+        codes = kit_codes.iter_text_codes(request.form.get('codes'))
 
-    db.session.commit()
-    flash(f'Successfully imported {len(codes)} kit codes.', 'success')
+    result = kit_codes.provision_codes(codes, batch_name, admin_id)
+    flash(f'Imported kit codes: {result.summary()}.', 'success')
     return redirect(url_for('admin_dashboard'))
 
 
-@app.route('/admin/generate-kit-codes', methods=['POST'])
+@route('/admin/generate-kit-codes', methods=['POST'])
 @admin_required
 def generate_kit_codes():
     batch_name = request.form.get('batch_name')
     quantity = int(request.form.get('quantity', 10))
     admin_id = session.get('admin_id')
 
-    for _ in range(quantity):
-        code = str(uuid.uuid4())
-        kit_code = KitCode(code=code,
-                           batch_name=batch_name,
-                           created_by=admin_id)
-        db.session.add(kit_code)
-
-    db.session.commit()
-    flash(f'Successfully generated {quantity} new kit codes.', 'success')
+    result = kit_codes.generate_codes(quantity, batch_name, admin_id)
+    flash(f'Successfully generated {result.inserted} new kit codes.',
+          'success')
     return redirect(url_for('admin_dashboard'))
 
 
-@app.route('/admin/toggle-kit-code/<int:code_id>', methods=['POST'])
+@route('/admin/toggle-kit-code/<int:code_id>', methods=['POST'])
 @admin_required
 def toggle_kit_code(code_id):
     kit_code = KitCode.query.get_or_404(code_id)
     kit_code.is_active = not kit_code.is_active
     db.session.commit()
+    kit_codes.invalidate_active_codes(kit_code.code)
 
     status = 'activated' if kit_code.is_active else 'deactivated'
     flash(f'Kit code {kit_code.code} has been {status}.', 'success')
     return redirect(url_for('admin_dashboard'))
 
 
+@route('/admin/export/<table>.<export_format>')
+@admin_required
+def export_data(table, export_format):
+    if table not in export.EXPORT_TABLES or export_format not in export.EXPORT_FORMATS:
+        return jsonify({"success": False, "error": "Unknown export"}), 404
+
+    filename = f'{table}-{get_study_day().isoformat()}.{export_format}'
+    if export_format == 'csv':
+        # Streamed chunk by chunk, so the worker never holds the full export
+        return Response(stream_with_context(export.iter_csv(table)),
+                        mimetype='text/csv',
+                        headers={
+                            'Content-Disposition':
+                            f'attachment; filename={filename}'
+                        })
+
+    # Parquet needs its footer written last, so it is spooled to disk first
+    try:
+        output = tempfile.TemporaryFile()
+        export.write_parquet(table, output)
+    except export.ExportError as e:
+        output.close()
+        return jsonify({"success": False, "error": str(e)}), 501
+    output.seek(0)
+    return send_file(output,
+                     mimetype='application/vnd.apache.parquet',
+                     as_attachment=True,
+                     download_name=filename)
+
+
+@route('/admin/analysis/correlations')
+@admin_required
+def admin_correlations():
+    import analysis
+    cohort = request.args.get('cohort') or None
+    try:
+        alpha = float(request.args.get('alpha', analysis.FDR_ALPHA))
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid alpha"}), 400
+
+    results = analysis.cohort_correlations(cohort)
+    return jsonify({
+        "success": True,
+        "cohort": cohort,
+        "tests": len(results),
+        "correlations": analysis.significant(results, alpha)
+    })
+
+
+@route('/admin/predictions')
+@admin_required
+def admin_predictions():
+    import prediction
+    results = prediction.score_active_kits()
+    return jsonify({"success": True, "predictions": results})
+
+
+@route('/metrics')
+def prometheus_metrics():
+    # Scrapers authenticate with METRICS_TOKEN, people with an admin login
+    if 'admin_id' not in session and not metrics.token_matches(
+            request.headers.get('Authorization')):
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    return Response(metrics.render(db.engine), content_type=metrics.CONTENT_TYPE)
+
+
+def community_comparison(mood_level, community_stats):
+    # Only shown with enough participants, and once both the participant and
+    # the community have a mood for the day; stools alone leave avg_mood empty
+    if (not community_stats or (community_stats.total_participants or 0) <= 10
+            or community_stats.avg_mood is None or mood_level is None):
+        return None
+    mood_diff = mood_level - community_stats.avg_mood
+    mood_comparison = ("above average" if mood_diff > 0.5 else
+                       "below average" if mood_diff < -0.5 else "about average")
+    return {
+        'mood_comparison': mood_comparison,
+        'community_avg_mood': round(community_stats.avg_mood, 1),
+        'total_participants': community_stats.total_participants
+    }
+
+
 # This remains for backward compatibility, but should be deprecated eventually
-@app.route('/insights/<kit_id>')
+@route('/insights/<kit_id>')
 def get_insights(kit_id):
-    from models import TrackingEntry, CommunityStats
-
     # Get date range (last 7 days)
-    end_date = datetime.now()
+    end_date = get_study_day()
     start_date = end_date - timedelta(days=7)
 
     # Fetch entries for the last 7 days
     entries = TrackingEntry.query.filter(
-        TrackingEntry.kit_id == kit_id, TrackingEntry.date >= start_date,
-        TrackingEntry.date <= end_date).order_by(TrackingEntry.date).all()
+        TrackingEntry.kit_id == kit_id, TrackingEntry.study_day >= start_date,
+        TrackingEntry.study_day <= end_date).order_by(
+            TrackingEntry.study_day).all()
 
     if not entries:
         return render_template('insights.html', has_data=False)
 
+    latest_stools = StoolEvent.latest_by_day(kit_id, start_date, end_date)
+
     # Prepare trend data
     trend_data = {'dates': [], 'moods': [], 'stool_types': []}
 
     for entry in entries:
-        trend_data['dates'].append(entry.date.strftime('%Y-%m-%d'))
+        stool = latest_stools.get(entry.study_day)
+        trend_data['dates'].append(entry.study_day.strftime('%Y-%m-%d'))
         trend_data['moods'].append(entry.mood)
         trend_data['stool_types'].append(
-            int(entry.stool_type) if entry.stool_type else 0)
+            (stool.bristol_type or 0) if stool else 0)
 
     # Get today's latest entry for detailed insights
     latest_entry = entries[-1] if entries else None
@@ -730,7 +739,8 @@ def get_insights(kit_id):
             mood_level, "No mood data available.")
 
         # Stool health analysis
-        stool_type = latest_entry.stool_type
+        latest_stool = latest_stools.get(latest_entry.study_day)
+        stool_type = str(latest_stool.bristol_type) if latest_stool else None
         stool_insights = {
             '1':
             "Your stool is very hard and separate, indicating possible dehydration.",
@@ -769,20 +779,10 @@ def get_insights(kit_id):
         ]
 
         # Get community stats for comparison
-        today = datetime.now().date()
-        community_stats = CommunityStats.query.filter_by(date=today).first()
-
-        if community_stats and community_stats.total_participants > 10:  # Only show if enough participants
-            mood_diff = mood_level - community_stats.avg_mood
-            mood_comparison = (
-                "above average" if mood_diff > 0.5 else
-                "below average" if mood_diff < -0.5 else "about average")
-
-            insights['community_comparison'] = {
-                'mood_comparison': mood_comparison,
-                'community_avg_mood': round(community_stats.avg_mood, 1),
-                'total_participants': community_stats.total_participants
-            }
+        community_stats = CommunityStats.query.filter_by(
+            date=get_study_day()).first()
+        insights['community_comparison'] = community_comparison(
+            mood_level, community_stats)
 
     # Check if this is a new submission
     show_trends = request.args.get('new_submission') == 'true'
@@ -793,7 +793,7 @@ def get_insights(kit_id):
                            trend_data=trend_data if show_trends else None)
 
 
-@app.route('/save-tracking', methods=['POST'])
+@route('/save-tracking', methods=['POST'])
 def save_tracking():
     #This function is now redundant and can be removed.  The new endpoints handle the individual data points.
     return jsonify({
@@ -802,23 +802,26 @@ def save_tracking():
     }), 405
 
 
-@app.route('/insights')
+INSIGHTS_DEFAULT_WINDOW = 7
+INSIGHTS_MAX_WINDOW = 365
+INSIGHTS_WINDOWS = (7, 30, 90)
+
+
+@route('/insights')
 def insights():
     if 'kit_id' not in session:
         return redirect(url_for('index'))
 
-    # Get date range (last 7 days)
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=7)
-
-    # Fetch entries for the last 7 days
-    entries = TrackingEntry.query.filter(
-        TrackingEntry.kit_id == session['kit_id'], TrackingEntry.date
-        >= start_date, TrackingEntry.date
-        <= end_date).order_by(TrackingEntry.date).all()
+    # Charts read the narrow DailyRollup rows, so a long window costs about
+    # the same as a week
+    window = request.args.get('window', INSIGHTS_DEFAULT_WINDOW, type=int)
+    window = min(max(window or INSIGHTS_DEFAULT_WINDOW, 1), INSIGHTS_MAX_WINDOW)
+    end_date = get_study_day()
+    start_date = end_date - timedelta(days=window)
 
-    if not entries:
-        return render_template('insights.html', has_data=False)
+    days = DailyRollup.for_window(session['kit_id'], start_date, end_date)
+    if not days:
+        return render_template('insights.html', has_data=False, window=window)
 
     # Prepare trend data
     trend_data = {
@@ -831,65 +834,50 @@ def insights():
         'dinner_counts': []
     }
 
-    for entry in entries:
-        date_str = entry.date.strftime('%Y-%m-%d')
-        trend_data['dates'].append(date_str)
-        trend_data['moods'].append(entry.mood if entry.mood else 0)
-
-        # Handle multiple stool entries
-        if entry.stool_entries:
-            # Get the most recent stool entry for the day
-            latest_stool = entry.stool_entries[-1]
-            trend_data['stool_types'].append(
-                int(latest_stool['type']) if latest_stool.get('type') else 0)
-            trend_data['stool_entries'].append(latest_stool)
+    for day in days:
+        trend_data['dates'].append(day.study_day.strftime('%Y-%m-%d'))
+        trend_data['moods'].append(day.mood if day.mood else 0)
+
+        # Use the most recent stool event for the day
+        if day.last_stool_at:
+            trend_data['stool_types'].append(day.last_bristol_type or 0)
+            trend_data['stool_entries'].append({
+                'type': str(day.last_bristol_type)
+                if day.last_bristol_type else None,
+                'timestamp': day.last_stool_at.isoformat(),
+                'details': {
+                    'relief': day.last_relief,
+                    'smell': day.last_smell
+                }
+            })
         else:
             trend_data['stool_types'].append(0)
             trend_data['stool_entries'].append(None)
 
-        # Count items in each meal
-        meals = entry.meals or {}
-        breakfast_items = sum(
-            len(items) for category in meals.get('breakfast', {}).values()
-            for items in (
-                category if isinstance(category, list) else [category.keys()]))
-        lunch_items = sum(
-            len(items) for category in meals.get('lunch', {}).values()
-            for items in (
-                category if isinstance(category, list) else [category.keys()]))
-        dinner_items = sum(
-            len(items) for category in meals.get('dinner', {}).values()
-            for items in (
-                category if isinstance(category, list) else [category.keys()]))
-
-        trend_data['breakfast_counts'].append(breakfast_items)
-        trend_data['lunch_counts'].append(lunch_items)
-        trend_data['dinner_counts'].append(dinner_items)
+        trend_data['breakfast_counts'].append(day.breakfast_items or 0)
+        trend_data['lunch_counts'].append(day.lunch_items or 0)
+        trend_data['dinner_counts'].append(day.dinner_items or 0)
 
     return render_template('insights.html',
                            has_data=True,
-                           trend_data=trend_data)
+                           trend_data=trend_data,
+                           window=window,
+                           windows=INSIGHTS_WINDOWS)
 
 
-@app.route('/test-reset')
+@route('/test-reset')
 def test_reset():
     if 'kit_id' not in session:
         return redirect(url_for('index'))
 
     current_time = datetime.now().time()
-    reset_time = time(3, 0)
-    current_date = datetime.now().date()
-
-    # If before reset time, use previous day
-    if current_time < reset_time:
-        current_date = current_date - timedelta(days=1)
+    current_date = get_study_day()
 
     # Check if it's a new day (after reset, before noon)
-    is_new_day = current_time >= reset_time and current_time <= time(12, 0)
+    is_new_day = in_new_day_window()
 
     # Get today's entry
-    entry = TrackingEntry.query.filter_by(kit_id=session['kit_id'],
-                                          date=current_date).first()
+    entry = TrackingEntry.get_for_day(session['kit_id'], current_date)
 
     # Get tracking status
     meals = entry.meals if entry else {}
@@ -897,7 +885,7 @@ def test_reset():
         'current_time':
         current_time.strftime('%H:%M:%S'),
         'reset_time':
-        reset_time.strftime('%H:%M:%S'),
+        RESET_TIME.strftime('%H:%M:%S'),
         'current_date':
         current_date.strftime('%Y-%m-%d'),
         'is_new_day':
@@ -912,7 +900,8 @@ def test_reset():
         'dinner' in meals if not is_new_day or
         ('breakfast' in meals and 'lunch' in meals) else False,
         'stool_logged':
-        bool(entry and entry.stool_entries and not is_new_day),
+        bool(not is_new_day
+             and StoolEvent.exists_for_day(session['kit_id'], current_date)),
         'mood_logged':
         bool(entry and entry.mood and not is_new_day),
         'lifestyle_logged':
@@ -922,7 +911,7 @@ def test_reset():
     return jsonify(tracking_status)
 
 
-@app.route('/admin/set-daily-menu', methods=['POST'])
+@route('/admin/set-daily-menu', methods=['POST'])
 @admin_required
 def set_daily_menu():
     try:
@@ -930,27 +919,66 @@ def set_daily_menu():
         if not menu_data:
             return jsonify({"success": False, "error": "Menu data is required"}), 400
 
-        current_date = datetime.now().date()
+        current_date = get_study_day()
 
-        # Check if menu already exists for today
-        daily_menu = DailyMenu.get_menu_for_date(current_date)
-        if daily_menu:
-            stmt = update(DailyMenu).where(
-                DailyMenu.date == current_date).values(meals=menu_data)
-            updt = db.session.execute(stmt)
-        else:
-            daily_menu = DailyMenu(
-                date=current_date,
-                menu_data=menu_data,
-                created_by=session['admin_id']
-            )
-            db.session.add(daily_menu)
-        
-        
+        # Updates today's menu or creates it, bumping its version stamp
+        menu_service.set_menu(current_date, menu_data, session['admin_id'])
+        FoodItem.sync_from_menu(menu_data)
         db.session.commit()
+        menu_service.invalidate(current_date)
         return jsonify({"success": True})
     except Exception as e:
-        logging.error(f"Error setting daily menu: {str(e)}")
+        logging.error("Error setting daily menu: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
+def create_app(config=None):
+    """Build the app without touching the database.
+
+    Tables are created by ``flask db-init`` and the first admin by
+    ``flask seed-admin``, so booting a worker is only Python imports.
+    """
+    # Level, format and debug sampling come from LOG_* environment variables
+    logging_config.configure()
+
+    app = Flask(__name__)
+    app.secret_key = os.environ.get(
+        "FLASK_SECRET_KEY") or "health_tracking_secret_key"
+    db_url = database_url()
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+        # Times how long requests wait for a pooled connection
+        **metrics.engine_options(db_url),
+    }
+    # Content hashes of the static files, used for cache-busting URLs and the
+    # service worker precache
+    app.config["ASSET_MANIFEST"] = assets.load_manifest(app.static_folder)
+    app.config.update(config or {})
+
+    db.init_app(app)
+
+    # jsonify and request.get_json go through orjson when it is installed
+    app.json = responses.JSONProvider(app)
+    # Opt-in with WRITE_BEHIND=1
+    write_behind.init_app(app)
+
+    app.before_request(start_request_log)
+    # Registered first so it runs last and its latency includes the other hooks
+    app.after_request(finish_request_log)
+    app.before_request(start_request_metrics)
+    app.after_request(finish_request_metrics)
+    app.url_defaults(add_asset_version)
+    app.after_request(cache_versioned_assets)
+    app.after_request(compress)
+
+    for rule, options, view in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    for command in commands.commands.values():
+        app.cli.add_command(command)
+    return app
+
+
+app = create_app()
+
 if __name__ == "__main__": app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
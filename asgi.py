@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie, parse_etags
+from database import db
+from models import get_today_status
+import logging_config
+import metrics
+import tracking
+import write_behind
+from app import app as flask_app, today_etag
+
+# Threads doing database work; more than the pool size would only queue on
+# the pool instead of here
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 5))
+# Requests waiting for a thread before new ones get a 503
+ASYNC_MAX_PENDING = int(os.environ.get('ASYNC_MAX_PENDING', 5000))
+ASYNC_MAX_BODY = int(os.environ.get('ASYNC_MAX_BODY', 1024 * 1024))
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, body, headers=()):
+        super().__init__(body.get('error'))
+        self.status = status
+        self.body = body
+        self.headers = list(headers)
+
+
+class Request:
+
+    def __init__(self, app, scope, body):
+        self.app = app
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope['headers']
+        }
+        self.body = body
+
+    def json(self):
+        # Mirrors request.json: a JSON content type is required
+        if 'json' not in self.headers.get('content-type', ''):
+            raise HTTPError(415, {
+                "success": False,
+                "error": "Expected an application/json body"
+            })
+        try:
+            data = self.app.json.loads(self.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            raise HTTPError(400, {"success": False, "error": "Invalid JSON body"})
+        return data
+
+    def session(self):
+        """The Flask session, decoded with the app's own signing settings."""
+        interface = self.app.session_interface
+        cookie = parse_cookie(self.headers.get('cookie', '')).get(
+            interface.get_cookie_name(self.app))
+        serializer = interface.get_signing_serializer(self.app)
+        if not cookie or serializer is None:
+            return {}
+        max_age = int(self.app.permanent_session_lifetime.total_seconds())
+        try:
+            return serializer.loads(cookie, max_age=max_age)
+        except BadSignature:
+            return {}
+
+
+class TrackingAPI:
+    """ASGI app for the save endpoints and /api/today.
+
+    Contracts match the Flask views. An open request is only a coroutine;
+    the tracking call itself runs on a few threads sized to the database
+    pool, so a burst of saves after a communal meal waits here instead of
+    holding a worker and a connection each.
+    """
+
+    def __init__(self, flask_app, threads=ASYNC_DB_THREADS,
+                 max_pending=ASYNC_MAX_PENDING):
+        self.flask_app = flask_app
+        self.threads = threads
+        self.max_pending = max_pending
+        self.executor = None
+        self.pending = 0
+        self.routes = {
+            ('POST', '/save-meal'): self.save_meal,
+            ('POST', '/save-stool'): self.save_stool,
+            ('POST', '/save-mood'): self.save_mood,
+            ('POST', '/save-lifestyle'): self.save_lifestyle,
+            ('GET', '/api/today'): self.today,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.threads,
+                                               thread_name_prefix='asgi-db')
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def run_sync(self, fn, *args):
+        """Run ``fn`` in an app context on one of the database threads."""
+        if self.pending >= self.max_pending:
+            raise HTTPError(503, {
+                "success": False,
+                "error": "Server busy, retry shortly"
+            }, [('retry-after', '1')])
+        self.startup()
+
+        def call():
+            with self.flask_app.app_context():
+                return fn(*args)
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, call)
+        finally:
+            self.pending -= 1
+
+    async def handle(self, scope, receive, send):
+        started = perf_counter()
+        request_id = dict(scope['headers']).get(b'x-request-id', b'').decode(
+            'latin-1')
+        if not request_id or len(request_id) > logging_config.REQUEST_ID_MAX_LENGTH:
+            request_id = uuid.uuid4().hex
+        view = self.routes.get((scope['method'], scope['path']))
+
+        headers = []
+        try:
+            if view is None:
+                raise HTTPError(404, {"success": False, "error": "Not found"})
+            body = await read_body(receive)
+            status, payload, headers = await view(Request(self.flask_app, scope, body))
+        except HTTPError as e:
+            status, payload, headers = e.status, e.body, e.headers
+        except Exception as e:
+            logging.error("Error handling %s: %s", scope['path'], e,
+                          extra={'request_id': request_id})
+            status, payload = 500, {"success": False, "error": str(e)}
+
+        content = b'' if payload is None else self.flask_app.json.dumps(
+            payload).encode()
+        headers = [(name.encode('latin-1'), value.encode('latin-1'))
+                   for name, value in headers]
+        headers.append((b'x-request-id', request_id.encode('latin-1')))
+        if payload is not None:
+            headers += [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(content)).encode())]
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+        seconds = perf_counter() - started
+        metrics.record_request(scope['path'] if view else '<unmatched>',
+                               scope['method'], status, seconds)
+        if logging_config.LOG_ACCESS:
+            logging_config.access_log.info('%s %s %s',
+                                           scope['method'],
+                                           scope['path'],
+                                           status,
+                                           extra={
+                                               'request_id': request_id,
+                                               'method': scope['method'],
+                                               'status': status,
+                                               'latency_ms': round(seconds * 1000, 2)
+                                           })
+
+    async def save(self, kind, kit_id, request, payload):
+        # Same contract as app._save, including the Idempotency-Key header
+        event_id = request.headers.get('idempotency-key')
+        if event_id and len(event_id) > tracking.EVENT_ID_MAX_LENGTH:
+            return 400, {"success": False, "error": "Invalid idempotency key"}, []
+        buffer = self.flask_app.extensions.get('write_behind')
+        if buffer is not None:
+            body, status = await self.run_sync(buffer.accept, kit_id, kind,
+                                               payload, event_id)
+            return status, body, list(write_behind.headers(status).items())
+        body, status = await self.run_sync(apply_event, kind, kit_id, payload,
+                                           event_id)
+        return status, body, []
+
+    async def save_meal(self, request):
+        if 'kit_id' not in request.session():
+            raise HTTPError(401, {"success": False, "error": "Not logged in"})
+        data = request.json()
+        return await self.save('meal', data.get('kitId'), request, data)
+
+    async def save_stool(self, request):
+        data = request.json()
+        return await self.save('stool', data.get('kitId'), request, data)
+
+    async def save_mood(self, request):
+        data = request.json()
+        return await self.save('mood', data.get('kitId'), request, data)
+
+    async def save_lifestyle(self, request):
+        session = request.session()
+        if 'kit_id' not in session:
+            raise HTTPError(401, {"success": False, "error": "Not logged in"})
+        return await self.save('lifestyle', session['kit_id'], request,
+                               request.json())
+
+    async def today(self, request):
+        session = request.session()
+        if 'kit_id' not in session:
+            raise HTTPError(401, {"success": False, "error": "Not logged in"})
+        status = await self.run_sync(get_today_status, session['kit_id'])
+        etag = today_etag(status)
+        headers = [('etag', f'"{etag}"'),
+                   ('cache-control', 'private, no-cache')]
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+            return 304, None, headers
+        return 200, status, headers
+
+
+def apply_event(kind, kit_id, payload, event_id):
+    try:
+        body, status = tracking.apply_event(kit_id, kind, payload, event_id)
+        db.session.commit()
+        return body, status
+    except Exception as e:
+        db.session.rollback()
+        logging.error("Error saving %s data: %s", kind, e)
+        return {"success": False, "error": str(e)}, 500
+
+
+async def read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise HTTPError(400, {"success": False, "error": "Client disconnected"})
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > ASYNC_MAX_BODY:
+            raise HTTPError(413, {"success": False, "error": "Request body too large"})
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+app = TrackingAPI(flask_app)
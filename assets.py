@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = 'asset-manifest.json'
+# Precached by the service worker; sw.js itself is served from /sw.js
+PRECACHE_DIRS = ('css', 'js', 'images')
+PRECACHE_FILES = ('manifest.json', )
+EXCLUDED_FILES = ('js/sw.js', MANIFEST_NAME)
+
+
+def _iter_assets(static_folder):
+    for directory in PRECACHE_DIRS:
+        root = os.path.join(static_folder, directory)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, static_folder).replace(os.sep, '/')
+    for filename in PRECACHE_FILES:
+        if os.path.exists(os.path.join(static_folder, filename)):
+            yield filename
+
+
+def build_manifest(static_folder):
+    """Hash every precached static file.
+
+    The combined version changes whenever any asset does, which renames the
+    service worker's cache and makes browsers pick up the deploy.
+    """
+    assets = {}
+    for name in sorted(_iter_assets(static_folder)):
+        if name in EXCLUDED_FILES:
+            continue
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            assets[name] = hashlib.sha256(f.read()).hexdigest()[:12]
+
+    version = hashlib.sha256(
+        json.dumps(assets, sort_keys=True).encode()).hexdigest()[:12]
+    return {'version': version, 'assets': assets}
+
+
+def write_manifest(static_folder):
+    manifest = build_manifest(static_folder)
+    with open(os.path.join(static_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    # Deploys run `flask build-assets`; without it the hashes are computed
+    # at startup so development servers still get versioned URLs
+    try:
+        with open(os.path.join(static_folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return build_manifest(static_folder)
@@ -0,0 +1,84 @@
+import os
+import sys
+import click
+
+
+def _load_app(database_url):
+    # DATABASE_URL has to be in place before app is imported
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from app import app
+    return app
+
+
+@click.group()
+def cli():
+    """Synthetic cohort and load benchmarks for the tracker routes."""
+
+
+@cli.command()
+@click.option('--database-url', envvar='DATABASE_URL',
+              help='Database to seed, e.g. sqlite:////tmp/bench.db.')
+@click.option('--participants', default=50, show_default=True)
+@click.option('--days', default=90, show_default=True)
+@click.option('--seed', 'seed_value', default=0, show_default=True)
+def seed(database_url, participants, days, seed_value):
+    """Seed an empty database with a synthetic study."""
+    app = _load_app(database_url)
+    from benchmarks import cohort
+    from database import db
+    with app.app_context():
+        # Importing the app no longer creates tables or the first admin
+        db.create_all()
+        cohort.ensure_admin()
+        cohort.seed(participants, days, seed_value, log=click.echo)
+
+
+@cli.command()
+@click.option('--database-url', envvar='DATABASE_URL')
+@click.option('--users', default=None, type=int,
+              help='Participants to drive (default: every seeded kit).')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--seed', 'seed_value', default=0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Write the JSON report here.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Earlier report to compare against.')
+@click.option('--fail-on-regression', is_flag=True)
+def run(database_url, users, concurrency, seed_value, output, baseline,
+        fail_on_regression):
+    """Drive the real routes concurrently and report latency percentiles."""
+    app = _load_app(database_url)
+    from benchmarks import cohort, driver, report
+    from database import db
+    with app.app_context():
+        kit_ids = cohort.seeded_codes()
+        dialect = db.engine.dialect.name
+    if not kit_ids:
+        raise click.ClickException('No seeded kits, run the seed command first')
+    kit_ids = kit_ids[:users] if users else kit_ids
+
+    samples, wall_seconds = driver.run(app, kit_ids, concurrency, seed_value)
+    result = report.build(
+        samples, wall_seconds, {
+            'database': dialect,
+            'users': len(kit_ids),
+            'concurrency': concurrency,
+            'seed': seed_value,
+        })
+    if output:
+        report.write(result, output)
+
+    rows, regressions = None, []
+    if baseline:
+        rows, regressions = report.compare(result, report.load(baseline))
+    click.echo(report.format_table(result, rows))
+    if regressions:
+        click.echo(f"Regressed: {', '.join(regressions)}")
+        if fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,186 @@
+import random
+from datetime import datetime, time, timedelta
+from database import db, insert_missing
+from models import (Admin, AnonymousUser, FoodItem, KitCode, LIFESTYLE_FIELDS,
+                    get_study_day)
+import kit_codes
+import menu_service
+import tracking
+
+BATCH_NAME = 'benchmark'
+KIT_PREFIX = 'BENCH'
+
+# Catalogue the synthetic menus are drawn from, shaped like DailyMenu data
+FOODS = {
+    'breakfast': {
+        'Beverages': ['Coffee', 'Tea', 'Water', 'Orange Juice', 'Kefir'],
+        'Cereals': ['Oatmeal', 'Granola', 'Muesli', 'Poha', 'Upma'],
+        'Protein': ['Eggs', 'Greek Yogurt', 'Tofu Scramble', 'Paneer'],
+        'Fruit': ['Banana', 'Papaya', 'Apple', 'Berries'],
+    },
+    'lunch': {
+        'Main Course': ['Grilled Chicken', 'Vegetable Stir Fry',
+                        'Quinoa Bowl', 'Dal', 'Rajma', 'Fish Curry'],
+        'Sides': ['Mixed Salad', 'Steamed Vegetables', 'Brown Rice',
+                  'Roti', 'Raita', 'Kimchi'],
+        'Dessert': ['No dessert', 'Fruit Salad', 'Kheer'],
+    },
+    'dinner': {
+        'Main Course': ['Baked Fish', 'Lentil Curry', 'Tofu Steak',
+                        'Khichdi', 'Chickpea Curry'],
+        'Sides': ['Roasted Vegetables', 'Quinoa', 'Sweet Potato', 'Roti',
+                  'Sauerkraut'],
+    },
+}
+# When each save happens on a simulated day
+SAVE_TIMES = {
+    'breakfast': time(8, 30),
+    'lunch': time(13, 15),
+    'dinner': time(19, 45),
+    'stool': time(9, 10),
+    'mood': time(21, 30),
+    'lifestyle': time(22, 0),
+}
+
+
+def ensure_admin():
+    # Menus and kit codes need an owner; a fresh database has no admin yet
+    if Admin.query.first() is None:
+        db.session.add(Admin(username='benchmark',
+                             password_hash='!',
+                             is_active=True))
+        db.session.commit()
+
+
+def kit_code(number):
+    return f'{KIT_PREFIX}{number:05d}'
+
+
+def daily_menu(rng):
+    # Three to five options per category, like the menus admins publish
+    return {
+        meal: {
+            category: {
+                name: {}
+                for name in rng.sample(names, min(len(names),
+                                                  rng.randint(3, 5)))
+            }
+            for category, names in categories.items()
+        }
+        for meal, categories in FOODS.items()
+    }
+
+
+def meal_selection(rng, menu, meal_type):
+    # Saved meals hold lists of names per category
+    selection = {}
+    for category, options in menu[meal_type].items():
+        names = [name for name in options if not name.startswith('No ')]
+        picked = rng.sample(names, rng.randint(0, min(2, len(names))))
+        if picked:
+            selection[category] = picked
+    return selection
+
+
+def participant_day(rng, profile, menu):
+    """Saves one participant makes on one day, as (kind, payload) pairs."""
+    saves = []
+    meals = ['breakfast', 'lunch', 'dinner']
+    # Meals are logged in order, and people often stop partway through
+    logged = rng.choices([0, 1, 2, 3], weights=[1, 1, 2, 6])[0]
+    for meal_type in meals[:logged]:
+        saves.append(('meal', {
+            'type': meal_type,
+            'foods': meal_selection(rng, menu, meal_type)
+        }))
+
+    for _ in range(rng.choices([0, 1, 2, 3], weights=[2, 5, 2, 1])[0]):
+        bristol = min(7, max(1, round(rng.gauss(profile['bristol'], 1.1))))
+        saves.append(('stool', {
+            'type': bristol,
+            'relief': rng.randint(1, 5),
+            'smell': rng.randint(1, 5)
+        }))
+
+    if rng.random() < 0.8:
+        base = profile['mood']
+        saves.append(('mood', {
+            'mood': {
+                field: min(5, max(1, round(rng.gauss(base, 0.8))))
+                for field in ['morning_mood', 'meal_mood', 'energy_level',
+                              'evening_mood', 'overall_mood']
+            }
+        }))
+    if rng.random() < 0.6:
+        saves.append(('lifestyle', {
+            field: rng.random() < profile['active']
+            for field in LIFESTYLE_FIELDS
+        }))
+    return saves
+
+
+def _at(study_day, kind, payload):
+    key = payload.get('type') if kind == 'meal' else kind
+    return datetime.combine(study_day, SAVE_TIMES[key])
+
+
+def seed(participants=50, days=90, seed=0, log=print):
+    """Create a synthetic cohort with ``days`` of history before today.
+
+    Everything goes through the same service functions the routes use, so
+    the derived tables (meal items, rollups, streaks, community stats) are
+    consistent with what live traffic would have produced. Today is left
+    empty for the load run. Returns the list of kit codes.
+    """
+    rng = random.Random(seed)
+    admin = Admin.query.order_by(Admin.id).first()
+    today = get_study_day()
+    first_day = today - timedelta(days=days)
+
+    codes = [kit_code(number) for number in range(1, participants + 1)]
+    result = kit_codes.provision_codes(codes, BATCH_NAME, admin.id)
+    log(f'Kit codes: {result.summary()}')
+
+    menus = {}
+    for offset in range(days + 1):
+        study_day = first_day + timedelta(days=offset)
+        menus[study_day] = daily_menu(rng)
+        menu_service.set_menu(study_day, menus[study_day], admin.id)
+        FoodItem.sync_from_menu(menus[study_day])
+    db.session.commit()
+    menu_service.invalidate()
+
+    for number, code in enumerate(codes, start=1):
+        insert_missing(AnonymousUser, [{
+            'kit_id': code,
+            'name': f'Participant {number}'
+        }], ['kit_id'])
+        profile = {
+            'bristol': rng.uniform(3, 5),
+            'mood': rng.uniform(2.5, 4.5),
+            'active': rng.uniform(0.1, 0.6),
+            'adherence': rng.uniform(0.6, 0.98),
+        }
+        for offset in range(days):
+            study_day = first_day + timedelta(days=offset)
+            if rng.random() > profile['adherence']:
+                continue
+            for kind, payload in participant_day(rng, profile,
+                                                 menus[study_day]):
+                body, status = tracking.apply_event(
+                    code, kind, payload, now=_at(study_day, kind, payload))
+                if status != 200:
+                    log(f'{code} {study_day} {kind}: {body.get("error")}')
+        db.session.commit()
+        if number % 10 == 0 or number == participants:
+            log(f'Seeded {number}/{participants} participants')
+    return codes
+
+
+def seeded_codes():
+    return list(
+        db.session.execute(
+            db.select(KitCode.code).where(
+                KitCode.batch_name == BATCH_NAME).order_by(
+                    KitCode.code)).scalars())
+
@@ -0,0 +1,92 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from benchmarks.cohort import meal_selection, participant_day
+
+_local = threading.local()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    # The test client handles a request on the calling thread, so a
+    # thread-local counter sees exactly that request's statements
+    _local.statements = getattr(_local, 'statements', 0) + 1
+
+
+class Recorder:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+
+    def add(self, route, status, seconds, statements):
+        with self.lock:
+            self.samples.append((route, status, seconds, statements))
+
+
+def _timed(recorder, route, call):
+    _local.statements = 0
+    started = perf_counter()
+    response = call()
+    elapsed = perf_counter() - started
+    recorder.add(route, response.status_code, elapsed, _local.statements)
+    return response
+
+
+def participant_session(app, kit_id, rng, recorder, insights_windows):
+    """One participant's visit: log in, then log today's day and look at it.
+
+    Each route is recorded under its URL rule so results from different
+    kits aggregate.
+    """
+    client = app.test_client()
+    get = lambda url: client.get(url)
+    post = lambda url, payload: client.post(url, json=payload)
+
+    _timed(recorder, '/validate-kit/<kit_id>',
+           lambda: client.post(f'/validate-kit/{kit_id}'))
+    _timed(recorder, '/dashboard', lambda: get('/dashboard'))
+
+    menu = {}
+    for meal_type in ('breakfast', 'lunch', 'dinner'):
+        response = _timed(recorder, '/get-menu-data',
+                          lambda: get(f'/get-menu-data?meal_type={meal_type}'))
+        if response.status_code == 200:
+            menu.update(response.get_json()['menu_data'])
+
+    profile = {'bristol': 4, 'mood': 3.5, 'active': 0.3}
+    for kind, payload in participant_day(rng, profile, menu):
+        payload = dict(payload, kitId=kit_id)
+        if kind == 'meal':
+            payload['foods'] = meal_selection(rng, menu, payload['type'])
+        _timed(recorder, f'/save-{kind}',
+               lambda: post(f'/save-{kind}', payload))
+
+    _timed(recorder, '/dashboard', lambda: get('/dashboard'))
+    for window in insights_windows:
+        _timed(recorder, f'/insights?window={window}',
+               lambda: get(f'/insights?window={window}'))
+
+
+def run(app, kit_ids, concurrency=8, seed=0, insights_windows=(7, 90)):
+    """Drive every kit through one session, ``concurrency`` at a time.
+
+    Returns the raw samples and the wall-clock time of the whole run.
+    """
+    recorder = Recorder()
+    # One generator per kit, so results do not depend on thread scheduling
+    rngs = [random.Random(f'{seed}-{kit_id}') for kit_id in kit_ids]
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(participant_session, app, kit_id, rng, recorder,
+                        insights_windows)
+            for kit_id, rng in zip(kit_ids, rngs)
+        ]
+        for future in futures:
+            future.result()
+    return recorder.samples, perf_counter() - started
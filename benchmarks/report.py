@@ -0,0 +1,116 @@
+import json
+import platform
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+import numpy as np
+
+# A route regresses when its p95 grows by more than this share and by more
+# than the noise floor
+REGRESSION_TOLERANCE = 0.10
+NOISE_FLOOR_MS = 1.0
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _stats(samples):
+    latencies = np.array([seconds for _, seconds, _ in samples]) * 1000
+    statements = np.array([count for _, _, count in samples])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for status, _, _ in samples if status >= 400),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'queries_per_request': round(float(statements.mean()), 2),
+    }
+
+
+def build(samples, wall_seconds, config):
+    """Summarise raw (route, status, seconds, statements) samples."""
+    by_route = defaultdict(list)
+    for route, status, seconds, statements in samples:
+        by_route[route].append((status, seconds, statements))
+
+    overall = _stats([(status, seconds, statements)
+                      for _, status, seconds, statements in samples])
+    overall['throughput_rps'] = round(len(samples) / wall_seconds, 2)
+    overall['wall_seconds'] = round(wall_seconds, 3)
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'config': config,
+        'overall': overall,
+        'routes': {
+            route: _stats(route_samples)
+            for route, route_samples in sorted(by_route.items())
+        },
+    }
+
+
+def write(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Per-route changes against a baseline report.
+
+    Returns (rows, regressions). A route regresses when its p95 latency
+    or its queries per request went up beyond the tolerance.
+    """
+    rows, regressions = [], []
+    for route, current in report['routes'].items():
+        previous = baseline['routes'].get(route)
+        if previous is None:
+            rows.append((route, None, current, None))
+            continue
+        change = (current['p95_ms'] - previous['p95_ms']) / max(
+            previous['p95_ms'], 1e-9)
+        slower = (change > tolerance and
+                  current['p95_ms'] - previous['p95_ms'] > NOISE_FLOOR_MS)
+        more_queries = (current['queries_per_request'] >
+                        previous['queries_per_request'] + 0.5)
+        rows.append((route, previous, current, change))
+        if slower or more_queries:
+            regressions.append(route)
+    return rows, regressions
+
+
+def format_table(report, rows=None):
+    lines = [
+        f"{'route':<28}{'req':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}"
+        f"{'q/req':>7}{'Δp95':>9}"
+    ]
+    changes = {row[0]: row[3] for row in rows or []}
+    for route, stats in report['routes'].items():
+        change = changes.get(route)
+        lines.append(
+            f"{route:<28}{stats['requests']:>6}{stats['errors']:>5}"
+            f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}"
+            f"{stats['p99_ms']:>9.2f}{stats['queries_per_request']:>7.1f}"
+            f"{'' if change is None else f'{change:+.0%}':>9}")
+    overall = report['overall']
+    lines.append(f"{overall['requests']} requests in "
+                 f"{overall['wall_seconds']}s, "
+                 f"{overall['throughput_rps']} req/s, "
+                 f"p95 {overall['p95_ms']} ms")
+    return '\n'.join(lines)
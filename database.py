@@ -1,8 +1,80 @@
 import os
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
+
+# ON CONFLICT ... DO UPDATE needs SQLite 3.24+
+SQLITE_HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+
+def upsert(model, index_elements, values, update=None, session=None):
+    """Insert a row or update the one matching ``index_elements`` in one statement.
+
+    ``update`` maps column names to the values or SQL expressions written on
+    conflict; by default every non-key column in ``values`` is overwritten.
+    """
+    session = session or db.session
+    if update is None:
+        update = {
+            column: value
+            for column, value in values.items() if column not in index_elements
+        }
+
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql' or (dialect == 'sqlite' and SQLITE_HAS_UPSERT):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(model.__table__).values(**values)
+        if update:
+            stmt = stmt.on_conflict_do_update(index_elements=index_elements,
+                                              set_=update)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+        return session.execute(stmt)
+
+    # Fallback for databases without ON CONFLICT: update first, insert on miss
+    table = model.__table__
+    key = [table.c[column] == values[column] for column in index_elements]
+    if update:
+        result = session.execute(table.update().where(*key).values(**update))
+        if result.rowcount:
+            return result
+    elif session.execute(select(table.c[index_elements[0]]).where(*key)).first():
+        return None
+    return session.execute(table.insert().values(**values))
+
+
+def insert_missing(model, rows, index_elements, session=None):
+    """Bulk insert ``rows``, skipping any that collide on ``index_elements``."""
+    session = session or db.session
+    if not rows:
+        return None
+
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql' or (dialect == 'sqlite' and SQLITE_HAS_UPSERT):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(model.__table__).on_conflict_do_nothing(
+            index_elements=index_elements)
+        return session.execute(stmt, rows)
+
+    # Fallback: filter out keys that already exist, then executemany
+    table = model.__table__
+    existing = set()
+    for row in rows:
+        key = [table.c[column] == row[column] for column in index_elements]
+        if session.execute(select(table.c[index_elements[0]]).where(
+                *key)).first() is not None:
+            existing.add(tuple(row[column] for column in index_elements))
+    rows = [
+        row for row in rows
+        if tuple(row[column] for column in index_elements) not in existing
+    ]
+    if rows:
+        return session.execute(table.insert(), rows)
+    return None
@@ -0,0 +1,191 @@
+from sqlalchemy import select
+from database import db
+from models import (FoodItem, MealItem, StoolEvent, TrackingEntry,
+                    LIFESTYLE_FIELDS, MEAL_TYPES, MOOD_FIELDS,
+                    iter_food_selections)
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_TABLES = ('days', 'foods')
+EXPORT_FORMATS = ('csv', 'parquet')
+
+# Fixed column types so every chunk has the same schema, even when a chunk
+# happens to contain only missing values for a column
+DAY_COLUMNS = {
+    'kit_id': 'string',
+    'study_day': 'object',
+    'mood': 'Float64',
+    **{f'mood_{field}': 'Float64' for field in MOOD_FIELDS},
+    **{f'lifestyle_{field}': 'boolean' for field in LIFESTYLE_FIELDS},
+    **{f'{meal}_logged': 'boolean' for meal in MEAL_TYPES},
+    **{f'{meal}_item_count': 'Int64' for meal in MEAL_TYPES},
+    **{f'{meal}_foods': 'string' for meal in MEAL_TYPES},
+    'stool_count': 'Int64',
+    'bristol_mean': 'Float64',
+    'bristol_min': 'Int64',
+    'bristol_max': 'Int64',
+    'relief_mean': 'Float64',
+    'smell_mean': 'Float64',
+}
+FOOD_COLUMNS = {
+    'kit_id': 'string',
+    'study_day': 'object',
+    'meal_type': 'string',
+    'category': 'string',
+    'food': 'string',
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def _stream(query, chunk_size):
+    # yield_per uses a server-side cursor on PostgreSQL, so only one chunk
+    # of rows is ever held by the driver
+    result = db.session.execute(
+        query.execution_options(yield_per=chunk_size))
+    for rows in result.partitions(chunk_size):
+        yield rows
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def day_record(row):
+    mood_details = row.mood_details if isinstance(row.mood_details, dict) else {}
+    lifestyle = row.lifestyle_log if isinstance(row.lifestyle_log, dict) else {}
+    meals = row.meals if isinstance(row.meals, dict) else {}
+
+    record = {
+        'kit_id': row.kit_id,
+        'study_day': row.study_day,
+        'mood': row.mood,
+        'stool_count': row.stool_count or 0,
+        'bristol_mean': row.bristol_mean,
+        'bristol_min': row.bristol_min,
+        'bristol_max': row.bristol_max,
+        'relief_mean': row.relief_mean,
+        'smell_mean': row.smell_mean,
+    }
+    for field in MOOD_FIELDS:
+        record[f'mood_{field}'] = _number(mood_details.get(field))
+    for field in LIFESTYLE_FIELDS:
+        record[f'lifestyle_{field}'] = bool(
+            lifestyle.get(field)) if lifestyle else None
+    for meal in MEAL_TYPES:
+        foods = [
+            f'{category}: {name}'
+            for category, name in iter_food_selections(meals.get(meal))
+        ]
+        record[f'{meal}_logged'] = meal in meals
+        record[f'{meal}_item_count'] = len(foods)
+        record[f'{meal}_foods'] = '; '.join(foods) if foods else None
+    return record
+
+
+def _frame(records, columns):
+    # pandas is only loaded once an export actually runs
+    import pandas as pd
+
+    frame = pd.DataFrame.from_records(records, columns=list(columns))
+    return frame.astype(columns)
+
+
+def day_query():
+    # Tracking rows with their stool events aggregated per day by the
+    # database, so the day export is a single streamed query
+    stools = select(
+        StoolEvent.kit_id, StoolEvent.study_day,
+        db.func.count(StoolEvent.id).label('stool_count'),
+        db.func.avg(StoolEvent.bristol_type).label('bristol_mean'),
+        db.func.min(StoolEvent.bristol_type).label('bristol_min'),
+        db.func.max(StoolEvent.bristol_type).label('bristol_max'),
+        db.func.avg(StoolEvent.relief).label('relief_mean'),
+        db.func.avg(StoolEvent.smell).label('smell_mean')).group_by(
+            StoolEvent.kit_id, StoolEvent.study_day).subquery()
+
+    return select(
+        TrackingEntry.kit_id, TrackingEntry.study_day, TrackingEntry.mood,
+        TrackingEntry.mood_details, TrackingEntry.lifestyle_log,
+        TrackingEntry.meals, stools.c.stool_count, stools.c.bristol_mean,
+        stools.c.bristol_min, stools.c.bristol_max, stools.c.relief_mean,
+        stools.c.smell_mean).outerjoin(
+            stools,
+            db.and_(stools.c.kit_id == TrackingEntry.kit_id,
+                    stools.c.study_day == TrackingEntry.study_day))
+
+
+def iter_day_frames(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one DataFrame per chunk, one row per participant-day."""
+    query = day_query().order_by(TrackingEntry.kit_id, TrackingEntry.study_day)
+
+    for rows in _stream(query, chunk_size):
+        yield _frame([day_record(row) for row in rows], DAY_COLUMNS)
+
+
+def iter_food_frames(chunk_size=EXPORT_CHUNK_SIZE):
+    # Long format: one row per food a participant selected for a meal
+    query = select(MealItem.kit_id, MealItem.study_day, MealItem.meal_type,
+                   FoodItem.category, FoodItem.name.label('food')).join(
+                       FoodItem, FoodItem.id == MealItem.food_id).order_by(
+                           MealItem.kit_id, MealItem.study_day,
+                           MealItem.meal_type, FoodItem.category,
+                           FoodItem.name)
+
+    for rows in _stream(query, chunk_size):
+        yield _frame([row._asdict() for row in rows], FOOD_COLUMNS)
+
+
+def iter_frames(table, chunk_size=EXPORT_CHUNK_SIZE):
+    if table == 'days':
+        return iter_day_frames(chunk_size)
+    if table == 'foods':
+        return iter_food_frames(chunk_size)
+    raise ExportError(f'Unknown export table: {table}')
+
+
+def _columns(table):
+    return DAY_COLUMNS if table == 'days' else FOOD_COLUMNS
+
+
+def iter_csv(table, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the export as CSV text, one chunk at a time."""
+    # The header comes from pandas too, so every line ends the same way
+    yield _frame([], _columns(table)).to_csv(index=False)
+    for frame in iter_frames(table, chunk_size):
+        yield frame.to_csv(index=False, header=False)
+
+
+def write_csv(table, output, chunk_size=EXPORT_CHUNK_SIZE):
+    _frame([], _columns(table)).to_csv(output, index=False)
+    rows = 0
+    for frame in iter_frames(table, chunk_size):
+        frame.to_csv(output, index=False, header=False)
+        rows += len(frame)
+    return rows
+
+
+def write_parquet(table, output, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write the export to ``output`` as Parquet, one row group per chunk."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError('Parquet export needs pyarrow, install it or use CSV')
+
+    schema = pa.Schema.from_pandas(_frame([], _columns(table)),
+                                   preserve_index=False)
+    # An empty frame cannot tell pyarrow that study_day holds dates
+    schema = schema.set(schema.get_field_index('study_day'),
+                        pa.field('study_day', pa.date32()))
+    rows = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        for frame in iter_frames(table, chunk_size):
+            writer.write_table(
+                pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            rows += len(frame)
+    return rows
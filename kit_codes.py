@@ -0,0 +1,268 @@
+import csv
+import io
+import os
+import re
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from time import monotonic
+from database import db, insert_missing
+from models import Admin, AnonymousUser, KitCode, TrackingEntry, get_study_day
+
+ADMIN_PAGE_SIZE = 50
+# How long a worker trusts that a kit code it has seen active is still active
+KIT_CODE_CACHE_TTL = float(os.environ.get('KIT_CODE_CACHE_TTL', 60))
+IMPORT_CHUNK_SIZE = 5000
+MAX_GENERATE_QUANTITY = 100000
+KIT_CODE_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,35}\Z')
+
+
+@dataclass
+class ProvisionResult:
+    inserted: int = 0
+    skipped: int = 0
+    invalid: int = 0
+
+    def summary(self):
+        return (f'{self.inserted} inserted, {self.skipped} skipped as '
+                f'duplicates, {self.invalid} invalid')
+
+
+def iter_uploaded_codes(stream):
+    # Reads the first column of a CSV or plain-text upload line by line, so
+    # the file is never held in memory as a whole
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    for row_number, row in enumerate(csv.reader(text)):
+        if not row:
+            continue
+        code = row[0].strip()
+        if row_number == 0 and code.lower() in ('code', 'kit_code', 'kit id'):
+            continue
+        yield code
+
+
+def iter_text_codes(text):
+    for line in io.StringIO(text or ''):
+        yield line.strip()
+
+
+def _chunks(codes, size):
+    chunk = []
+    for code in codes:
+        chunk.append(code)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def provision_codes(codes, batch_name, admin_id, chunk_size=IMPORT_CHUNK_SIZE):
+    """Insert kit codes in chunks, skipping blanks, invalid and existing codes.
+
+    Each chunk costs one set-based lookup of existing codes and one
+    executemany insert, and is committed on its own.
+    """
+    result = ProvisionResult()
+    seen = set()
+    for chunk in _chunks(codes, chunk_size):
+        candidates = []
+        for code in chunk:
+            if not code:
+                continue
+            if not KIT_CODE_PATTERN.match(code):
+                result.invalid += 1
+            elif code in seen:
+                result.skipped += 1
+            else:
+                seen.add(code)
+                candidates.append(code)
+
+        existing = set(
+            db.session.execute(
+                db.select(KitCode.code).where(
+                    KitCode.code.in_(candidates))).scalars()) if candidates else set()
+        new_codes = [code for code in candidates if code not in existing]
+        result.skipped += len(existing)
+
+        # ON CONFLICT DO NOTHING covers codes added concurrently since the lookup
+        insert_missing(KitCode, [{
+            'code': code,
+            'batch_name': batch_name,
+            'created_by': admin_id,
+            'is_active': True
+        } for code in new_codes], ['code'])
+        db.session.commit()
+        result.inserted += len(new_codes)
+    invalidate_active_codes()
+    return result
+
+
+def generate_codes(quantity, batch_name, admin_id):
+    quantity = max(0, min(quantity, MAX_GENERATE_QUANTITY))
+    return provision_codes((str(uuid.uuid4()) for _ in range(quantity)),
+                           batch_name, admin_id)
+
+
+def encode_cursor(kit_code):
+    return f'{kit_code.created_at.isoformat()}|{kit_code.id}'
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, code_id = cursor.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(code_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def browse_codes(search=None, batch_name=None, is_active=None, after=None,
+                 page_size=ADMIN_PAGE_SIZE):
+    """Return one page of kit codes, newest first, and the next page's cursor.
+
+    Pages are keyed on (created_at, id) rather than OFFSET, so every page is
+    a single index range scan however deep the admin pages.
+    """
+    query = db.select(KitCode).order_by(KitCode.created_at.desc(),
+                                        KitCode.id.desc())
+    if search:
+        query = query.where(KitCode.code.startswith(search, autoescape=True))
+    if batch_name:
+        query = query.where(KitCode.batch_name == batch_name)
+    if is_active is not None:
+        query = query.where(KitCode.is_active.is_(is_active))
+
+    cursor = decode_cursor(after) if after else None
+    if cursor:
+        created_at, code_id = cursor
+        query = query.where(
+            db.or_(
+                KitCode.created_at < created_at,
+                db.and_(KitCode.created_at == created_at,
+                        KitCode.id < code_id)))
+
+    codes = db.session.execute(query.limit(page_size + 1)).scalars().all()
+    next_cursor = encode_cursor(codes[page_size - 1]) if len(
+        codes) > page_size else None
+    return codes[:page_size], next_cursor
+
+
+def batch_summaries():
+    # Totals, active codes and codes a participant has logged in with, per
+    # batch, from one GROUP BY
+    rows = db.session.execute(
+        db.select(
+            KitCode.batch_name,
+            db.func.count(KitCode.id).label('total'),
+            db.func.sum(db.case((KitCode.is_active.is_(True), 1),
+                                else_=0)).label('active'),
+            db.func.count(AnonymousUser.id).label('activated')).outerjoin(
+                AnonymousUser,
+                AnonymousUser.kit_id == KitCode.code).group_by(
+                    KitCode.batch_name).order_by(KitCode.batch_name))
+    return [row._asdict() for row in rows]
+
+
+@dataclass
+class LoginState:
+    admin_id: int = None
+    kit_active: bool = False
+    user_id: int = None
+    user_name: str = None
+    last_study_day: object = None
+
+
+# code -> monotonic time it was last confirmed active
+_active_codes = {}
+_active_codes_lock = threading.Lock()
+
+
+def _cached_active(code):
+    checked_at = _active_codes.get(code)
+    return checked_at is not None and monotonic() - checked_at < KIT_CODE_CACHE_TTL
+
+
+def _remember_active(code):
+    with _active_codes_lock:
+        # Expired entries are dropped on write so the cache stays small
+        if len(_active_codes) > 10000:
+            now = monotonic()
+            for stale in [
+                    c for c, checked_at in _active_codes.items()
+                    if now - checked_at >= KIT_CODE_CACHE_TTL
+            ]:
+                _active_codes.pop(stale, None)
+        _active_codes[code] = monotonic()
+
+
+def invalidate_active_codes(code=None):
+    # Other workers notice a deactivation once their entry expires
+    if code is None:
+        _active_codes.clear()
+    else:
+        _active_codes.pop(code, None)
+
+
+def load_login_state(kit_id):
+    """Fetch everything a login needs for ``kit_id`` in one statement.
+
+    Admin, kit validity, participant and latest tracked day are scalar
+    subqueries; the kit lookup is dropped when the code is cached as active.
+    """
+    kit_cached = _cached_active(kit_id)
+    admin_id = db.select(Admin.id).where(
+        Admin.username == kit_id, Admin.is_active.is_(True)).scalar_subquery()
+    kit_active = db.literal(True) if kit_cached else db.select(
+        KitCode.id).where(KitCode.code == kit_id,
+                          KitCode.is_active.is_(True)).exists()
+    user_id = db.select(AnonymousUser.id).where(
+        AnonymousUser.kit_id == kit_id).scalar_subquery()
+    user_name = db.select(AnonymousUser.name).where(
+        AnonymousUser.kit_id == kit_id).scalar_subquery()
+    last_study_day = db.select(db.func.max(TrackingEntry.study_day)).where(
+        TrackingEntry.kit_id == kit_id).scalar_subquery()
+
+    row = db.session.execute(
+        db.select(admin_id.label('admin_id'), kit_active.label('kit_active'),
+                  user_id.label('user_id'), user_name.label('user_name'),
+                  last_study_day.label('last_study_day'))).one()
+    state = LoginState(**row._asdict())
+    state.kit_active = bool(state.kit_active)
+    if state.kit_active and not kit_cached:
+        _remember_active(kit_id)
+    return state
+
+
+def register_participant(kit_id, state):
+    # First login creates the participant with its display name in one insert;
+    # a concurrent first login for the same kit is absorbed by ON CONFLICT
+    if state.user_id is None:
+        insert_missing(AnonymousUser, [{
+            'kit_id': kit_id,
+            'name': kit_id
+        }], ['kit_id'])
+        db.session.commit()
+    elif not state.user_name:
+        db.session.execute(
+            db.update(AnonymousUser).where(
+                AnonymousUser.kit_id == kit_id).values(name=kit_id))
+        db.session.commit()
+    return kit_id
+
+
+def login_response(username, state, study_day=None):
+    study_day = study_day or get_study_day()
+    has_tracked = state.last_study_day == study_day
+    # Previous entries are only reported when today has not been tracked yet
+    last_study_day = None if has_tracked else state.last_study_day
+    return {
+        "valid": True,
+        "is_admin": False,
+        "username": username,
+        "has_tracked": has_tracked,
+        "has_previous_entries": last_study_day is not None,
+        "last_entry_date":
+        last_study_day.strftime('%Y-%m-%d') if last_study_day else None,
+        "show_username_warning": True
+    }
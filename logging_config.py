@@ -0,0 +1,187 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from time import perf_counter
+from flask import g, has_request_context, request
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# "json" for one structured record per line, "text" for reading locally
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+# Share of requests whose DEBUG records are kept; every other level is
+# always kept
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))
+LOG_ACCESS = os.environ.get('LOG_ACCESS', '1') not in ('0', 'false', 'no')
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_MAX_LENGTH = 64
+
+TEXT_FORMAT = ('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: '
+               '%(message)s')
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(
+    vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+        'message', 'asctime', 'taskName'
+    }
+
+access_log = logging.getLogger('access')
+_handler = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created,
+                                           timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    # Runs on the logging thread's caller, where the request is still bound
+
+    def filter(self, record):
+        if has_request_context() and 'request_id' in g:
+            record.request_id = g.request_id
+            record.route = request.url_rule.rule if request.url_rule else None
+        else:
+            record.request_id = getattr(record, 'request_id', '-')
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keep DEBUG records for a sample of requests, everything else always.
+
+    The decision is made once per request, so a sampled request keeps all
+    of its debug payloads and the rest keep none.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if not has_request_context():
+            return random.random() < self.rate
+        if 'log_debug' not in g:
+            g.log_debug = random.random() < self.rate
+        return g.log_debug
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        # Only merge the arguments here, while they still hold the caller's
+        # values; building the output line is left to the listener
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _formatter(log_format):
+    if log_format == 'text':
+        return logging.Formatter(TEXT_FORMAT)
+    return JsonFormatter()
+
+
+def configure(level=LOG_LEVEL, log_format=LOG_FORMAT,
+              debug_sample_rate=LOG_DEBUG_SAMPLE_RATE, stream=None):
+    """Route all logging through a queue drained by a background thread.
+
+    Callers only pay for the level check, the filters and putting the
+    record on the queue; formatting and writing happen on the listener
+    thread.
+    """
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(_formatter(log_format))
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _handler = handler
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    return _listener
+
+
+def _stop():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    # The listener thread does not survive a fork (gunicorn --preload), so
+    # the child gets its own queue and listener writing to the same output.
+    # Records the parent had not written yet stay with the parent
+    global _listener
+    if _listener is not None:
+        _handler.queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(_handler.queue,
+                                                   *_listener.handlers)
+        _listener.start()
+
+
+atexit.register(_stop)
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def start_request():
+    request_id = request.headers.get(REQUEST_ID_HEADER, '')
+    if not request_id or len(request_id) > REQUEST_ID_MAX_LENGTH:
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+    g.request_started = perf_counter()
+
+
+def finish_request(response):
+    if 'request_id' not in g:
+        return response
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    if LOG_ACCESS and access_log.isEnabledFor(logging.INFO):
+        latency_ms = (perf_counter() - g.request_started) * 1000
+        access_log.info('%s %s %s',
+                        request.method,
+                        request.path,
+                        response.status_code,
+                        extra={
+                            'method': request.method,
+                            'status': response.status_code,
+                            'latency_ms': round(latency_ms, 2)
+                        })
+    return response
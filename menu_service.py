@@ -0,0 +1,144 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import timedelta
+from flask import json
+from time import monotonic
+from database import db
+from models import DailyMenu, MEAL_TYPES
+
+# How long a worker trusts its cached menu before re-reading the version stamp
+MENU_VERSION_TTL = float(os.environ.get("MENU_VERSION_TTL", 5))
+MENU_CACHE_CONTROL = "public, max-age=60"
+
+# Default menu data if no menu is set for today
+DEFAULT_MENU_DATA = {
+    "breakfast": {
+        "Beverages": {
+            "Coffee": {},
+            "Tea": {},
+            "Water": {}
+        },
+        "Cereals": {
+            "Oatmeal": {},
+            "Granola": {},
+            "Muesli": {}
+        },
+        "Protein": {
+            "Eggs": {},
+            "Greek Yogurt": {},
+            "Tofu Scramble": {}
+        }
+    },
+    "lunch": {
+        "Main Course": {
+            "Grilled Chicken": {},
+            "Vegetable Stir Fry": {},
+            "Quinoa Bowl": {}
+        },
+        "Sides": {
+            "Mixed Salad": {},
+            "Steamed Vegetables": {},
+            "Brown Rice": {}
+        }
+    },
+    "dinner": {
+        "Main Course": {
+            "Baked Fish": {},
+            "Lentil Curry": {},
+            "Tofu Steak": {}
+        },
+        "Sides": {
+            "Roasted Vegetables": {},
+            "Quinoa": {},
+            "Sweet Potato": {}
+        }
+    }
+}
+
+
+@dataclass
+class CachedMenu:
+    study_day: object
+    version: object
+    checked_at: float
+    # Pre-encoded {"menu_data": {meal_type: ...}} bodies and their ETags
+    bodies: dict = field(default_factory=dict)
+    etags: dict = field(default_factory=dict)
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _menu_version(study_day):
+    # Tiny indexed read; None means no menu was set and the default applies
+    return db.session.execute(
+        db.select(DailyMenu.version).where(
+            DailyMenu.date == study_day).order_by(
+                DailyMenu.id.desc()).limit(1)).scalar()
+
+
+def _build(study_day, version):
+    menu_data = None
+    if version is not None:
+        daily_menu = DailyMenu.get_menu_for_date(study_day)
+        menu_data = daily_menu.menu_data if daily_menu else None
+    tag = f"v{version}"
+    if not menu_data:
+        tag = "default"
+        menu_data = DEFAULT_MENU_DATA
+
+    cached = CachedMenu(study_day=study_day,
+                        version=version,
+                        checked_at=monotonic())
+    for meal_type in MEAL_TYPES:
+        cached.bodies[meal_type] = json.dumps(
+            {"menu_data": {meal_type: menu_data.get(meal_type, {})}})
+        cached.etags[meal_type] = f"menu-{study_day.isoformat()}-{tag}-{meal_type}"
+    return cached
+
+
+def get_menu(study_day):
+    cached = _cache.get(study_day)
+    if cached and monotonic() - cached.checked_at < MENU_VERSION_TTL:
+        return cached
+
+    version = _menu_version(study_day)
+    if cached and cached.version == version:
+        cached.checked_at = monotonic()
+        return cached
+
+    with _lock:
+        cached = _build(study_day, version)
+        # Only the current study day (and the one before, around the reset) is kept
+        for day in [
+                day for day in _cache if day < study_day - timedelta(days=1)
+        ]:
+            _cache.pop(day, None)
+        _cache[study_day] = cached
+    return cached
+
+
+def invalidate(study_day=None):
+    # Other workers pick the change up through the version stamp within the TTL
+    if study_day is None:
+        _cache.clear()
+    else:
+        _cache.pop(study_day, None)
+
+
+def set_menu(study_day, menu_data, admin_id):
+    # Every change bumps the version stamp that the ETags are derived from
+    daily_menu = DailyMenu.get_menu_for_date(study_day)
+    if daily_menu:
+        daily_menu.menu_data = menu_data
+        daily_menu.version = DailyMenu.version + 1
+        daily_menu.updated_at = db.func.now()
+    else:
+        daily_menu = DailyMenu(date=study_day,
+                               menu_data=menu_data,
+                               version=1,
+                               created_by=admin_id)
+        db.session.add(daily_menu)
+    return daily_menu
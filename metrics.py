@@ -0,0 +1,358 @@
+import atexit
+import fcntl
+import glob
+import hmac
+import json
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from processes import alive
+
+# With gunicorn every worker has its own registry; pointing METRICS_DIR at a
+# directory shared by the workers lets any of them report the whole server
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# Bearer token for scrapers; admins can also read /metrics from a browser
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# name: (help, label names, buckets)
+HISTOGRAMS = {
+    'http_request_duration_seconds':
+    ('Request latency by route', ('route', 'method', 'status'),
+     LATENCY_BUCKETS),
+    'http_request_sql_statements':
+    ('SQL statements issued per request', ('route', ), STATEMENT_BUCKETS),
+    'http_request_sql_seconds':
+    ('Time spent executing SQL per request', ('route', ), LATENCY_BUCKETS),
+    'db_pool_checkout_wait_seconds':
+    ('Time spent waiting for a pooled connection', (), WAIT_BUCKETS),
+}
+GAUGES = {
+    'db_pool_size': 'Connections the pool keeps open',
+    'db_pool_checked_out': 'Connections currently in use',
+    'db_pool_overflow': 'Connections open beyond the pool size',
+}
+
+
+class Registry:
+    """Histograms for one process, cheap enough to update on every request.
+
+    Each series is a list of per-bucket counts followed by the sum and the
+    count; buckets are only made cumulative when the text is rendered.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name in HISTOGRAMS}
+
+    def observe(self, name, value, labels=()):
+        buckets = HISTOGRAMS[name][2]
+        index = bisect_left(buckets, value)
+        with self.lock:
+            series = self.histograms[name].get(labels)
+            if series is None:
+                series = self.histograms[name][labels] = [0] * (
+                    len(buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(labels), list(series)]
+                       for labels, series in series_by_labels.items()]
+                for name, series_by_labels in self.histograms.items()
+            }
+
+
+registry = Registry()
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool has no event before a checkout starts waiting, so the wait
+    # is timed around the call that takes a connection from the queue
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registry.observe('db_pool_checkout_wait_seconds',
+                             perf_counter() - started)
+
+
+def engine_options(database_url):
+    # SQLite (and in-memory databases in particular) keep their own pools
+    if database_url and not database_url.startswith('sqlite'):
+        return {'poolclass': TimedQueuePool}
+    return {}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if has_request_context() and 'metrics_started' in g:
+        conn.info.setdefault('metrics_query_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get('metrics_query_start')
+    if starts and has_request_context() and 'metrics_started' in g:
+        g.metrics_sql_seconds += perf_counter() - starts.pop()
+        g.metrics_sql_statements += 1
+
+
+def start_request():
+    g.metrics_started = perf_counter()
+    g.metrics_sql_statements = 0
+    g.metrics_sql_seconds = 0.0
+
+
+def _route():
+    # The URL rule, not the path, so kit ids do not become label values
+    return request.url_rule.rule if request.url_rule else '<unmatched>'
+
+
+def record_request(route, method, status, seconds, engine=None):
+    # Shared with the ASGI tier, which has no Flask request to read from
+    registry.observe('http_request_duration_seconds', seconds,
+                     (route, method, str(status)))
+    _maybe_flush(engine)
+
+
+def finish_request(response, engine=None):
+    if 'metrics_started' not in g:
+        return response
+    route = _route()
+    registry.observe('http_request_sql_statements', g.metrics_sql_statements,
+                     (route, ))
+    registry.observe('http_request_sql_seconds', g.metrics_sql_seconds,
+                     (route, ))
+    record_request(route, request.method, response.status_code,
+                   perf_counter() - g.metrics_started, engine)
+    return response
+
+
+def pool_gauges(engine):
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        'db_pool_size': pool.size(),
+        'db_pool_checked_out': pool.checkedout(),
+        'db_pool_overflow': max(pool.overflow(), 0),
+    }
+
+
+_last_flush = 0.0
+_last_gauges = {}
+
+
+def _path(pid):
+    return os.path.join(METRICS_DIR, f'metrics-{pid}.json')
+
+
+def _exited_path():
+    # Histograms of every worker that has exited, summed
+    return os.path.join(METRICS_DIR, 'exited.json')
+
+
+@contextmanager
+def _locked():
+    # Held while exited workers are folded in and while a scrape reads the
+    # files, so a scrape never sees a worker counted twice or not at all
+    with open(os.path.join(METRICS_DIR, 'metrics.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, data):
+    # Written under a temporary name and renamed, so readers never see a
+    # half-written file
+    fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush(gauges=None):
+    """Write this process's metrics to METRICS_DIR for the other workers."""
+    global _last_flush, _last_gauges
+    if not METRICS_DIR:
+        return
+    if gauges is not None:
+        _last_gauges = gauges
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write(_path(os.getpid()), {
+        'pid': os.getpid(),
+        'histograms': registry.snapshot(),
+        'gauges': _last_gauges
+    })
+    _last_flush = monotonic()
+
+
+def _maybe_flush(engine=None):
+    if METRICS_DIR and monotonic() - _last_flush >= METRICS_FLUSH_INTERVAL:
+        flush(pool_gauges(engine) if engine is not None else None)
+
+
+def _retire(path, process):
+    # Called with the lock held. The worker's histograms move into the
+    # exited file so the totals never go down, as Prometheus counters must
+    # not; its gauges are dropped with its own file
+    exited = _read(_exited_path()) or {'histograms': {}}
+    histograms, _ = _merge([exited, process])
+    _write(_exited_path(), {
+        'pid': None,
+        'histograms': {
+            name: [[list(labels), values]
+                   for labels, values in series.items()]
+            for name, series in histograms.items()
+        },
+        'gauges': {}
+    })
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _exit():
+    # An exiting worker folds itself into the exited file, so recycled
+    # workers do not pile up in METRICS_DIR
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with _locked():
+            _retire(_path(os.getpid()), {
+                'pid': os.getpid(),
+                'histograms': registry.snapshot()
+            })
+
+
+atexit.register(_exit)
+
+
+def _collect(engine):
+    gauges = pool_gauges(engine)
+    if not METRICS_DIR:
+        return [{
+            'pid': os.getpid(),
+            'histograms': registry.snapshot(),
+            'gauges': gauges
+        }]
+
+    flush(gauges)
+    processes = []
+    with _locked():
+        for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+            process = _read(path)
+            if process is None:
+                continue
+            if not alive(process['pid']):
+                # Left by a worker that crashed before it could retire
+                _retire(path, process)
+                continue
+            processes.append(process)
+        exited = _read(_exited_path())
+    if exited:
+        processes.append(exited)
+    return processes
+
+
+def _merge(processes):
+    # Histograms are summed across workers, exited ones included; gauges
+    # are reported per live worker
+    merged = {name: {} for name in HISTOGRAMS}
+    gauges = {name: {} for name in GAUGES}
+    for process in processes:
+        for name, series in process['histograms'].items():
+            if name not in merged:
+                continue
+            for labels, values in series:
+                labels = tuple(labels)
+                total = merged[name].get(labels)
+                if total is None:
+                    merged[name][labels] = list(values)
+                else:
+                    merged[name][labels] = [
+                        a + b for a, b in zip(total, values)
+                    ]
+        for name, value in process.get('gauges', {}).items():
+            if name in gauges:
+                gauges[name][process['pid']] = value
+    return merged, gauges
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"'
+             for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(engine):
+    """All metrics in the Prometheus text exposition format."""
+    histograms, gauges = _merge(_collect(engine))
+    lines = []
+    for name, (help_text, label_names, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, values in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf', ), values):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+                lines.append(f'{name}_bucket'
+                             f'{_labels(label_names, labels, [le])} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, labels)} '
+                         f'{_number(values[-2])}')
+            lines.append(f'{name}_count{_labels(label_names, labels)} '
+                         f'{values[-1]}')
+    for name, help_text in GAUGES.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for pid, value in sorted(gauges[name].items()):
+            lines.append(f'{name}{_labels(("pid", ), (pid, ))} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def token_matches(authorization):
+    # Constant-time comparison of an "Authorization: Bearer ..." header
+    if not METRICS_TOKEN or not authorization:
+        return False
+    scheme, _, token = authorization.partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.strip(), METRICS_TOKEN)
@@ -0,0 +1,347 @@
+import logging
+from datetime import datetime
+from sqlalchemy import bindparam, func, inspect, null, select, text
+from database import db, insert_missing
+from models import (CommunityStats, DailyMenu, DailyRollup, FoodItem, KitCode,
+                    MealItem, ParticipantStreak, StoolEvent, TrackingEntry,
+                    MEAL_TYPES, get_study_day, iter_food_selections)
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _has_column(table_name, column_name):
+    columns = inspect(db.engine).get_columns(table_name)
+    return any(column['name'] == column_name for column in columns)
+
+
+def _add_column(table_name, column_name, column_type):
+    if not _has_column(table_name, column_name):
+        db.session.execute(
+            text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+        db.session.commit()
+        logging.info('Added column %s.%s', table_name, column_name)
+
+
+def _create_indexes(model, *names):
+    for index in model.__table__.indexes:
+        if not names or index.name in names:
+            index.create(db.engine, checkfirst=True)
+
+
+def _merge_entries(entries):
+    # Fold same-day duplicates into the oldest row, later rows win on conflicts
+    keeper = entries[0]
+    meals = dict(keeper.meals or {})
+    stool_entries = list(keeper.stool_entries or [])
+    seen_stools = {(s.get('timestamp'), s.get('type')) for s in stool_entries}
+
+    for entry in entries[1:]:
+        meals.update(entry.meals or {})
+        for stool in entry.stool_entries or []:
+            key = (stool.get('timestamp'), stool.get('type'))
+            if key not in seen_stools:
+                seen_stools.add(key)
+                stool_entries.append(stool)
+        if entry.mood is not None:
+            keeper.mood = entry.mood
+            keeper.mood_details = entry.mood_details
+        if entry.lifestyle_log:
+            keeper.lifestyle_log = entry.lifestyle_log
+        keeper.current_streak = max(keeper.current_streak or 0,
+                                    entry.current_streak or 0)
+        keeper.best_streak = max(keeper.best_streak or 0,
+                                 entry.best_streak or 0)
+        db.session.delete(entry)
+
+    keeper.meals = meals
+    keeper.stool_entries = stool_entries
+
+
+def add_tracking_entry_study_day():
+    _add_column('tracking_entry', 'study_day', 'DATE')
+
+    # Backfill study_day from the creation timestamp, applying the 3 AM reset
+    table = TrackingEntry.__table__
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.date).where(
+                table.c.study_day.is_(None)).limit(BACKFILL_CHUNK_SIZE)).all()
+        if not rows:
+            break
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('entry_id')).values(
+                study_day=bindparam('day')),
+            [{
+                'entry_id': row.id,
+                'day': get_study_day(row.date) if row.date else get_study_day()
+            } for row in rows])
+        db.session.commit()
+
+    # The unique key can only be created once every (kit_id, study_day) is distinct
+    duplicates = db.session.execute(
+        select(TrackingEntry.kit_id, TrackingEntry.study_day).group_by(
+            TrackingEntry.kit_id, TrackingEntry.study_day).having(
+                func.count() > 1)).all()
+    for kit_id, study_day in duplicates:
+        entries = TrackingEntry.query.filter_by(
+            kit_id=kit_id, study_day=study_day).order_by(TrackingEntry.id).all()
+        _merge_entries(entries)
+    if duplicates:
+        db.session.commit()
+        logging.info('Merged %s duplicate tracking days', len(duplicates))
+
+    _create_indexes(TrackingEntry)
+
+
+def _legacy_stool_event(entry, stool):
+    details = stool.get('details') or {}
+    try:
+        timestamp = datetime.fromisoformat(stool['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        timestamp = entry.date or datetime.now()
+
+    event = {
+        'kit_id': entry.kit_id,
+        'study_day': entry.study_day,
+        'timestamp': timestamp
+    }
+    for column, value, high in (('bristol_type', stool.get('type'), 7),
+                                ('relief', details.get('relief'), 5),
+                                ('smell', details.get('smell'), 5)):
+        try:
+            event[column] = StoolEvent.parse_scale(value, 1, high)
+        except ValueError:
+            event[column] = None
+    return event
+
+
+def explode_stool_entries():
+    # Move each legacy stool_entries array into StoolEvent rows, clearing the
+    # array in the same transaction so a re-run never duplicates events
+    last_id = 0
+    while True:
+        entries = TrackingEntry.query.filter(
+            TrackingEntry.id > last_id,
+            TrackingEntry.stool_entries.isnot(None)).order_by(
+                TrackingEntry.id).limit(BACKFILL_CHUNK_SIZE).all()
+        if not entries:
+            break
+
+        events = [
+            _legacy_stool_event(entry, stool) for entry in entries
+            for stool in entry.stool_entries or [] if isinstance(stool, dict)
+        ]
+        if events:
+            db.session.execute(StoolEvent.__table__.insert(), events)
+        for entry in entries:
+            entry.stool_entries = null()
+        db.session.commit()
+        last_id = entries[-1].id
+        logging.info('Exploded %s stool entries up to id %s', len(events), last_id)
+
+
+def build_food_catalog():
+    for daily_menu in DailyMenu.query.order_by(DailyMenu.date):
+        FoodItem.sync_from_menu(daily_menu.menu_data)
+    db.session.commit()
+
+    # Explode saved meals into MealItem facts, existing facts are left alone
+    last_id = 0
+    while True:
+        entries = TrackingEntry.query.filter(
+            TrackingEntry.id > last_id,
+            TrackingEntry.meals.isnot(None)).order_by(
+                TrackingEntry.id).limit(BACKFILL_CHUNK_SIZE).all()
+        if not entries:
+            break
+
+        selections = [(entry, meal_type, category, name)
+                      for entry in entries for meal_type in MEAL_TYPES
+                      for category, name in iter_food_selections(
+                          (entry.meals or {}).get(meal_type))]
+        food_ids = FoodItem.ids_for(
+            (category, name) for _, _, category, name in selections)
+        rows = {(entry.kit_id, entry.study_day, meal_type,
+                 food_ids[(category, name)])
+                for entry, meal_type, category, name in selections}
+        insert_missing(MealItem, [{
+            'kit_id': kit_id,
+            'study_day': study_day,
+            'meal_type': meal_type,
+            'food_id': food_id
+        } for kit_id, study_day, meal_type, food_id in rows],
+                       ['kit_id', 'study_day', 'meal_type', 'food_id'])
+        db.session.commit()
+        last_id = entries[-1].id
+        logging.info('Exploded %s meal items up to id %s', len(rows), last_id)
+
+
+def add_community_stats_counters():
+    for column in ['mood_sum FLOAT', 'mood_count INTEGER', 'stool_count INTEGER'
+                   ] + [f'bristol_{t} INTEGER' for t in CommunityStats.BRISTOL_TYPES]:
+        name, column_type = column.split()
+        _add_column('community_stats', name, f'{column_type} DEFAULT 0')
+
+    # Keep the newest row per date so the unique index can be created
+    keep = select(func.max(CommunityStats.id)).group_by(CommunityStats.date)
+    db.session.execute(
+        db.delete(CommunityStats).where(CommunityStats.id.notin_(keep)))
+    db.session.commit()
+    _create_indexes(CommunityStats)
+
+
+def backfill_participant_streaks():
+    # Replay each participant's tracked days in order, skipping kits that
+    # already have a streak row so live updates are never overwritten
+    tracked_days = db.session.execute(
+        select(TrackingEntry.kit_id, TrackingEntry.study_day).where(
+            TrackingEntry.kit_id.notin_(select(
+                ParticipantStreak.kit_id))).order_by(
+                    TrackingEntry.kit_id, TrackingEntry.study_day)).all()
+
+    streak = None
+    replayed = 0
+    for kit_id, study_day in tracked_days:
+        if streak is None or streak.kit_id != kit_id:
+            streak = ParticipantStreak(kit_id=kit_id,
+                                       current_streak=0,
+                                       best_streak=0)
+            db.session.add(streak)
+            replayed += 1
+            if replayed % BACKFILL_CHUNK_SIZE == 0:
+                db.session.commit()
+        streak.advance(study_day)
+    db.session.commit()
+    logging.info('Replayed streaks for %s participants', replayed)
+
+
+def add_daily_menu_version():
+    _add_column('daily_menu', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    _add_column('daily_menu', 'updated_at', 'TIMESTAMP')
+    _create_indexes(DailyMenu)
+
+
+def add_kit_code_indexes():
+    _create_indexes(KitCode)
+    # Prefix search (LIKE 'abc%') can only use a btree with pattern ops on
+    # PostgreSQL databases that do not use the C collation
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(
+            text('CREATE INDEX IF NOT EXISTS ix_kit_code_code_pattern '
+                 'ON kit_code (code varchar_pattern_ops)'))
+        db.session.commit()
+
+
+def add_tracking_entry_updated_at():
+    _add_column('tracking_entry', 'updated_at', 'TIMESTAMP')
+    # Rows written before the column existed count as changed when created
+    table = TrackingEntry.__table__
+    db.session.execute(
+        table.update().where(table.c.updated_at.is_(None)).values(
+            updated_at=func.coalesce(table.c.date, func.now())))
+    db.session.commit()
+    _create_indexes(TrackingEntry, 'ix_tracking_entry_updated_at_id')
+
+
+def add_sync_state_overlap_rows():
+    if inspect(db.engine).has_table('sync_state'):
+        _add_column('sync_state', 'overlap_rows', 'JSON')
+
+
+def backfill_daily_rollups():
+    # Aggregate the source tables once, then insert a rollup for every day
+    # that does not have one yet; rows kept by live saves are left alone
+    meal_counts = {}
+    for kit_id, study_day, meal_type, count in db.session.execute(
+            select(MealItem.kit_id, MealItem.study_day, MealItem.meal_type,
+                   func.count()).group_by(MealItem.kit_id, MealItem.study_day,
+                                          MealItem.meal_type)):
+        meal_counts[(kit_id, study_day, meal_type)] = count
+
+    stools = {}
+    for row in db.session.execute(
+            select(StoolEvent.kit_id, StoolEvent.study_day,
+                   func.count().label('stool_count'),
+                   func.coalesce(func.sum(StoolEvent.bristol_type),
+                                 0).label('bristol_sum'),
+                   func.count(StoolEvent.bristol_type).label(
+                       'bristol_count')).group_by(StoolEvent.kit_id,
+                                                  StoolEvent.study_day)):
+        stools[(row.kit_id, row.study_day)] = {
+            'stool_count': row.stool_count,
+            'bristol_sum': row.bristol_sum,
+            'bristol_count': row.bristol_count
+        }
+    # Ordered so the day's most recent event is the one left in the dict
+    for event in db.session.execute(
+            select(StoolEvent.kit_id, StoolEvent.study_day,
+                   StoolEvent.bristol_type, StoolEvent.relief,
+                   StoolEvent.smell, StoolEvent.timestamp).order_by(
+                       StoolEvent.kit_id, StoolEvent.study_day,
+                       StoolEvent.timestamp, StoolEvent.id)):
+        stools[(event.kit_id, event.study_day)].update(
+            last_bristol_type=event.bristol_type,
+            last_relief=event.relief,
+            last_smell=event.smell,
+            last_stool_at=event.timestamp)
+
+    table = TrackingEntry.__table__
+    last_id = 0
+    written = 0
+    while True:
+        entries = db.session.execute(
+            select(table.c.id, table.c.kit_id, table.c.study_day,
+                   table.c.mood, table.c.lifestyle_log).where(
+                       table.c.id > last_id).order_by(
+                           table.c.id).limit(BACKFILL_CHUNK_SIZE)).all()
+        if not entries:
+            break
+
+        rows = []
+        for entry in entries:
+            key = (entry.kit_id, entry.study_day)
+            row = dict(stools.get(key, {'stool_count': 0, 'bristol_sum': 0,
+                                        'bristol_count': 0}),
+                       kit_id=entry.kit_id,
+                       study_day=entry.study_day,
+                       mood=entry.mood)
+            if entry.lifestyle_log:
+                row.update(DailyRollup.lifestyle_flags(entry.lifestyle_log))
+            for meal_type in MEAL_TYPES:
+                row[f'{meal_type}_items'] = meal_counts.get(key + (meal_type, ))
+            rows.append(row)
+        # Every row carries the same keys so the insert stays one executemany
+        columns = set().union(*rows)
+        insert_missing(DailyRollup, [{
+            column: row.get(column)
+            for column in columns
+        } for row in rows], ['kit_id', 'study_day'])
+        db.session.commit()
+        written += len(rows)
+        last_id = entries[-1].id
+    logging.info('Checked daily rollups for %s tracking days', written)
+
+
+# Applied in order; every migration must be safe to run more than once.
+# Columns are added before any migration that loads the model through the
+# ORM, since those queries select every mapped column
+MIGRATIONS = [
+    add_tracking_entry_updated_at,
+    add_tracking_entry_study_day,
+    explode_stool_entries,
+    add_daily_menu_version,
+    build_food_catalog,
+    add_community_stats_counters,
+    backfill_participant_streaks,
+    add_kit_code_indexes,
+    backfill_daily_rollups,
+    add_sync_state_overlap_rows,
+]
+
+def run_migrations():
+    # Tables added since the database was created must exist before the
+    # migrations fill them; create_all leaves existing tables alone
+    db.create_all()
+    for migration in MIGRATIONS:
+        logging.info('Running migration %s', migration.__name__)
+        migration()
@@ -1,7 +1,29 @@
-from database import db
+from database import db, insert_missing, upsert
 import uuid
 from datetime import datetime, timedelta, time
 
+RESET_TIME = time(3, 0)  # 3 AM reset time
+NEW_DAY_END = time(12, 0)
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner']
+LIFESTYLE_FIELDS = ['yoga', 'gym', 'swimming', 'meditation']
+MOOD_FIELDS = ['morning_mood', 'meal_mood', 'energy_level', 'evening_mood',
+               'overall_mood']
+
+
+def get_study_day(now=None):
+    # Entries logged before the reset time still belong to the previous day
+    now = now or datetime.now()
+    study_day = now.date()
+    if now.time() < RESET_TIME:
+        study_day = study_day - timedelta(days=1)
+    return study_day
+
+
+def in_new_day_window(now=None):
+    # Between the reset time and noon the day's logging starts over
+    current_time = (now or datetime.now()).time()
+    return RESET_TIME <= current_time <= NEW_DAY_END
+
 class AnonymousUser(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     kit_id = db.Column(db.String(36), unique=True, nullable=False)
@@ -20,17 +42,27 @@ class Admin(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
 
 class DailyMenu(db.Model):
+    __table_args__ = (db.Index('ix_daily_menu_date', 'date'), )
+
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
     menu_data = db.Column(db.JSON, nullable=False)
+    # Bumped on every change; shared cache stamp for all workers
+    version = db.Column(db.Integer, nullable=False, default=1)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, server_default=db.func.now())
     created_by = db.Column(db.Integer, db.ForeignKey('admin.id'), nullable=False)
 
     @classmethod
     def get_menu_for_date(cls, date):
-        return cls.query.filter_by(date=date).first()
+        return cls.query.filter_by(date=date).order_by(cls.id.desc()).first()
 
 class KitCode(db.Model):
+    __table_args__ = (
+        db.Index('ix_kit_code_created_at_id', 'created_at', 'id'),
+        db.Index('ix_kit_code_batch_name', 'batch_name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(36), unique=True, nullable=False)
     batch_name = db.Column(db.String(100), nullable=False)
@@ -39,9 +71,17 @@ class KitCode(db.Model):
     is_active = db.Column(db.Boolean, default=True)
 
 class TrackingEntry(db.Model):
+    __table_args__ = (
+        db.Index('ix_tracking_entry_kit_study_day', 'kit_id', 'study_day',
+                 unique=True),
+        db.Index('ix_tracking_entry_updated_at_id', 'updated_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     kit_id = db.Column(db.String(36), nullable=False)
     date = db.Column(db.DateTime, server_default=db.func.now())
+    study_day = db.Column(db.Date, nullable=False,
+                          default=lambda: get_study_day())
     meals = db.Column(db.JSON)
     stool_entries = db.Column(db.JSON)
     mood = db.Column(db.Integer)
@@ -51,79 +91,346 @@ class TrackingEntry(db.Model):
     best_streak = db.Column(db.Integer, default=0)
     last_tracked_date = db.Column(db.DateTime)
     lifestyle_log = db.Column(db.JSON)  
+    # Set by every upsert; incremental syncs read rows changed after a mark
+    updated_at = db.Column(db.DateTime, server_default=db.func.now())
 
-    def update_streak(self):
-        today = datetime.now().date()
-        current_time = datetime.now().time()
-        reset_time = time(3, 0)  # 3 AM reset time
+    @classmethod
+    def get_for_day(cls, kit_id, study_day=None):
+        return cls.query.filter_by(
+            kit_id=kit_id, study_day=study_day or get_study_day()).first()
 
-        # If it's before reset time, consider it as previous day
-        if current_time < reset_time:
-            today = today - timedelta(days=1)
+    @classmethod
+    def upsert_day(cls, kit_id, study_day, **values):
+        # One INSERT ... ON CONFLICT touching only this participant's day row
+        return upsert(
+            cls, ['kit_id', 'study_day'],
+            dict(values,
+                 kit_id=kit_id,
+                 study_day=study_day,
+                 updated_at=db.func.now()))
 
-        if not self.last_tracked_date:
-            self.current_streak = 1
-            self.best_streak = 1
-            self.last_tracked_date = today
-            return
 
-        last_date = self.last_tracked_date.date()
-        days_diff = (today - last_date).days
+class ParticipantStreak(db.Model):
+    MILESTONES = [7, 30, 100]
 
-        if days_diff == 0:
-            # Same day, no streak update needed
-            return
-        elif days_diff == 1:
-            # Consecutive day
-            self.current_streak += 1
-            if self.current_streak > self.best_streak:
-                self.best_streak = self.current_streak
+    kit_id = db.Column(db.String(36), primary_key=True)
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    best_streak = db.Column(db.Integer, nullable=False, default=0)
+    last_study_day = db.Column(db.Date)
+    milestones_hit = db.Column(db.JSON)
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    def advance(self, study_day):
+        # Count ``study_day`` as tracked, in the order days are logged
+        if self.last_study_day is not None:
+            days_diff = (study_day - self.last_study_day).days
+            if days_diff <= 0:
+                # Same day (or an older one), no streak update needed
+                return
+            elif days_diff == 1:
+                # Consecutive day
+                self.current_streak = (self.current_streak or 0) + 1
+            else:
+                # Streak broken
+                self.current_streak = 1
         else:
-            # Streak broken
             self.current_streak = 1
 
-        self.last_tracked_date = today
+        self.best_streak = max(self.best_streak or 0, self.current_streak)
+        self.last_study_day = study_day
+        hit = list(self.milestones_hit or [])
+        for milestone in self.MILESTONES:
+            if self.current_streak >= milestone and milestone not in hit:
+                hit.append(milestone)
+        self.milestones_hit = hit
+
+    @classmethod
+    def record_activity(cls, kit_id, study_day=None):
+        # Make sure the row exists, then lock it for the rest of the save's
+        # transaction so concurrent saves advance the streak one at a time
+        insert_missing(cls, [{
+            'kit_id': kit_id,
+            'current_streak': 0,
+            'best_streak': 0
+        }], ['kit_id'])
+        streak = db.session.get(cls, kit_id, with_for_update=True,
+                                populate_existing=True)
+        streak.advance(study_day or get_study_day())
+        return streak
+
+    def to_dict(self, today=None):
+        today = today or get_study_day()
+        current_streak = self.current_streak or 0
+        # A streak is broken once a whole study day passes without logging
+        if self.last_study_day is None or (today - self.last_study_day).days > 1:
+            current_streak = 0
+
+        return {
+            'current_streak': current_streak,
+            'best_streak': self.best_streak or 0,
+            'last_study_day': self.last_study_day.isoformat()
+            if self.last_study_day else None,
+            'milestones_hit': self.milestones_hit or [],
+            'next_milestone': next(
+                (m for m in self.MILESTONES if m > current_streak),
+                self.MILESTONES[-1]),
+            'achievement_unlocked': current_streak in self.MILESTONES
+        }
 
     @classmethod
-    def get_user_streaks(cls, kit_id):
-        # Get the current time and determine if we're before reset time
-        current_time = datetime.now().time()
-        reset_time = time(3, 0)
+    def get_info(cls, kit_id, today=None):
+        streak = db.session.get(cls, kit_id)
+        return (streak or cls(kit_id=kit_id)).to_dict(today)
+
 
-        # If before reset time, use yesterday's date for checking
-        check_date = datetime.now().date()
-        if current_time < reset_time:
-            check_date = check_date - timedelta(days=1)
+class StoolEvent(db.Model):
+    __table_args__ = (
+        db.Index('ix_stool_event_kit_study_day', 'kit_id', 'study_day'),
+        db.Index('ix_stool_event_study_day', 'study_day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kit_id = db.Column(db.String(36), nullable=False)
+    study_day = db.Column(db.Date, nullable=False,
+                          default=lambda: get_study_day())
+    bristol_type = db.Column(db.SmallInteger)
+    relief = db.Column(db.SmallInteger)
+    smell = db.Column(db.SmallInteger)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
-        latest_entry = cls.query.filter_by(kit_id=kit_id).order_by(cls.date.desc()).first()
-        if not latest_entry:
-            return {
-                'current_streak': 0,
-                'best_streak': 0,
-                'achievement_unlocked': False
+    @staticmethod
+    def parse_scale(value, low, high):
+        # Form values arrive as strings or ints; anything outside the scale is rejected
+        if value in (None, ''):
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f'Invalid value: {value}')
+        if not low <= value <= high:
+            raise ValueError(f'Value out of range: {value}')
+        return value
+
+    @classmethod
+    def exists_for_day(cls, kit_id, study_day=None):
+        return db.session.query(
+            cls.query.filter_by(kit_id=kit_id,
+                                study_day=study_day
+                                or get_study_day()).exists()).scalar()
+
+    @classmethod
+    def latest_by_day(cls, kit_id, start_day, end_day):
+        events = cls.query.filter(cls.kit_id == kit_id,
+                                  cls.study_day >= start_day,
+                                  cls.study_day <= end_day).order_by(
+                                      cls.study_day, cls.timestamp, cls.id)
+        # Later events overwrite earlier ones, leaving the day's most recent
+        return {event.study_day: event for event in events}
+
+    def to_dict(self):
+        # Same shape as the legacy TrackingEntry.stool_entries items
+        return {
+            'type': str(self.bristol_type) if self.bristol_type else None,
+            'timestamp': self.timestamp.isoformat(),
+            'details': {
+                'relief': self.relief,
+                'smell': self.smell
             }
+        }
+
+def iter_food_selections(categories):
+    # Meal categories hold either {item: {}} (menus) or [item, ...] (saved meals)
+    for category, items in (categories or {}).items():
+        if isinstance(items, dict):
+            items = items.keys()
+        elif not isinstance(items, list):
+            continue
+        for name in items:
+            if isinstance(name, str) and name.strip():
+                yield category, name.strip()
+
+
+class FoodItem(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('category', 'name',
+                            name='uq_food_item_category_name'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    @classmethod
+    def ids_for(cls, pairs):
+        # Map (category, name) pairs to ids, adding unseen foods to the catalog
+        pairs = set(pairs)
+        if not pairs:
+            return {}
+
+        def lookup():
+            names = {name for _, name in pairs}
+            rows = db.session.execute(
+                db.select(cls.id, cls.category,
+                          cls.name).where(cls.name.in_(names))).all()
+            return {(row.category, row.name): row.id
+                    for row in rows if (row.category, row.name) in pairs}
+
+        ids = lookup()
+        missing = pairs - ids.keys()
+        if missing:
+            insert_missing(cls, [{
+                'category': category,
+                'name': name
+            } for category, name in missing], ['category', 'name'])
+            ids = lookup()
+        return ids
+
+    @classmethod
+    def sync_from_menu(cls, menu_data):
+        # Skip placeholder options such as "No dessert", the tracker hides them too
+        return cls.ids_for(
+            (category, name) for meal in (menu_data or {}).values()
+            if isinstance(meal, dict)
+            for category, name in iter_food_selections(meal)
+            if not name.lower().startswith('no '))
+
+
+class MealItem(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('kit_id', 'study_day', 'meal_type', 'food_id',
+                            name='uq_meal_item_kit_day_meal_food'),
+        db.Index('ix_meal_item_food_study_day', 'food_id', 'study_day'),
+        db.Index('ix_meal_item_study_day', 'study_day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kit_id = db.Column(db.String(36), nullable=False)
+    study_day = db.Column(db.Date, nullable=False)
+    meal_type = db.Column(db.String(10), nullable=False)
+    food_id = db.Column(db.Integer,
+                        db.ForeignKey('food_item.id'),
+                        nullable=False)
+
+    @classmethod
+    def replace_meal(cls, kit_id, study_day, meal_type, foods):
+        # Rewrite one meal's fact rows with a DELETE and a single executemany
+        food_ids = FoodItem.ids_for(iter_food_selections(foods))
+        db.session.execute(
+            db.delete(cls).where(cls.kit_id == kit_id,
+                                 cls.study_day == study_day,
+                                 cls.meal_type == meal_type))
+        food_ids = set(food_ids.values())
+        if food_ids:
+            db.session.execute(db.insert(cls), [{
+                'kit_id': kit_id,
+                'study_day': study_day,
+                'meal_type': meal_type,
+                'food_id': food_id
+            } for food_id in food_ids])
+        return len(food_ids)
 
-        # Check if latest entry is from check_date
-        if latest_entry.date.date() < check_date:
-            # User hasn't tracked today yet, but might still be within the streak window
-            days_missed = (check_date - latest_entry.date.date()).days
-            if days_missed > 1:
-                latest_entry.current_streak = 0
+class DailyRollup(db.Model):
+    # One narrow row per participant-day, kept current by every save so
+    # charts never have to load the JSON columns of TrackingEntry
+    __table_args__ = (
+        db.Index('ix_daily_rollup_kit_study_day', 'kit_id', 'study_day',
+                 unique=True),
+    )
 
-        achievement_unlocked = latest_entry.current_streak in [7, 30, 100]
+    id = db.Column(db.Integer, primary_key=True)
+    kit_id = db.Column(db.String(36), nullable=False)
+    study_day = db.Column(db.Date, nullable=False)
+    mood = db.Column(db.Float)
+    stool_count = db.Column(db.Integer, nullable=False, default=0)
+    bristol_sum = db.Column(db.Integer, nullable=False, default=0)
+    bristol_count = db.Column(db.Integer, nullable=False, default=0)
+    # The day's most recent stool event
+    last_bristol_type = db.Column(db.SmallInteger)
+    last_relief = db.Column(db.SmallInteger)
+    last_smell = db.Column(db.SmallInteger)
+    last_stool_at = db.Column(db.DateTime)
+    breakfast_items = db.Column(db.SmallInteger)
+    lunch_items = db.Column(db.SmallInteger)
+    dinner_items = db.Column(db.SmallInteger)
+    yoga = db.Column(db.Boolean)
+    gym = db.Column(db.Boolean)
+    swimming = db.Column(db.Boolean)
+    meditation = db.Column(db.Boolean)
+
+    @classmethod
+    def record(cls, kit_id, study_day, **values):
+        # Columns given are overwritten, the rest of the row is left alone
+        upsert(cls, ['kit_id', 'study_day'],
+               dict(values, kit_id=kit_id, study_day=study_day))
 
+    @classmethod
+    def record_stool(cls, kit_id, study_day, event):
+        # Counters grow atomically, so concurrent stool saves are all counted
+        has_type = 1 if event.bristol_type is not None else 0
+        last = {
+            'last_bristol_type': event.bristol_type,
+            'last_relief': event.relief,
+            'last_smell': event.smell,
+            'last_stool_at': event.timestamp
+        }
+        upsert(cls, ['kit_id', 'study_day'],
+               dict(last,
+                    kit_id=kit_id,
+                    study_day=study_day,
+                    stool_count=1,
+                    bristol_sum=event.bristol_type or 0,
+                    bristol_count=has_type),
+               update=dict(last,
+                           stool_count=cls.stool_count + 1,
+                           bristol_sum=cls.bristol_sum +
+                           (event.bristol_type or 0),
+                           bristol_count=cls.bristol_count + has_type))
+
+    @staticmethod
+    def lifestyle_flags(lifestyle_log):
+        lifestyle_log = lifestyle_log if isinstance(lifestyle_log, dict) else {}
         return {
-            'current_streak': latest_entry.current_streak,
-            'best_streak': latest_entry.best_streak,
-            'achievement_unlocked': achievement_unlocked
+            field: bool(lifestyle_log.get(field))
+            for field in LIFESTYLE_FIELDS
         }
 
+    @classmethod
+    def for_window(cls, kit_id, start_day, end_day):
+        return db.session.execute(
+            db.select(cls.study_day, cls.mood, cls.stool_count,
+                      cls.bristol_sum, cls.bristol_count,
+                      cls.last_bristol_type, cls.last_relief, cls.last_smell,
+                      cls.last_stool_at, cls.breakfast_items,
+                      cls.lunch_items, cls.dinner_items).where(
+                          cls.kit_id == kit_id,
+                          cls.study_day.between(start_day, end_day)).order_by(
+                              cls.study_day)).all()
+
+
 class CommunityStats(db.Model):
+    BRISTOL_TYPES = range(1, 8)
+
+    __table_args__ = (
+        db.Index('ix_community_stats_date', 'date', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
     avg_mood = db.Column(db.Float)
     most_common_stool_type = db.Column(db.String(10))
-    total_participants = db.Column(db.Integer)
+    total_participants = db.Column(db.Integer, default=0)
+    # Running counters behind the derived columns above
+    mood_sum = db.Column(db.Float, default=0)
+    mood_count = db.Column(db.Integer, default=0)
+    stool_count = db.Column(db.Integer, default=0)
+    bristol_1 = db.Column(db.Integer, default=0)
+    bristol_2 = db.Column(db.Integer, default=0)
+    bristol_3 = db.Column(db.Integer, default=0)
+    bristol_4 = db.Column(db.Integer, default=0)
+    bristol_5 = db.Column(db.Integer, default=0)
+    bristol_6 = db.Column(db.Integer, default=0)
+    bristol_7 = db.Column(db.Integer, default=0)
     updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
 
     @classmethod
@@ -132,4 +439,201 @@ class CommunityStats(db.Model):
         if not stats:
             stats = cls(date=date)
             db.session.add(stats)
-        return stats
\ No newline at end of file
+        return stats
+
+    @classmethod
+    def record(cls, study_day, new_participant=False, mood=None,
+               previous_mood=None, bristol_type=None):
+        # Apply one participant's save to the day's counters in a single
+        # atomic upsert, so concurrent saves never lose an increment
+        deltas = {}
+        if new_participant:
+            deltas['total_participants'] = 1
+        if mood is not None:
+            deltas['mood_sum'] = mood - (previous_mood or 0)
+            if previous_mood is None:
+                deltas['mood_count'] = 1
+        if bristol_type in cls.BRISTOL_TYPES:
+            deltas['stool_count'] = 1
+            deltas[f'bristol_{bristol_type}'] = 1
+        if not deltas:
+            return
+
+        update = {
+            column: getattr(cls, column) + delta
+            for column, delta in deltas.items()
+        }
+        update['updated_at'] = db.func.now()
+        values = dict(deltas, date=study_day)
+
+        if 'mood_sum' in deltas:
+            mood_count = cls.mood_count + deltas.get('mood_count', 0)
+            update['avg_mood'] = db.case(
+                (mood_count > 0, (cls.mood_sum + deltas['mood_sum']) /
+                 mood_count),
+                else_=None)
+            if deltas.get('mood_count'):
+                values['avg_mood'] = float(mood)
+
+        if 'stool_count' in deltas:
+            # Only this type's count grows, so it either takes over as the
+            # most common type or the current one stays
+            current_count = db.case(
+                *[(cls.most_common_stool_type == str(t),
+                   getattr(cls, f'bristol_{t}')) for t in cls.BRISTOL_TYPES],
+                else_=0)
+            update['most_common_stool_type'] = db.case(
+                (getattr(cls, f'bristol_{bristol_type}') + 1 > current_count,
+                 str(bristol_type)),
+                else_=cls.most_common_stool_type)
+            values['most_common_stool_type'] = str(bristol_type)
+
+        upsert(cls, ['date'], values, update=update)
+
+    @classmethod
+    def rebuild(cls, start_day, end_day):
+        # Recompute every day in the range from the source tables
+        days = {}
+        participants = db.session.execute(
+            db.select(TrackingEntry.study_day, db.func.count(),
+                      db.func.sum(TrackingEntry.mood),
+                      db.func.count(TrackingEntry.mood)).where(
+                          TrackingEntry.study_day.between(
+                              start_day, end_day)).group_by(
+                                  TrackingEntry.study_day))
+        for study_day, total, mood_sum, mood_count in participants:
+            days[study_day] = {
+                'total_participants': total,
+                'mood_sum': float(mood_sum or 0),
+                'mood_count': mood_count,
+                'avg_mood': mood_sum / mood_count if mood_count else None
+            }
+
+        histograms = db.session.execute(
+            db.select(StoolEvent.study_day, StoolEvent.bristol_type,
+                      db.func.count()).where(
+                          StoolEvent.study_day.between(start_day, end_day),
+                          StoolEvent.bristol_type.isnot(None)).group_by(
+                              StoolEvent.study_day, StoolEvent.bristol_type))
+        for study_day, bristol_type, count in histograms:
+            day = days.setdefault(study_day, {'total_participants': 0})
+            day[f'bristol_{bristol_type}'] = count
+
+        for study_day, day in days.items():
+            counts = {
+                t: day.setdefault(f'bristol_{t}', 0)
+                for t in cls.BRISTOL_TYPES
+            }
+            day['stool_count'] = sum(counts.values())
+            day['most_common_stool_type'] = str(
+                max(counts, key=counts.get)) if day['stool_count'] else None
+            day.setdefault('mood_sum', 0)
+            day.setdefault('mood_count', 0)
+            day.setdefault('avg_mood', None)
+            upsert(cls, ['date'], dict(day, date=study_day))
+
+        # Days that no longer have any data are cleared
+        db.session.execute(
+            db.delete(cls).where(cls.date.between(start_day, end_day),
+                                 cls.date.notin_(list(days))))
+        return len(days)
+
+
+class SyncEvent(db.Model):
+    # One row per client idempotency key, written in the same transaction as
+    # the save it describes so a replayed event returns the stored result
+    __table_args__ = (
+        db.Index('ix_sync_event_kit_event', 'kit_id', 'event_id', unique=True),
+        db.Index('ix_sync_event_created_at', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kit_id = db.Column(db.String(36), nullable=False)
+    event_id = db.Column(db.String(64), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.SmallInteger, nullable=False)
+    response = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    @classmethod
+    def lookup(cls, kit_id, event_ids):
+        if not event_ids:
+            return {}
+        rows = db.session.execute(
+            db.select(cls).where(cls.kit_id == kit_id,
+                                 cls.event_id.in_(event_ids))).scalars()
+        return {row.event_id: row for row in rows}
+
+
+class SyncState(db.Model):
+    # High-water mark of an incremental export job, one row per job
+    name = db.Column(db.String(50), primary_key=True)
+    high_water_at = db.Column(db.DateTime)
+    high_water_id = db.Column(db.Integer)
+    # [id, updated_at, digest] of rows already sent that the next run's
+    # overlap re-reads; they are skipped unless their values have changed
+    overlap_rows = db.Column(db.JSON)
+    rows_synced = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+
+def get_today_status(kit_id, now=None):
+    # Everything the dashboard shows for the current study day, fetched in a
+    # single statement: today's entry and the streak row are outer-joined to
+    # a one-row base so the query returns a row even before anything is logged
+    study_day = get_study_day(now)
+    base = db.select(db.literal(1).label('one')).subquery()
+    entry = db.select(TrackingEntry.meals, TrackingEntry.mood_details,
+                      TrackingEntry.lifestyle_log).where(
+                          TrackingEntry.kit_id == kit_id,
+                          TrackingEntry.study_day == study_day).subquery()
+    streak = db.select(ParticipantStreak.current_streak,
+                       ParticipantStreak.best_streak,
+                       ParticipantStreak.last_study_day,
+                       ParticipantStreak.milestones_hit).where(
+                           ParticipantStreak.kit_id == kit_id).subquery()
+    stool_logged = db.select(StoolEvent.id).where(
+        StoolEvent.kit_id == kit_id,
+        StoolEvent.study_day == study_day).exists()
+    menu_version = db.select(DailyMenu.version).where(
+        DailyMenu.date == study_day).order_by(
+            DailyMenu.id.desc()).limit(1).scalar_subquery()
+
+    row = db.session.execute(
+        db.select(entry.c.meals, entry.c.mood_details, entry.c.lifestyle_log,
+                  streak.c.current_streak, streak.c.best_streak,
+                  streak.c.last_study_day, streak.c.milestones_hit,
+                  stool_logged.label('stool_logged'),
+                  menu_version.label('menu_version')).select_from(base).outerjoin(
+                      entry, db.true()).outerjoin(streak, db.true())).one()
+
+    is_new_day = in_new_day_window(now)
+    meals = row.meals or {}
+    breakfast_logged = 'breakfast' in meals
+    lunch_logged = 'lunch' in meals
+    dinner_logged = 'dinner' in meals
+
+    # Reset unlogged meals during new day
+    if is_new_day and not breakfast_logged:
+        lunch_logged = False
+        dinner_logged = False
+
+    streak_info = ParticipantStreak(
+        kit_id=kit_id,
+        current_streak=row.current_streak,
+        best_streak=row.best_streak,
+        last_study_day=row.last_study_day,
+        milestones_hit=row.milestones_hit).to_dict(study_day)
+
+    return {
+        'study_day': study_day.isoformat(),
+        'is_new_day': is_new_day,
+        'breakfast_logged': breakfast_logged,
+        'lunch_logged': lunch_logged,
+        'dinner_logged': dinner_logged,
+        'stool_logged': bool(row.stool_logged),
+        'mood_logged': bool(row.mood_details),
+        'lifestyle_logged': bool(row.lifestyle_log),
+        'streak': streak_info,
+        'menu_version': row.menu_version
+    }
@@ -0,0 +1,240 @@
+import glob
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from database import db
+from analysis import build_feature_matrix, shift_days
+from models import AnonymousUser, KitCode, get_study_day
+
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join('instance', 'models'))
+TARGETS = ['bristol_mean', 'mood']
+# Features are the day itself plus the average of the last few logged days
+RECENT_DAYS = 3
+RIDGE_LAMBDA = 1.0
+ARTIFACT_PATTERN = re.compile(r'model-v(\d+)\.npz$')
+
+
+@dataclass
+class RidgeModel:
+    """Ridge regression kept as sufficient statistics.
+
+    Only X'X, X'y and the sums are stored, so new days are folded in by
+    adding their statistics, and the coefficients are re-solved in closed
+    form. The result is exactly a full retrain over every day seen so far.
+    """
+    features: list
+    xtx: np.ndarray
+    xty: np.ndarray
+    sx: np.ndarray
+    sy: np.ndarray
+    n: np.ndarray
+    trained_through: date = None
+    version: int = 0
+    lam: float = RIDGE_LAMBDA
+
+    @classmethod
+    def empty(cls, features, lam=RIDGE_LAMBDA):
+        p, k = len(features), len(TARGETS)
+        return cls(features=list(features),
+                   xtx=np.zeros((k, p, p)),
+                   xty=np.zeros((k, p)),
+                   sx=np.zeros((k, p)),
+                   sy=np.zeros(k),
+                   n=np.zeros(k),
+                   lam=lam)
+
+    def update(self, x, y):
+        # Each target only learns from the rows where it was observed
+        for t in range(len(TARGETS)):
+            observed = ~np.isnan(y[:, t])
+            xt, yt = x[observed], y[observed, t]
+            self.xtx[t] += xt.T @ xt
+            self.xty[t] += xt.T @ yt
+            self.sx[t] += xt.sum(axis=0)
+            self.sy[t] += yt.sum()
+            self.n[t] += len(yt)
+
+    def coefficients(self):
+        """Intercepts and weights, solved on standardized features."""
+        p = len(self.features)
+        intercepts = np.full(len(TARGETS), np.nan)
+        weights = np.zeros((len(TARGETS), p))
+        for t in range(len(TARGETS)):
+            n = self.n[t]
+            if n < 2:
+                continue
+            mean, y_mean = self.sx[t] / n, self.sy[t] / n
+            cov = self.xtx[t] / n - np.outer(mean, mean)
+            sd = np.sqrt(np.clip(np.diag(cov), 0, None))
+            varying = sd > 1e-9
+            scale = np.where(varying, sd, 1.0)
+            cov_s = cov / np.outer(scale, scale)
+            xy_s = (self.xty[t] / n - mean * y_mean) / scale
+            # Constant columns carry no signal; pin their weights to zero
+            cov_s[~varying, :] = 0
+            cov_s[:, ~varying] = 0
+            xy_s[~varying] = 0
+            beta_s = np.linalg.solve(cov_s + (self.lam / n) * np.eye(p), xy_s)
+            weights[t] = beta_s / scale
+            intercepts[t] = y_mean - mean @ weights[t]
+        return intercepts, weights
+
+    def predict(self, x):
+        intercepts, weights = self.coefficients()
+        return x @ weights.T + intercepts
+
+    def save(self, directory=MODEL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'model-v{self.version:04d}.npz')
+        np.savez(path,
+                 features=np.array(self.features, dtype=str),
+                 targets=np.array(TARGETS, dtype=str),
+                 xtx=self.xtx,
+                 xty=self.xty,
+                 sx=self.sx,
+                 sy=self.sy,
+                 n=self.n,
+                 lam=self.lam,
+                 version=self.version,
+                 trained_through=str(self.trained_through or ''),
+                 created_at=datetime.now().isoformat())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            trained_through = str(data['trained_through'])
+            return cls(features=[str(name) for name in data['features']],
+                       xtx=data['xtx'],
+                       xty=data['xty'],
+                       sx=data['sx'],
+                       sy=data['sy'],
+                       n=data['n'],
+                       lam=float(data['lam']),
+                       version=int(data['version']),
+                       trained_through=date.fromisoformat(trained_through)
+                       if trained_through else None)
+
+
+def _artifacts(directory):
+    for path in glob.glob(os.path.join(directory, 'model-v*.npz')):
+        match = ARTIFACT_PATTERN.search(path)
+        if match:
+            yield int(match.group(1)), path
+
+
+def _latest_version(directory=MODEL_DIR):
+    return max((version for version, _ in _artifacts(directory)), default=0)
+
+
+def latest_artifact(directory=MODEL_DIR):
+    artifacts = sorted(_artifacts(directory))
+    return artifacts[-1][1] if artifacts else None
+
+
+def load_latest(directory=MODEL_DIR):
+    path = latest_artifact(directory)
+    return RidgeModel.load(path) if path else None
+
+
+def build_features(matrix):
+    """Per participant-day model inputs: the day and its recent average."""
+    filled = matrix.fillna(0.0)
+    recent = filled.groupby(level='kit_id').rolling(
+        RECENT_DAYS, min_periods=1).mean().droplevel(0)
+    return pd.concat([filled, recent.add_prefix(f'recent{RECENT_DAYS}:')],
+                     axis=1)
+
+
+def training_rows(features, matrix, after=None, before=None):
+    # Features on day d paired with targets observed on day d + 1. Only
+    # target days before ``before`` are used, so a day is learnt once it is
+    # complete and never needs to be revisited
+    targets = shift_days(matrix[TARGETS], 1).reindex(features.index)
+    target_day = pd.to_datetime(features.index.get_level_values(
+        'study_day')) + pd.Timedelta(days=1)
+    keep = targets.notna().any(axis=1).to_numpy()
+    if after is not None:
+        keep = keep & (target_day > pd.Timestamp(after))
+    if before is not None:
+        keep = keep & (target_day < pd.Timestamp(before))
+    return features[keep], targets[keep]
+
+
+def train(full=False, directory=MODEL_DIR, today=None):
+    """Fold completed days into the latest model and save a new version.
+
+    Warm starts from the newest artifact and only adds target days after
+    its ``trained_through``; ``full`` starts over, which also picks up
+    foods added to the catalogue since the model was first trained.
+    Returns None when there is nothing new to learn from.
+    """
+    today = today or get_study_day()
+    matrix = build_feature_matrix()
+    if matrix.empty:
+        return None
+    features = build_features(matrix)
+
+    previous = None if full else load_latest(directory)
+    if previous is None:
+        model = RidgeModel.empty(features.columns)
+        after = None
+    else:
+        model = previous
+        after = previous.trained_through
+
+    x, y = training_rows(features, matrix, after=after, before=today)
+    if not len(x):
+        return None
+    x = x.reindex(columns=model.features, fill_value=0.0)
+    model.update(x.to_numpy(dtype='float64'), y.to_numpy(dtype='float64'))
+    model.trained_through = max(
+        x.index.get_level_values('study_day')) + timedelta(days=1)
+    model.version = _latest_version(directory) + 1
+    model.save(directory)
+    return model
+
+
+def active_kits():
+    return set(
+        db.session.execute(
+            db.select(AnonymousUser.kit_id).join(
+                KitCode, KitCode.code == AnonymousUser.kit_id).where(
+                    KitCode.is_active.is_(True))).scalars())
+
+
+def score_active_kits(model=None):
+    """Next-day predictions for every active participant in one pass.
+
+    Each participant is scored from their most recent logged day, and the
+    whole cohort is a single matrix product.
+    """
+    model = model or load_latest()
+    if model is None:
+        return []
+    matrix = build_feature_matrix()
+    if matrix.empty:
+        return []
+    features = build_features(matrix)
+
+    kits = features.index.get_level_values('kit_id')
+    latest = features[kits.isin(active_kits())].groupby(level='kit_id').tail(1)
+    predictions = model.predict(
+        latest.reindex(columns=model.features,
+                       fill_value=0.0).to_numpy(dtype='float64'))
+
+    results = []
+    for (kit_id, study_day), values in zip(latest.index, predictions):
+        result = {
+            'kit_id': kit_id,
+            'based_on': study_day.isoformat(),
+            'model_version': model.version
+        }
+        for target, value in zip(TARGETS, values):
+            result[f'predicted_{target}'] = None if np.isnan(value) else round(
+                float(value), 2)
+        results.append(result)
+    return results
@@ -0,0 +1,13 @@
+import os
+
+
+def alive(pid):
+    # Signal 0 only checks that the pid exists; a process owned by another
+    # user counts as alive
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
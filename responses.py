@@ -0,0 +1,143 @@
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this fit in a packet or two; compressing them only
+# costs CPU
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESS_MIMETYPES = ('application/json', 'text/html')
+GZIP_LEVEL = 6
+# Brotli's top levels are meant for static files, 5 suits per-request work
+BROTLI_QUALITY = 5
+# Compressed bodies of responses with a strong ETag, which names the content
+COMPRESSED_CACHE_SIZE = 64
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson when it is installed.
+
+    Anything orjson cannot encode natively (dates, decimals, ...) goes
+    through Flask's default hook, so the output matches the stdlib
+    provider; without orjson this is the stdlib provider.
+    """
+    # Key order carries no meaning for the clients and sorting is not free
+    sort_keys = False
+
+    def _orjson_option(self, indent=False):
+        option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY |
+                  orjson.OPT_PASSTHROUGH_DATETIME)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _encode(self, obj, indent=False):
+        # Bytes from orjson, or None when the stdlib encoder has to take over
+        if orjson is None:
+            return None
+        try:
+            return orjson.dumps(obj,
+                                default=self.default,
+                                option=self._orjson_option(indent))
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits
+            return None
+
+    def dumps(self, obj, **kwargs):
+        if not kwargs:
+            encoded = self._encode(obj)
+            if encoded is not None:
+                return encoded.decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and
+                                          self._app.debug)
+        encoded = self._encode(obj, indent)
+        if encoded is None:
+            return super().response(obj)
+        return self._app.response_class(encoded + b'\n',
+                                        mimetype=self.mimetype)
+
+
+_compressed = OrderedDict()
+_lock = threading.Lock()
+
+
+def negotiate_encoding(accept_encodings):
+    # Brotli when the client takes it and the module is installed, else gzip
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(data, coding):
+    if coding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _should_compress(response):
+    return (response.mimetype in COMPRESS_MIMETYPES and
+            200 <= response.status_code < 300 and
+            response.status_code != 204 and not response.direct_passthrough
+            and not response.is_streamed and
+            'Content-Encoding' not in response.headers)
+
+
+def compress_response(response, accept_encodings):
+    """Compress a JSON or HTML response body for the negotiated encoding."""
+    if not _should_compress(response):
+        return response
+    # The body differs by Accept-Encoding even when it is left as is
+    response.vary.add('Accept-Encoding')
+
+    coding = negotiate_encoding(accept_encodings)
+    if coding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    etag, weak = response.get_etag()
+    key = (etag, coding) if etag and not weak else None
+    with _lock:
+        body = _compressed.get(key) if key else None
+        if body is not None:
+            _compressed.move_to_end(key)
+    if body is None:
+        body = _compress(data, coding)
+        if key:
+            with _lock:
+                _compressed[key] = body
+                while len(_compressed) > COMPRESSED_CACHE_SIZE:
+                    _compressed.popitem(last=False)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = coding
+    # The encoded bytes are a different representation of the same content,
+    # which a weak validator still describes
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
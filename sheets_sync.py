@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import time as clock
+from datetime import date, datetime, timedelta
+from database import db
+from export import DAY_COLUMNS, day_query, day_record
+from models import SyncState, TrackingEntry
+
+SYNC_NAME = 'google_sheets_days'
+# Rows per Sheets API call; one call per chunk stays far below the cell limit
+SHEETS_BATCH_ROWS = 500
+# Sheets allows 60 write requests per minute per user
+SHEETS_MIN_INTERVAL = float(os.environ.get('SHEETS_MIN_INTERVAL', 1.0))
+# Rows committed by a transaction that started before the last run finished
+# can carry an older updated_at, so each run re-reads this much overlap
+SYNC_OVERLAP = timedelta(minutes=5)
+
+HEADER = list(DAY_COLUMNS)
+KEY_COLUMNS = 2  # kit_id, study_day
+
+
+class MemorySheet:
+    """In-memory stand-in for a worksheet, for tests and dry runs."""
+
+    def __init__(self, rows=None):
+        self.rows = [list(row) for row in rows or []]
+        self.calls = []
+
+    def read_header_and_keys(self):
+        self.calls.append('read')
+        header = self.rows[0] if self.rows else []
+        return header, [row[:KEY_COLUMNS] for row in self.rows[1:]]
+
+    def write_header(self, header):
+        self.calls.append('header')
+        if self.rows:
+            self.rows[0] = list(header)
+        else:
+            self.rows.append(list(header))
+
+    def update_rows(self, updates):
+        self.calls.append('update')
+        for row_number, values in updates:
+            self.rows[row_number - 1] = list(values)
+
+    def append_rows(self, rows):
+        self.calls.append('append')
+        self.rows.extend(list(row) for row in rows)
+
+
+class GspreadSheet:
+    """Worksheet client backed by gspread, using only batched calls."""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def read_header_and_keys(self):
+        # Header and key columns in a single values.batchGet
+        header, keys = self.worksheet.batch_get(['1:1', 'A2:B'])
+        return (header[0] if header else []), list(keys)
+
+    def write_header(self, header):
+        self.worksheet.update([header], 'A1', value_input_option='RAW')
+
+    def update_rows(self, updates):
+        self.worksheet.batch_update([{
+            'range': f'A{row_number}',
+            'values': [values]
+        } for row_number, values in updates],
+                                    value_input_option='RAW')
+
+    def append_rows(self, rows):
+        self.worksheet.append_rows(rows,
+                                   value_input_option='RAW',
+                                   insert_data_option='INSERT_ROWS',
+                                   table_range='A1')
+
+
+def open_worksheet():
+    # gspread and google-auth are only needed when a real sync runs
+    import gspread
+
+    client = gspread.service_account(
+        filename=os.environ['GOOGLE_SHEETS_CREDENTIALS'])
+    spreadsheet = client.open_by_key(os.environ['GOOGLE_SHEETS_SPREADSHEET_ID'])
+    title = os.environ.get('GOOGLE_SHEETS_WORKSHEET', 'days')
+    try:
+        worksheet = spreadsheet.worksheet(title)
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title, rows=1000,
+                                              cols=len(HEADER))
+    return GspreadSheet(worksheet)
+
+
+def _cell(value):
+    # RAW input keeps kit codes and dates as typed; missing values stay blank
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _changed_rows(state, chunk_size):
+    # Everything updated since a little before the mark, paged by id so the
+    # pages never depend on comparing timestamps for equality
+    query = day_query().add_columns(TrackingEntry.id,
+                                    TrackingEntry.updated_at).order_by(
+                                        TrackingEntry.id)
+    if state.high_water_at is not None:
+        query = query.where(
+            TrackingEntry.updated_at >= state.high_water_at - SYNC_OVERLAP)
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            query.where(TrackingEntry.id > last_id).limit(chunk_size)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def _digest(values):
+    return hashlib.sha1(json.dumps(values, default=str).encode()).hexdigest()
+
+
+def _overlap_rows(versions, high_water_at):
+    # Only rows the next run's overlap will read again are worth keeping
+    if high_water_at is None:
+        return None
+    cutoff = high_water_at - SYNC_OVERLAP
+    return sorted([row_id, updated_at, digest]
+                  for row_id, (updated_at, digest) in versions.items()
+                  if datetime.fromisoformat(updated_at) >= cutoff)
+
+
+class _Throttle:
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_call = None
+
+    def wait(self):
+        if self.last_call is not None:
+            delay = self.interval - (clock.monotonic() - self.last_call)
+            if delay > 0:
+                clock.sleep(delay)
+        self.last_call = clock.monotonic()
+
+
+def sync_days(sheet, full=False, chunk_size=SHEETS_BATCH_ROWS,
+              min_interval=SHEETS_MIN_INTERVAL):
+    """Push participant-days changed since the last run to ``sheet``.
+
+    Rows are keyed by (kit_id, study_day): existing rows are rewritten with
+    one batch_update per chunk and new ones added with one append_rows.
+    The high-water mark only moves once the run completes; rerunning after
+    an interruption rewrites the rows already sent rather than duplicating
+    them. Rows the overlap re-reads are skipped when the values already
+    sent are unchanged. Returns the number of rows sent.
+    """
+    state = db.session.get(SyncState, SYNC_NAME) or SyncState(name=SYNC_NAME,
+                                                             rows_synced=0)
+    if full:
+        state.high_water_at = state.high_water_id = None
+        state.overlap_rows = None
+    db.session.add(state)
+    already_sent = {
+        row_id: (updated_at, digest)
+        for row_id, updated_at, digest in state.overlap_rows or []
+    }
+    sent_versions = dict(already_sent)
+
+    header, keys = sheet.read_header_and_keys()
+    if list(header) != HEADER:
+        sheet.write_header(HEADER)
+    positions = {
+        tuple(key[:KEY_COLUMNS]): row_number
+        for row_number, key in enumerate(keys, start=2)
+    }
+    next_row = len(keys) + 2
+    throttle = _Throttle(min_interval)
+
+    sent = 0
+    high_water = (state.high_water_at, state.high_water_id)
+    for rows in _changed_rows(state, chunk_size):
+        updates, appends = [], []
+        for row in rows:
+            record = day_record(row)
+            values = [_cell(record[column]) for column in HEADER]
+            digest = _digest(values)
+            if already_sent.get(row.id, (None, None))[1] == digest:
+                continue
+            if row.updated_at is not None:
+                sent_versions[row.id] = (row.updated_at.isoformat(), digest)
+            key = (row.kit_id, row.study_day.isoformat())
+            if key in positions:
+                updates.append((positions[key], values))
+            else:
+                positions[key] = next_row
+                next_row += 1
+                appends.append(values)
+            if high_water[0] is None or (row.updated_at, row.id) > high_water:
+                high_water = (row.updated_at, row.id)
+
+        if updates:
+            throttle.wait()
+            sheet.update_rows(updates)
+        if appends:
+            throttle.wait()
+            sheet.append_rows(appends)
+        sent += len(updates) + len(appends)
+        logging.info('Synced %s tracking days to Google Sheets', sent)
+
+    state.high_water_at, state.high_water_id = high_water
+    state.overlap_rows = _overlap_rows(sent_versions, high_water[0])
+    state.rows_synced = (state.rows_synced or 0) + sent
+    db.session.commit()
+    return sent
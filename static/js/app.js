@@ -50,7 +50,14 @@ function prevStep(currentStepNum) {
 // Check if service worker is supported
 if ('serviceWorker' in navigator) {
     window.addEventListener('load', () => {
-        navigator.serviceWorker.register('/static/js/sw.js')
+        // The worker used to live under /static/js/, where it could not see the save endpoints
+        navigator.serviceWorker.getRegistrations().then(registrations => {
+            registrations
+                .filter(registration => registration.scope.endsWith('/static/js/'))
+                .forEach(registration => registration.unregister());
+        });
+
+        navigator.serviceWorker.register('/sw.js', { scope: '/' })
             .then(registration => {
                 console.log('ServiceWorker registration successful');
             })
@@ -58,6 +65,13 @@ if ('serviceWorker' in navigator) {
                 console.log('ServiceWorker registration failed: ', err);
             });
     });
+
+    // Flush saves queued while offline as soon as the connection is back
+    window.addEventListener('online', () => {
+        if (navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({ type: 'flush' });
+        }
+    });
 }
 
 // Modified loadMenuData function for proper menu rendering
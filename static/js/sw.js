@@ -1,26 +1,240 @@
-const CACHE_NAME = 'health-tracker-v1';
-const urlsToCache = [
-    '/',
-    '/static/css/styles.css',
-    '/static/js/app.js',
-    '/track'
-];
+// Injected by the /sw.js route; the fallback only applies when the raw file is served
+const ASSET_MANIFEST = self.__ASSET_MANIFEST__ || { version: 'dev', precache: [] };
+const STATIC_CACHE = `static-${ASSET_MANIFEST.version}`;
+// Cached pages link to hashed assets, so they are dropped with them on deploy
+const PAGES_CACHE = `pages-${ASSET_MANIFEST.version}`;
+const MENU_CACHE = 'menu-v1';
+const CURRENT_CACHES = [STATIC_CACHE, PAGES_CACHE, MENU_CACHE];
+
+// Saves are queued in IndexedDB while offline and flushed to /api/sync
+const SAVE_ROUTES = {
+    '/save-meal': 'meal',
+    '/save-stool': 'stool',
+    '/save-mood': 'mood',
+    '/save-lifestyle': 'lifestyle'
+};
+const QUEUE_DB = 'health-tracker-queue';
+const QUEUE_STORE = 'events';
+const SYNC_TAG = 'tracking-sync';
+const SYNC_BATCH_SIZE = 50;
+// An event that keeps failing with a server error is dropped after this many
+// flushes; while it is queued, every new save is queued behind it
+const SYNC_MAX_ATTEMPTS = 5;
 
 self.addEventListener('install', event => {
+    // Hashed URLs, so everything in the precache can be served without revalidation
     event.waitUntil(
-        caches.open(CACHE_NAME)
-            .then(cache => cache.addAll(urlsToCache))
+        caches.open(STATIC_CACHE)
+            .then(cache => cache.addAll(ASSET_MANIFEST.precache))
+            .then(() => self.skipWaiting())
     );
 });
 
-self.addEventListener('fetch', event => {
-    event.respondWith(
-        caches.match(event.request)
-            .then(response => {
-                if (response) {
-                    return response;
-                }
-                return fetch(event.request);
-            })
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => !CURRENT_CACHES.includes(key)).map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
     );
 });
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (request.method === 'POST' && SAVE_ROUTES[url.pathname]) {
+        event.respondWith(handleSave(request, SAVE_ROUTES[url.pathname]));
+        return;
+    }
+    if (request.method !== 'GET') {
+        return;
+    }
+
+    if (url.pathname.startsWith('/static/')) {
+        event.respondWith(cacheFirst(request));
+    } else if (url.pathname === '/get-menu-data') {
+        event.respondWith(staleWhileRevalidate(request, event));
+    } else if (request.mode === 'navigate') {
+        event.respondWith(networkFirst(request));
+    }
+});
+
+async function cacheFirst(request) {
+    // The static cache is per deploy, so a lookup ignoring ?v= is never stale
+    const cached = await caches.match(request, { cacheName: STATIC_CACHE, ignoreSearch: true });
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(STATIC_CACHE);
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function staleWhileRevalidate(request, event) {
+    const cache = await caches.open(MENU_CACHE);
+    const cached = await cache.match(request);
+    const refresh = fetch(request).then(response => {
+        if (response.ok) {
+            return cache.put(request, response.clone()).then(() => response);
+        }
+        return response;
+    });
+
+    if (cached) {
+        event.waitUntil(refresh.catch(() => {}));
+        return cached;
+    }
+    return refresh;
+}
+
+async function networkFirst(request) {
+    // Pages are always fetched fresh; the cached copy is only an offline fallback
+    const cache = await caches.open(PAGES_CACHE);
+    try {
+        const response = await fetch(request);
+        if (response.ok) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request);
+        if (cached) {
+            return cached;
+        }
+        throw error;
+    }
+}
+
+self.addEventListener('sync', event => {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(flushQueue());
+    }
+});
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'flush') {
+        event.waitUntil(flushQueue());
+    }
+});
+
+function openQueue() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(QUEUE_DB, 1);
+        request.onupgradeneeded = () => {
+            request.result.createObjectStore(QUEUE_STORE, { keyPath: 'seq', autoIncrement: true });
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function withStore(mode, callback) {
+    const db = await openQueue();
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction(QUEUE_STORE, mode);
+        const result = callback(transaction.objectStore(QUEUE_STORE));
+        transaction.oncomplete = () => resolve(result && 'result' in result ? result.result : undefined);
+        transaction.onerror = () => reject(transaction.error);
+    });
+}
+
+function enqueue(event) {
+    return withStore('readwrite', store => store.add(event));
+}
+
+function queuedEvents() {
+    return withStore('readonly', store => store.getAll());
+}
+
+function dequeue(seqs) {
+    return withStore('readwrite', store => seqs.forEach(seq => store.delete(seq)));
+}
+
+function requeue(events) {
+    return withStore('readwrite', store => events.forEach(event => store.put(event)));
+}
+
+async function handleSave(request, type) {
+    const body = await request.clone().text();
+    const id = self.crypto.randomUUID();
+
+    // Anything already queued goes first so saves reach the server in order
+    const pending = await flushQueue();
+    if (pending === 0) {
+        try {
+            const headers = new Headers(request.headers);
+            headers.set('Idempotency-Key', id);
+            return await fetch(request.url, {
+                method: 'POST',
+                headers: headers,
+                body: body,
+                credentials: 'same-origin'
+            });
+        } catch (error) {
+            // Offline: fall through and queue with the same key, so a save
+            // that reached the server before the connection dropped is not
+            // applied twice
+        }
+    }
+
+    await enqueue({ id: id, type: type, payload: JSON.parse(body || '{}'), queuedAt: Date.now() });
+    if (self.registration.sync) {
+        self.registration.sync.register(SYNC_TAG).catch(() => {});
+    }
+    return new Response(JSON.stringify({ success: true, queued: true }), {
+        status: 202,
+        headers: { 'Content-Type': 'application/json' }
+    });
+}
+
+// Sends queued events in batches and returns how many are still pending
+async function flushQueue() {
+    let events = await queuedEvents();
+    while (events.length) {
+        const batch = events.slice(0, SYNC_BATCH_SIZE);
+        let response;
+        try {
+            response = await fetch('/api/sync', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                credentials: 'same-origin',
+                body: JSON.stringify({
+                    events: batch.map(event => ({ id: event.id, type: event.type, payload: event.payload, queuedAt: event.queuedAt }))
+                })
+            });
+        } catch (error) {
+            return events.length;
+        }
+        if (!response.ok) {
+            return events.length;
+        }
+
+        // Only server errors are retried; rejected events would fail again
+        const data = await response.json();
+        const done = new Set(data.results.filter(result => result.status < 500).map(result => result.id));
+        const failed = batch
+            .filter(event => !done.has(event.id))
+            .map(event => ({ ...event, attempts: (event.attempts || 0) + 1 }));
+        const dropped = failed.filter(event => event.attempts >= SYNC_MAX_ATTEMPTS);
+        dropped.forEach(event => console.warn('Dropping queued save after repeated server errors', event.id));
+        await dequeue(batch
+            .filter(event => done.has(event.id))
+            .concat(dropped)
+            .map(event => event.seq));
+        const retried = failed.filter(event => event.attempts < SYNC_MAX_ATTEMPTS);
+        if (retried.length) {
+            await requeue(retried);
+            return events.length - batch.length + retried.length;
+        }
+        events = events.slice(batch.length);
+    }
+    return 0;
+}
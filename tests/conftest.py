@@ -0,0 +1,22 @@
+import os
+import pytest
+
+# app.py builds its module-level app on import, which needs a database URL;
+# every test gets its own database from the fixture below
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('LOG_ACCESS', '0')
+
+from app import create_app  # noqa: E402
+from database import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
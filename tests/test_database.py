@@ -0,0 +1,60 @@
+from datetime import datetime
+import pytest
+import database
+from database import db, insert_missing, upsert
+from models import AnonymousUser, TrackingEntry, get_study_day
+import tracking
+
+
+@pytest.fixture(params=[True, False], ids=['on-conflict', 'fallback'])
+def has_upsert(request, monkeypatch):
+    monkeypatch.setattr(database, 'SQLITE_HAS_UPSERT', request.param)
+    return request.param
+
+
+def names():
+    return dict(db.session.execute(
+        db.select(AnonymousUser.kit_id, AnonymousUser.name)).all())
+
+
+def test_upsert_inserts_then_updates(app, has_upsert):
+    upsert(AnonymousUser, ['kit_id'], {'kit_id': 'K1', 'name': 'first'})
+    upsert(AnonymousUser, ['kit_id'], {'kit_id': 'K1', 'name': 'second'})
+    upsert(AnonymousUser, ['kit_id'], {'kit_id': 'K2', 'name': 'other'})
+    db.session.commit()
+
+    assert names() == {'K1': 'second', 'K2': 'other'}
+
+
+def test_upsert_without_update_keeps_the_row(app, has_upsert):
+    upsert(AnonymousUser, ['kit_id'], {'kit_id': 'K1', 'name': 'first'},
+           update={})
+    upsert(AnonymousUser, ['kit_id'], {'kit_id': 'K1', 'name': 'second'},
+           update={})
+    db.session.commit()
+
+    assert names() == {'K1': 'first'}
+
+
+def test_insert_missing_skips_existing_rows(app, has_upsert):
+    insert_missing(AnonymousUser, [{'kit_id': 'K1', 'name': 'first'}],
+                   ['kit_id'])
+    insert_missing(AnonymousUser, [{'kit_id': 'K1', 'name': 'second'},
+                                   {'kit_id': 'K2', 'name': 'other'}],
+                   ['kit_id'])
+    db.session.commit()
+
+    assert names() == {'K1': 'first', 'K2': 'other'}
+    assert insert_missing(AnonymousUser, [], ['kit_id']) is None
+
+
+def test_saves_for_one_day_share_a_row(app, has_upsert):
+    now = datetime.now()
+    tracking.apply_event('K1', 'stool', {'type': 4, 'relief': 3, 'smell': 2},
+                         now=now)
+    tracking.apply_event('K1', 'mood', {'mood': {'overall_mood': 4}}, now=now)
+    db.session.commit()
+
+    entries = db.session.execute(db.select(TrackingEntry)).scalars().all()
+    assert [(entry.kit_id, entry.study_day, entry.mood)
+            for entry in entries] == [('K1', get_study_day(now), 4)]
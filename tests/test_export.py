@@ -0,0 +1,29 @@
+import io
+from datetime import date
+import pytest
+from database import db
+from models import TrackingEntry
+import export
+
+
+@pytest.fixture
+def days(app):
+    for day in range(5):
+        TrackingEntry.upsert_day('K1', date(2026, 1, 1 + day), mood=3,
+                                 mood_details={'energy_level': 4})
+    db.session.commit()
+
+
+def test_streamed_csv_has_one_line_ending(days):
+    text = ''.join(export.iter_csv('days', chunk_size=2))
+    assert '\r' not in text
+    lines = text.split('\n')
+    assert lines[-1] == ''
+    assert lines[0] == ','.join(export.DAY_COLUMNS)
+    assert len(lines) == 1 + 5 + 1
+
+
+def test_written_csv_matches_the_stream(days):
+    output = io.StringIO()
+    assert export.write_csv('days', output, chunk_size=2) == 5
+    assert output.getvalue() == ''.join(export.iter_csv('days'))
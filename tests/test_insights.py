@@ -0,0 +1,56 @@
+from database import db
+from models import CommunityStats, get_study_day
+from app import community_comparison
+import tracking
+
+STOOL = {'type': 4, 'relief': 3, 'smell': 2}
+
+
+def save(kind, kit_id, payload):
+    body, status = tracking.apply_event(kit_id, kind, payload)
+    db.session.commit()
+    assert status == 200, body
+
+
+def today_stats():
+    return db.session.execute(
+        db.select(CommunityStats).where(
+            CommunityStats.date == get_study_day())).scalar_one()
+
+
+def test_day_with_stools_but_no_moods(app):
+    for i in range(11):
+        save('stool', f'K{i}', STOOL)
+
+    stats = today_stats()
+    assert stats.total_participants == 11 and stats.avg_mood is None
+    assert community_comparison(None, stats) is None
+    assert community_comparison(4, stats) is None
+
+
+def test_participant_without_a_mood(app):
+    for i in range(11):
+        save('mood', f'K{i}', {'mood': {'overall_mood': 3}})
+
+    assert community_comparison(None, today_stats()) is None
+
+
+def test_comparison_needs_enough_participants(app):
+    for i in range(10):
+        save('mood', f'K{i}', {'mood': {'overall_mood': 2}})
+
+    assert community_comparison(5, today_stats()) is None
+    assert community_comparison(5, None) is None
+
+
+def test_comparison(app):
+    for i in range(11):
+        save('mood', f'K{i}', {'mood': {'overall_mood': 2}})
+
+    assert community_comparison(5, today_stats()) == {
+        'mood_comparison': 'above average',
+        'community_avg_mood': 2.0,
+        'total_participants': 11
+    }
+    assert community_comparison(2, today_stats())['mood_comparison'] == (
+        'about average')
@@ -0,0 +1,82 @@
+import io
+import pytest
+from database import db
+from models import Admin, KitCode, TrackingEntry, get_study_day
+import kit_codes
+
+
+@pytest.fixture
+def admin(app):
+    admin = Admin(username='admin', password_hash='-')
+    db.session.add(admin)
+    db.session.commit()
+    yield admin
+    kit_codes.invalidate_active_codes()
+
+
+@pytest.mark.parametrize('code', [
+    'A', 'kit-001', 'KIT_2026_a', '7f9c2e1a-4b3d-4e5f-9a8b-0c1d2e3f4a5b',
+    'a' * 36,
+])
+def test_pattern_accepts(code):
+    assert kit_codes.KIT_CODE_PATTERN.match(code)
+
+
+@pytest.mark.parametrize('code', [
+    '', '-kit', '_kit', 'kit 1', 'kit/1', 'kit\n', 'kit;1', 'a' * 37,
+])
+def test_pattern_rejects(code):
+    assert not kit_codes.KIT_CODE_PATTERN.match(code)
+
+
+def test_provision_codes_counts_invalid_and_duplicates(admin):
+    kit_codes.provision_codes(['KIT-1'], 'first', admin.id)
+    result = kit_codes.provision_codes(
+        ['KIT-1', 'KIT-2', '', 'bad code', 'KIT-2', 'KIT-3'], 'second',
+        admin.id, chunk_size=2)
+
+    assert (result.inserted, result.skipped, result.invalid) == (2, 2, 1)
+    assert db.session.execute(
+        db.select(KitCode.code, KitCode.batch_name).order_by(
+            KitCode.code)).all() == [('KIT-1', 'first'), ('KIT-2', 'second'),
+                                     ('KIT-3', 'second')]
+
+
+def test_uploaded_codes_skip_the_header():
+    upload = io.BytesIO('﻿code,note\nKIT-1,x\n\n KIT-2 \n'.encode())
+    assert list(kit_codes.iter_uploaded_codes(upload)) == ['KIT-1', 'KIT-2']
+
+
+def test_login_state(admin):
+    kit_codes.provision_codes(['KIT-1'], 'batch', admin.id)
+    today = get_study_day()
+    TrackingEntry.upsert_day('KIT-1', today)
+    db.session.commit()
+
+    state = kit_codes.load_login_state('KIT-1')
+    assert state.kit_active and state.admin_id is None
+    assert state.last_study_day == today
+    assert kit_codes.load_login_state('admin').admin_id == admin.id
+    assert not kit_codes.load_login_state('KIT-9').kit_active
+
+
+def test_deactivated_code_is_refused_once_invalidated(admin):
+    kit_codes.provision_codes(['KIT-1'], 'batch', admin.id)
+    assert kit_codes.load_login_state('KIT-1').kit_active
+
+    db.session.execute(db.update(KitCode).values(is_active=False))
+    db.session.commit()
+    # Cached as active until the entry expires or is invalidated
+    assert kit_codes.load_login_state('KIT-1').kit_active
+    kit_codes.invalidate_active_codes('KIT-1')
+    assert not kit_codes.load_login_state('KIT-1').kit_active
+
+
+def test_first_login_registers_the_participant(admin):
+    kit_codes.provision_codes(['KIT-1'], 'batch', admin.id)
+    state = kit_codes.load_login_state('KIT-1')
+    assert state.user_id is None
+
+    kit_codes.register_participant('KIT-1', state)
+    state = kit_codes.load_login_state('KIT-1')
+    assert state.user_id is not None and state.user_name == 'KIT-1'
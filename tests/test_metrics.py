@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from database import db
+import metrics
+
+ROUTE = ('/save-mood', 'POST', '200')
+
+
+@pytest.fixture
+def metrics_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path / 'metrics'))
+    monkeypatch.setattr(metrics, 'registry', metrics.Registry())
+    os.makedirs(metrics.METRICS_DIR)
+    return metrics.METRICS_DIR
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+def request_count():
+    histograms, _ = metrics._merge(metrics._collect(db.engine))
+    series = histograms['http_request_duration_seconds'].get(ROUTE)
+    return series[-1] if series else 0
+
+
+def test_crashed_worker_counts_stay_in_the_totals(metrics_dir):
+    pid = dead_pid()
+    registry = metrics.Registry()
+    for _ in range(3):
+        registry.observe('http_request_duration_seconds', 0.01, ROUTE)
+    with open(metrics._path(pid), 'w') as f:
+        json.dump({'pid': pid, 'histograms': registry.snapshot(),
+                   'gauges': {'db_pool_size': 5}}, f)
+    metrics.registry.observe('http_request_duration_seconds', 0.01, ROUTE)
+
+    assert request_count() == 4
+    assert not os.path.exists(metrics._path(pid))
+    # Counted once, however often it is scraped
+    assert request_count() == 4
+    assert f'pid="{pid}"' not in metrics.render(db.engine)
+
+
+def test_exiting_worker_folds_its_counts_in(metrics_dir):
+    metrics.registry.observe('http_request_duration_seconds', 0.01, ROUTE)
+    metrics.flush()
+    assert os.path.exists(metrics._path(os.getpid()))
+
+    metrics._exit()
+    assert not os.path.exists(metrics._path(os.getpid()))
+
+    # The next worker starts from an empty registry
+    metrics.registry = metrics.Registry()
+    metrics.registry.observe('http_request_duration_seconds', 0.01, ROUTE)
+    assert request_count() == 2
@@ -0,0 +1,88 @@
+import json
+from datetime import date
+import pytest
+from sqlalchemy import inspect, text
+from app import create_app
+from database import db
+from migrations import run_migrations
+from models import (CommunityStats, DailyRollup, ParticipantStreak, StoolEvent,
+                    TrackingEntry)
+
+# The tables as they were before the first migration
+BASELINE_SCHEMA = [
+    """CREATE TABLE anonymous_user (
+        id INTEGER PRIMARY KEY, kit_id VARCHAR(36) NOT NULL UNIQUE,
+        name VARCHAR(100), created_at DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE admin (
+        id INTEGER PRIMARY KEY, username VARCHAR(64) NOT NULL UNIQUE,
+        password_hash VARCHAR(256) NOT NULL, is_active BOOLEAN,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE daily_menu (
+        id INTEGER PRIMARY KEY, date DATE NOT NULL, menu_data JSON NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        created_by INTEGER NOT NULL REFERENCES admin (id))""",
+    """CREATE TABLE kit_code (
+        id INTEGER PRIMARY KEY, code VARCHAR(36) NOT NULL UNIQUE,
+        batch_name VARCHAR(100) NOT NULL,
+        created_by INTEGER NOT NULL REFERENCES admin (id),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP, is_active BOOLEAN)""",
+    """CREATE TABLE tracking_entry (
+        id INTEGER PRIMARY KEY, kit_id VARCHAR(36) NOT NULL,
+        date DATETIME DEFAULT CURRENT_TIMESTAMP, meals JSON,
+        stool_entries JSON, mood INTEGER, mood_details JSON,
+        shared_with_community BOOLEAN, current_streak INTEGER,
+        best_streak INTEGER, last_tracked_date DATETIME, lifestyle_log JSON)""",
+    """CREATE TABLE community_stats (
+        id INTEGER PRIMARY KEY, date DATE NOT NULL, avg_mood FLOAT,
+        most_common_stool_type VARCHAR(10), total_participants INTEGER,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+]
+
+
+@pytest.fixture
+def baseline_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "baseline.db"}',
+    })
+    with app.app_context():
+        for statement in BASELINE_SCHEMA:
+            db.session.execute(text(statement))
+        db.session.execute(
+            text("INSERT INTO tracking_entry (kit_id, date, meals, "
+                 "stool_entries, mood) VALUES (:kit_id, :date, :meals, "
+                 ":stool_entries, :mood)"), {
+                     'kit_id': 'K1',
+                     'date': '2026-01-05 14:00:00',
+                     'meals': json.dumps({'breakfast': {'Bread': ['Toast']}}),
+                     'stool_entries': json.dumps([{
+                         'timestamp': '2026-01-05T14:00:00',
+                         'type': '4',
+                         'details': {'relief': '3', 'smell': '2'}
+                     }]),
+                     'mood': 4
+                 })
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def test_migrate_baseline_database_without_db_init(baseline_app):
+    run_migrations()
+    # A second run after the next deploy changes nothing
+    run_migrations()
+
+    tables = set(inspect(db.engine).get_table_names())
+    assert {'stool_event', 'daily_rollup', 'meal_item', 'food_item',
+            'participant_streak', 'sync_event', 'sync_state'} <= tables
+
+    entry = db.session.execute(db.select(TrackingEntry)).scalar_one()
+    assert entry.study_day == date(2026, 1, 5)
+    assert entry.stool_entries is None
+    stools = db.session.execute(db.select(StoolEvent)).scalars().all()
+    assert [(s.kit_id, s.study_day, s.bristol_type, s.relief, s.smell)
+            for s in stools] == [('K1', date(2026, 1, 5), 4, 3, 2)]
+    rollup = db.session.execute(db.select(DailyRollup)).scalar_one()
+    assert (rollup.mood, rollup.stool_count, rollup.breakfast_items) == (4, 1, 1)
+    assert db.session.get(ParticipantStreak, 'K1') is not None
+    assert db.session.execute(db.select(CommunityStats)).first() is None
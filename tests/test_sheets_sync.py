@@ -0,0 +1,86 @@
+from datetime import date, datetime, timedelta
+from database import db
+from models import SyncState, TrackingEntry
+import sheets_sync
+
+T0 = datetime(2026, 1, 10, 12, 0)
+
+
+def save_day(kit_id, study_day, updated_at, **values):
+    TrackingEntry.upsert_day(kit_id, study_day, **values)
+    # SQLite's now() only has whole seconds, so tests set the time themselves
+    db.session.execute(
+        db.update(TrackingEntry).where(
+            TrackingEntry.kit_id == kit_id,
+            TrackingEntry.study_day == study_day).values(updated_at=updated_at))
+    db.session.commit()
+
+
+def sync(sheet):
+    return sheets_sync.sync_days(sheet, min_interval=0)
+
+
+def sheet_row(sheet, kit_id, study_day):
+    mood = sheets_sync.HEADER.index('mood')
+    rows = [row for row in sheet.rows[1:]
+            if row[:2] == [kit_id, study_day.isoformat()]]
+    assert len(rows) == 1
+    return rows[0][mood]
+
+
+def test_high_water_mark_advances(app):
+    save_day('K1', date(2026, 1, 1), T0, mood=3)
+    save_day('K2', date(2026, 1, 1), T0 + timedelta(minutes=1), mood=4)
+    sheet = sheets_sync.MemorySheet()
+
+    assert sync(sheet) == 2
+    state = db.session.get(SyncState, sheets_sync.SYNC_NAME)
+    assert state.high_water_at == T0 + timedelta(minutes=1)
+    assert state.rows_synced == 2
+
+    save_day('K3', date(2026, 1, 1), T0 + timedelta(hours=1), mood=5)
+    assert sync(sheet) == 1
+    assert state.high_water_at == T0 + timedelta(hours=1)
+    assert state.rows_synced == 3
+    assert len(sheet.rows) == 4
+
+
+def test_overlap_resends_edited_rows_without_duplicates(app):
+    day = date(2026, 1, 1)
+    save_day('K1', day, T0 - timedelta(minutes=1), mood=3)
+    save_day('K2', day, T0, mood=4)
+    sheet = sheets_sync.MemorySheet()
+    sync(sheet)
+
+    # Committed after the last run but stamped before its mark, as a slow
+    # transaction would be
+    save_day('K1', day, T0 - timedelta(minutes=2), mood=1)
+    sheet.calls.clear()
+
+    assert sync(sheet) == 1
+    assert sheet.calls == ['read', 'update']
+    assert len(sheet.rows) == 3
+    assert sheet_row(sheet, 'K1', day) == 1
+
+
+def test_rerun_without_changes_writes_nothing(app):
+    save_day('K1', date(2026, 1, 1), T0 - timedelta(minutes=1), mood=3)
+    save_day('K2', date(2026, 1, 1), T0, mood=4)
+    sheet = sheets_sync.MemorySheet()
+    sync(sheet)
+    sheet.calls.clear()
+
+    assert sync(sheet) == 0
+    assert sheet.calls == ['read']
+    assert len(sheet.rows) == 3
+
+
+def test_full_resync_rewrites_rows_in_place(app):
+    save_day('K1', date(2026, 1, 1), T0, mood=3)
+    sheet = sheets_sync.MemorySheet()
+    sync(sheet)
+    sheet.calls.clear()
+
+    assert sheets_sync.sync_days(sheet, full=True, min_interval=0) == 1
+    assert sheet.calls == ['read', 'update']
+    assert len(sheet.rows) == 2
@@ -0,0 +1,148 @@
+from datetime import datetime, time, timedelta
+from database import db
+from models import StoolEvent, SyncEvent, TrackingEntry, get_study_day
+import tracking
+
+STOOL = {'type': 4, 'relief': 3, 'smell': 2}
+NOW = datetime(2026, 3, 10, 12, 0)
+
+
+def ms(at):
+    return int(at.timestamp() * 1000)
+
+
+def stool(event_id, **extra):
+    return dict({'id': event_id, 'type': 'stool', 'payload': STOOL}, **extra)
+
+
+def stools():
+    return db.session.execute(
+        db.select(StoolEvent.study_day).order_by(StoolEvent.id)).scalars().all()
+
+
+def test_duplicate_ids_apply_once(app):
+    results = tracking.apply_batch('K1', [stool('e1'), stool('e1'),
+                                          stool('e2')], NOW)
+    db.session.commit()
+
+    assert [(r['id'], r['status'], r.get('duplicate', False))
+            for r in results] == [('e1', 200, False), ('e1', 200, True),
+                                  ('e2', 200, False)]
+    assert len(stools()) == 2
+
+
+def test_retried_batch_replays_stored_results(app):
+    tracking.apply_batch('K1', [stool('e1'), {'id': 'e2', 'type': 'meal',
+                                              'payload': {}}], NOW)
+    db.session.commit()
+
+    results = tracking.apply_batch('K1', [stool('e1'), {'id': 'e2',
+                                                        'type': 'meal',
+                                                        'payload': {}}], NOW)
+    db.session.commit()
+    assert [(r['status'], r['duplicate']) for r in results] == [(200, True),
+                                                                 (400, True)]
+    assert len(stools()) == 1
+    # Keys are per kit
+    tracking.apply_batch('K2', [stool('e1')], NOW)
+    db.session.commit()
+    assert len(stools()) == 2
+
+
+def test_malformed_events_fail_alone(app):
+    results = tracking.apply_batch('K1', [
+        'not an event', {'type': 'stool', 'payload': STOOL},
+        stool('x' * (tracking.EVENT_ID_MAX_LENGTH + 1)),
+        {'id': 'e1', 'type': 'nap', 'payload': {}},
+        {'id': 'e2', 'type': 'stool'},
+        stool('e3'),
+    ], NOW)
+    db.session.commit()
+
+    assert [r['status'] for r in results] == [400, 400, 400, 400, 400, 200]
+    assert set(SyncEvent.lookup('K1', ['e1', 'e2', 'e3'])) == {'e3'}
+
+
+def test_malformed_payloads_are_rejected(app):
+    results = tracking.apply_batch('K1', [
+        {'id': 'e1', 'type': 'mood', 'payload': {'mood': {'overall_mood': '5'}}},
+        {'id': 'e2', 'type': 'meal',
+         'payload': {'type': 'breakfast', 'foods': ['Toast']}},
+        {'id': 'e3', 'type': 'mood', 'payload': {'mood': {'overall_mood': 5}}},
+    ], NOW)
+    db.session.commit()
+
+    assert [r['status'] for r in results] == [400, 400, 200]
+    assert db.session.scalar(db.select(TrackingEntry.mood)) == 5
+
+
+def test_saves_apply_as_of_queued_at(app):
+    before_reset = datetime.combine(NOW.date(), time(2, 30))
+    tracking.apply_batch('K1', [
+        stool('late-night', queuedAt=ms(before_reset)),
+        stool('no-time'),
+        stool('future', queuedAt=ms(NOW + timedelta(days=1))),
+        stool('junk', queuedAt='yesterday'),
+    ], NOW)
+    db.session.commit()
+
+    assert stools() == [get_study_day(before_reset)] + [get_study_day(NOW)] * 3
+    assert get_study_day(before_reset) == NOW.date() - timedelta(days=1)
+    assert db.session.execute(
+        db.select(TrackingEntry.study_day).order_by(
+            TrackingEntry.study_day)).scalars().all() == [
+                NOW.date() - timedelta(days=1), NOW.date()]
+
+
+def test_queued_at_is_clamped():
+    assert tracking.queued_at(ms(NOW - timedelta(days=30)), NOW) == (
+        NOW - tracking.SYNC_MAX_AGE)
+    assert tracking.queued_at(ms(NOW + timedelta(hours=1)), NOW) == NOW
+    assert tracking.queued_at(ms(NOW - timedelta(hours=1)), NOW) == (
+        NOW - timedelta(hours=1))
+    for value in (None, True, 'soon', float('nan'), 10**30):
+        assert tracking.queued_at(value, NOW) == NOW
+
+
+def test_sync_endpoint(app):
+    client = app.test_client()
+    assert client.post('/api/sync', json={'events': []}).status_code == 401
+
+    with client.session_transaction() as session:
+        session['kit_id'] = 'K1'
+    too_many = [stool(f'e{i}') for i in range(tracking.SYNC_MAX_BATCH + 1)]
+    assert client.post('/api/sync', json={'events': too_many}).status_code == 400
+
+    response = client.post('/api/sync', json={'events': [stool('e1')]})
+    assert response.status_code == 200
+    assert response.json['results'][0]['success']
+
+
+def test_prune_sync_events(app):
+    tracking.apply_batch('K1', [stool(f'e{i}') for i in range(5)], NOW)
+    db.session.commit()
+    old = NOW - tracking.SYNC_EVENT_RETENTION - timedelta(minutes=1)
+    db.session.execute(
+        db.update(SyncEvent).where(SyncEvent.event_id.in_(
+            ['e0', 'e1', 'e2'])).values(created_at=old))
+    db.session.execute(
+        db.update(SyncEvent).where(SyncEvent.event_id == 'e3').values(
+            created_at=NOW - tracking.SYNC_MAX_AGE))
+    db.session.commit()
+
+    assert tracking.prune_sync_events(NOW, chunk_size=2) == 3
+    assert set(SyncEvent.lookup('K1', [f'e{i}' for i in range(5)])) == {
+        'e3', 'e4'}
+    assert tracking.prune_sync_events(NOW) == 0
+
+
+def test_prune_sync_events_command(app):
+    tracking.apply_batch('K1', [stool('e1')], NOW)
+    db.session.execute(db.update(SyncEvent).values(
+        created_at=datetime.now() - tracking.SYNC_EVENT_RETENTION -
+        timedelta(days=1)))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['prune-sync-events'])
+    assert result.exit_code == 0, result.output
+    assert 'Deleted 1 sync events' in result.output
@@ -0,0 +1,50 @@
+from datetime import datetime
+import pytest
+from database import db
+from models import FoodItem, MealItem
+import tracking
+
+NOW = datetime(2026, 3, 10, 12, 0)
+
+
+def catalog():
+    return set(db.session.execute(
+        db.select(FoodItem.category, FoodItem.name)).all())
+
+
+def test_meal_adds_its_foods_to_the_catalog(app):
+    body, status = tracking.apply_event('K1', 'meal', {
+        'type': 'breakfast',
+        'foods': {'Bread': ['Toast', ' Rye '], 'Fruit': ['Apple']}
+    }, now=NOW)
+    db.session.commit()
+
+    assert status == 200, body
+    assert catalog() == {('Bread', 'Toast'), ('Bread', 'Rye'),
+                         ('Fruit', 'Apple')}
+    assert db.session.scalar(
+        db.select(db.func.count()).select_from(MealItem)) == 3
+
+
+@pytest.mark.parametrize('foods', [
+    {'Bread': ['x' * 201]},
+    {'x' * 101: ['Toast']},
+    {'Bread': [f'Food {i}' for i in range(tracking.MEAL_MAX_FOODS + 1)]},
+])
+def test_oversized_foods_are_rejected(app, foods):
+    body, status = tracking.apply_event('K1', 'meal', {
+        'type': 'breakfast',
+        'foods': foods
+    }, now=NOW)
+    db.session.commit()
+
+    assert status == 400 and not body['success']
+    assert catalog() == set()
+
+
+def test_longest_names_fit(app):
+    foods = {'c' * 100: ['n' * 200]}
+    tracking.check_payload('K1', 'meal', {'type': 'lunch', 'foods': foods})
+    with pytest.raises(tracking.TrackingError):
+        tracking.save_meal('K1', {'type': 'lunch',
+                                  'foods': {'c' * 100: ['n' * 201]}}, NOW)
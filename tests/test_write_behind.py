@@ -0,0 +1,134 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+import pytest
+from database import db
+from models import StoolEvent, SyncEvent
+import tracking
+from write_behind import DEAD_LETTER_FILE, WriteBehind
+
+STOOL = {'type': 4, 'relief': 3, 'smell': 2}
+
+
+@pytest.fixture
+def buffer(app, tmp_path):
+    # Only flushes the tests call, never the flusher thread's own
+    buffer = WriteBehind(app, spool_dir=str(tmp_path / 'spool'),
+                         interval=3600, batch_size=1000, fsync=False,
+                         max_attempts=3)
+    yield buffer
+    buffer.close()
+
+
+def spooled(buffer):
+    return sorted(name for name in os.listdir(buffer.spool_dir)
+                  if os.path.getsize(os.path.join(buffer.spool_dir, name)))
+
+
+def stools(kit_id):
+    return db.session.scalar(
+        db.select(db.func.count()).select_from(StoolEvent).where(
+            StoolEvent.kit_id == kit_id))
+
+
+def test_server_error_keeps_the_save(buffer, monkeypatch):
+    calls = []
+
+    def fail_once(kit_id, payload, now=None):
+        calls.append(kit_id)
+        if len(calls) == 1:
+            raise RuntimeError('database went away')
+        return tracking.save_stool(kit_id, payload, now)
+
+    monkeypatch.setitem(tracking.SAVE_HANDLERS, 'stool', fail_once)
+    failed = buffer.submit('K1', 'stool', STOOL)
+    after = buffer.submit('K1', 'mood', {'mood': {'overall_mood': 4}})
+    other = buffer.submit('K2', 'stool', STOOL)
+
+    assert buffer.flush() == 1
+    # The failed save and the one after it for the same kit wait, in order
+    assert [event['id'] for event in buffer.pending] == [failed, after]
+    assert spooled(buffer)
+    assert set(SyncEvent.lookup('K1', [failed, after])) == set()
+    assert set(SyncEvent.lookup('K2', [other])) == {other}
+
+    assert buffer.flush() == 2
+    assert not buffer.pending
+    assert spooled(buffer) == []
+    assert stools('K1') == 1
+    assert SyncEvent.lookup('K1', [failed])[failed].status == 200
+
+
+def test_failing_save_is_moved_to_dead_letter_file(buffer, monkeypatch):
+
+    def fail(kit_id, payload, now=None):
+        raise RuntimeError('database went away')
+
+    monkeypatch.setitem(tracking.SAVE_HANDLERS, 'stool', fail)
+    failed = buffer.submit('K1', 'stool', STOOL)
+    after = buffer.submit('K1', 'mood', {'mood': {'overall_mood': 4}})
+
+    assert buffer.flush() == 0
+    files = os.listdir(buffer.spool_dir)
+    assert buffer.flush() == 0
+    # Flushes that apply nothing do not leave new spool files behind
+    assert os.listdir(buffer.spool_dir) == files
+
+    assert buffer.flush() == 1
+    assert not buffer.pending
+    assert spooled(buffer) == [DEAD_LETTER_FILE]
+    assert set(SyncEvent.lookup('K1', [failed, after])) == {after}
+    with open(os.path.join(buffer.spool_dir, DEAD_LETTER_FILE)) as f:
+        dead = [json.loads(line) for line in f]
+    assert [(event['id'], event['attempts'], event['error'])
+            for event in dead] == [(failed, 3, 'database went away')]
+
+
+@pytest.mark.parametrize('kind, payload', [
+    ('mood', {'mood': {'overall_mood': '5'}}),
+    ('mood', {'mood': {'overall_mood': 9}}),
+    ('mood', {'mood': [5]}),
+    ('lifestyle', {'yoga': 'yes'}),
+    ('meal', {'type': 'breakfast', 'foods': ['Toast']}),
+    ('meal', {'type': 'breakfast', 'foods': {'Bread': 'Toast'}}),
+])
+def test_malformed_saves_are_refused_up_front(buffer, kind, payload):
+    body, status = buffer.accept('K1', kind, payload)
+    assert status == 400 and not body['success']
+    assert not buffer.pending
+
+
+def test_rejected_save_is_dropped(buffer):
+    buffer.submit('K1', 'mood', {'mood': {'overall_mood': 4}})
+    rejected = buffer.submit('K1', 'meal', {'type': 'dinner'})
+
+    assert buffer.flush() == 2
+    assert not buffer.pending
+    assert spooled(buffer) == []
+    assert 400 <= SyncEvent.lookup('K1', [rejected])[rejected].status < 500
+
+
+def test_drain_replays_spools_of_dead_processes(buffer):
+    os.makedirs(buffer.spool_dir)
+    applied = 'applied-before-crash'
+    tracking.apply_event('K1', 'stool', STOOL, applied)
+    db.session.commit()
+
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    path = os.path.join(buffer.spool_dir, f'{process.pid}-dead-00000001.jsonl')
+    with open(path, 'w') as f:
+        for event_id in (applied, 'not-applied'):
+            f.write(json.dumps({'id': event_id, 'kit_id': 'K1',
+                                'kind': 'stool', 'payload': STOOL,
+                                'at': datetime.now().isoformat()}) + '\n')
+        f.write('{"id": "torn')
+
+    buffer.drain()
+
+    assert stools('K1') == 2
+    assert set(SyncEvent.lookup('K1', [applied, 'not-applied'])) == {
+        applied, 'not-applied'}
+    assert os.listdir(buffer.spool_dir) == []
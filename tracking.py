@@ -0,0 +1,362 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from database import db
+from models import (CommunityStats, DailyRollup, FoodItem, MealItem,
+                    ParticipantStreak, StoolEvent, SyncEvent, TrackingEntry,
+                    LIFESTYLE_FIELDS, MEAL_TYPES, MOOD_FIELDS, get_study_day,
+                    in_new_day_window)
+
+SYNC_MAX_BATCH = 100
+# Foods a participant picks are added to the shared catalog, so a meal is
+# capped well above any real menu
+MEAL_MAX_FOODS = 200
+EVENT_ID_MAX_LENGTH = 64
+# Offline saves older than this are applied as of this long ago
+SYNC_MAX_AGE = timedelta(days=7)
+# Idempotency keys are kept past SYNC_MAX_AGE, with a margin for a device
+# that retries its queue late, and then pruned
+SYNC_EVENT_RETENTION = SYNC_MAX_AGE + timedelta(days=7)
+PRUNE_CHUNK_SIZE = 5000
+
+
+class TrackingError(Exception):
+    # A save rejected by validation; retrying it gives the same answer
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# Each save works on the current session and never commits, so a route can
+# commit one save and /api/sync can commit a whole batch at once
+
+
+def save_lifestyle(kit_id, payload, now=None):
+    today = get_study_day(now)
+    entry = TrackingEntry.get_for_day(kit_id, today)
+    if entry and entry.lifestyle_log:
+        raise TrackingError("Lifestyle already logged for today")
+
+    TrackingEntry.upsert_day(kit_id, today, lifestyle_log=payload)
+    DailyRollup.record(kit_id, today, **DailyRollup.lifestyle_flags(payload))
+    ParticipantStreak.record_activity(kit_id, today)
+    CommunityStats.record(today, new_participant=entry is None)
+    return {"success": True}
+
+
+def save_meal(kit_id, payload, now=None):
+    meal_type = payload.get('type')
+    foods = payload.get('foods', {})
+    if not kit_id or not meal_type:
+        raise TrackingError("Missing required data")
+    if meal_type not in MEAL_TYPES:
+        raise TrackingError("Invalid meal type")
+    check_foods(foods)
+
+    today = get_study_day(now)
+
+    # Get today's entry, the row itself is written by a single upsert
+    entry = TrackingEntry.get_for_day(kit_id, today)
+    is_new_entry = entry is None
+
+    # Work on a copy so the loaded row is never flushed separately
+    meals = dict(entry.meals or {}) if entry else {}
+
+    # Check meal sequence and save data
+    is_new_day = in_new_day_window(now)
+    logging.debug("Saving meal - Type: %s, Is new day: %s", meal_type,
+                  is_new_day)
+    logging.debug("Current meals: %s", meals)
+
+    if meal_type == 'breakfast' and (is_new_day or 'breakfast' not in meals):
+        # Always allow breakfast during new day or if not logged
+        meals['breakfast'] = foods
+    elif meal_type == 'lunch':
+        if 'breakfast' not in meals:
+            raise TrackingError("Please log breakfast first")
+        if 'lunch' in meals:
+            raise TrackingError("Lunch already logged for today")
+        meals['lunch'] = foods
+    elif meal_type == 'dinner':
+        if 'breakfast' not in meals or 'lunch' not in meals:
+            raise TrackingError("Please log breakfast and lunch first")
+        if 'dinner' in meals:
+            raise TrackingError("Dinner already logged for today")
+        meals['dinner'] = foods
+
+    logging.debug("Final meals state: %s", meals)
+    TrackingEntry.upsert_day(kit_id, today, meals=meals)
+    ParticipantStreak.record_activity(kit_id, today)
+    items = MealItem.replace_meal(kit_id, today, meal_type,
+                                  meals.get(meal_type))
+    DailyRollup.record(kit_id, today, **{f'{meal_type}_items': items})
+    CommunityStats.record(today, new_participant=is_new_entry)
+    return {"success": True}
+
+
+def save_stool(kit_id, payload, now=None):
+    try:
+        stool_event = StoolEvent(
+            kit_id=kit_id,
+            bristol_type=StoolEvent.parse_scale(payload.get('type'), 1, 7),
+            relief=StoolEvent.parse_scale(payload.get('relief'), 1, 5),
+            smell=StoolEvent.parse_scale(payload.get('smell'), 1, 5),
+            timestamp=now or datetime.now())
+    except ValueError as e:
+        raise TrackingError(str(e))
+
+    today = get_study_day(now)
+    stool_event.study_day = today
+
+    # Get today's entry, the row itself is written by a single upsert
+    is_new_entry = TrackingEntry.get_for_day(kit_id, today) is None
+
+    # Events are append-only, concurrent submissions each insert their own row
+    db.session.add(stool_event)
+    TrackingEntry.upsert_day(kit_id, today)
+    DailyRollup.record_stool(kit_id, today, stool_event)
+    ParticipantStreak.record_activity(kit_id, today)
+    CommunityStats.record(today,
+                          new_participant=is_new_entry,
+                          bristol_type=stool_event.bristol_type)
+    return {"success": True}
+
+
+def parse_mood(mood_data):
+    # Each component is a whole number from 1 to 5, or 0 when not answered
+    if not isinstance(mood_data, dict):
+        raise TrackingError("Invalid mood data")
+    for field in MOOD_FIELDS:
+        value = mood_data.get(field, 0)
+        if isinstance(value, bool) or not isinstance(
+                value, int) or not 0 <= value <= 5:
+            raise TrackingError(f"Invalid {field.replace('_', ' ')}")
+    return mood_data
+
+
+def save_mood(kit_id, payload, now=None):
+    mood_data = parse_mood(payload.get('mood', {}))
+
+    # Calculate overall mood average
+    mood_values = [mood_data.get(field, 0) for field in MOOD_FIELDS]
+    non_zero_values = [v for v in mood_values if v != 0]
+    mood = sum(non_zero_values) / len(non_zero_values) if non_zero_values else 0
+
+    today = get_study_day(now)
+    entry = TrackingEntry.get_for_day(kit_id, today)
+
+    TrackingEntry.upsert_day(kit_id, today, mood=mood, mood_details=mood_data)
+    DailyRollup.record(kit_id, today, mood=mood)
+    ParticipantStreak.record_activity(kit_id, today)
+    CommunityStats.record(today,
+                          new_participant=entry is None,
+                          mood=mood,
+                          previous_mood=entry.mood if entry else None)
+    return {"success": True}
+
+
+SAVE_HANDLERS = {
+    'lifestyle': save_lifestyle,
+    'meal': save_meal,
+    'stool': save_stool,
+    'mood': save_mood,
+}
+
+
+def check_foods(foods):
+    # {category: [food, ...]}, as the meal form sends it, with names that
+    # fit the food catalog
+    if not isinstance(foods, dict) or not all(
+            isinstance(items, list) and all(
+                isinstance(name, str) for name in items)
+            for items in foods.values()):
+        raise TrackingError("Invalid food selection")
+    if sum(len(items) for items in foods.values()) > MEAL_MAX_FOODS:
+        raise TrackingError("Too many foods selected")
+    for category, items in foods.items():
+        if len(category) > FoodItem.category.type.length or any(
+                len(name.strip()) > FoodItem.name.type.length
+                for name in items):
+            raise TrackingError("Food name too long")
+
+
+def check_payload(kit_id, kind, payload):
+    """Checks that need no database, for saves accepted before they run.
+
+    Every save is checked again when it is applied. Rules that depend on
+    what is already logged (meal order, one mood a day) are only enforced
+    then.
+    """
+    if kind not in SAVE_HANDLERS:
+        raise TrackingError("Unknown event type")
+    if not kit_id or not isinstance(payload, dict):
+        raise TrackingError("Missing required data")
+    if kind == 'meal':
+        if not payload.get('type'):
+            raise TrackingError("Missing required data")
+        if payload['type'] not in MEAL_TYPES:
+            raise TrackingError("Invalid meal type")
+        check_foods(payload.get('foods', {}))
+    elif kind == 'mood':
+        parse_mood(payload.get('mood', {}))
+    elif kind == 'lifestyle':
+        for field in LIFESTYLE_FIELDS:
+            if not isinstance(payload.get(field, False), bool):
+                raise TrackingError(f"Invalid {field} value")
+    elif kind == 'stool':
+        try:
+            StoolEvent.parse_scale(payload.get('type'), 1, 7)
+            StoolEvent.parse_scale(payload.get('relief'), 1, 5)
+            StoolEvent.parse_scale(payload.get('smell'), 1, 5)
+        except ValueError as e:
+            raise TrackingError(str(e))
+
+
+def replay(sync_event):
+    return dict(sync_event.response or {}, duplicate=True), sync_event.status
+
+
+def _apply(kit_id, kind, payload, event_id, now):
+    try:
+        check_payload(kit_id, kind, payload)
+        body, status = SAVE_HANDLERS[kind](kit_id, payload, now), 200
+    except TrackingError as e:
+        body, status = {"success": False, "error": e.message}, e.status
+    if event_id:
+        db.session.add(
+            SyncEvent(kit_id=kit_id,
+                      event_id=event_id,
+                      kind=kind,
+                      status=status,
+                      response=body))
+        db.session.flush()
+    return body, status
+
+
+def apply_event(kit_id, kind, payload, event_id=None, now=None):
+    """Apply one save and return ``(body, status)``; the caller commits.
+
+    With an ``event_id`` the outcome is recorded in SyncEvent, so a client
+    retrying a request whose response it never saw gets the first result
+    back instead of a second write.
+    """
+    if event_id:
+        sync_event = SyncEvent.lookup(kit_id, [event_id]).get(event_id)
+        if sync_event:
+            return replay(sync_event)
+    return _apply(kit_id, kind, payload, event_id, now)
+
+
+def apply_in_savepoint(kit_id, kind, payload, event_id, now=None):
+    """Apply one keyed save in a savepoint of the caller's transaction.
+
+    A failing save is rolled back on its own and reported as its result,
+    so the events around it still commit.
+    """
+    savepoint = db.session.begin_nested()
+    try:
+        body, status = _apply(kit_id, kind, payload, event_id, now)
+        savepoint.commit()
+    except IntegrityError:
+        # The same key was applied concurrently by another request
+        savepoint.rollback()
+        body, status = {"success": True, "duplicate": True}, 200
+    except Exception as e:
+        savepoint.rollback()
+        logging.error("Error syncing %s event: %s", kind, e)
+        body, status = {"success": False, "error": str(e)}, 500
+    return body, status
+
+
+def _check_event(event):
+    if not isinstance(event, dict):
+        return "Malformed event"
+    event_id = event.get('id')
+    if not isinstance(event_id, str) or not 0 < len(
+            event_id) <= EVENT_ID_MAX_LENGTH:
+        return "Missing or invalid event id"
+    if event.get('type') not in SAVE_HANDLERS:
+        return "Unknown event type"
+    if not isinstance(event.get('payload'), dict):
+        return "Missing event payload"
+    return None
+
+
+def queued_at(value, now=None):
+    """When an offline save was made, from its ``queuedAt`` in epoch ms.
+
+    The client clock is only trusted within the last SYNC_MAX_AGE and never
+    past ``now``; a missing or malformed value means ``now``.
+    """
+    now = now or datetime.now()
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return now
+    try:
+        at = datetime.fromtimestamp(value / 1000)
+    except (OverflowError, OSError, ValueError):
+        return now
+    return min(max(at, now - SYNC_MAX_AGE), now)
+
+
+def apply_batch(kit_id, events, now=None):
+    """Apply queued events in order inside the caller's transaction.
+
+    Every event runs in its own savepoint, so one failing event is reported
+    in its result without undoing the rest of the batch. Each event is
+    applied as of its ``queuedAt``, so a save made offline before the
+    daily reset lands on the study day it was made.
+    """
+    known = SyncEvent.lookup(
+        kit_id, [
+            event.get('id') for event in events
+            if isinstance(event, dict) and isinstance(event.get('id'), str)
+        ])
+    applied = {}
+    results = []
+    for event in events:
+        error = _check_event(event)
+        if error:
+            results.append({
+                "id": event.get('id') if isinstance(event, dict) else None,
+                "success": False,
+                "status": 400,
+                "error": error
+            })
+            continue
+
+        event_id = event['id']
+        if event_id in applied:
+            body, status = dict(applied[event_id][0],
+                                duplicate=True), applied[event_id][1]
+        elif event_id in known:
+            body, status = replay(known[event_id])
+        else:
+            body, status = apply_in_savepoint(
+                kit_id, event['type'], event['payload'], event_id,
+                queued_at(event.get('queuedAt'), now))
+            applied[event_id] = (body, status)
+
+        results.append(dict(body, id=event_id, status=status))
+    return results
+
+
+def prune_sync_events(now=None, chunk_size=PRUNE_CHUNK_SIZE):
+    """Delete SyncEvent rows older than SYNC_EVENT_RETENTION; returns the count.
+
+    Deletes and commits in chunks read from ix_sync_event_created_at, so a
+    large backlog never holds one long transaction.
+    """
+    cutoff = (now or datetime.now()) - SYNC_EVENT_RETENTION
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            db.select(SyncEvent.id).where(
+                SyncEvent.created_at < cutoff).order_by(
+                    SyncEvent.created_at).limit(chunk_size)).scalars().all()
+        if not ids:
+            return deleted
+        db.session.execute(db.delete(SyncEvent).where(SyncEvent.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
@@ -0,0 +1,325 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+from database import db
+from models import SyncEvent
+from processes import alive
+import tracking
+
+# Off by default: with it on, saves are acknowledged before they are applied
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '0') not in ('0', 'false', 'no')
+# A flush runs this often, or as soon as a full batch is waiting
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.25))
+WRITE_BEHIND_BATCH = int(os.environ.get('WRITE_BEHIND_BATCH', 200))
+# Saves waiting beyond this are refused with a 503 instead of queued
+WRITE_BEHIND_MAX_QUEUE = int(os.environ.get('WRITE_BEHIND_MAX_QUEUE', 10000))
+# Defaults to instance/write-behind; every process keeps its own files there
+WRITE_BEHIND_SPOOL_DIR = os.environ.get('WRITE_BEHIND_SPOOL_DIR')
+# With 0 the spool survives a crashed process but not a crashed machine
+WRITE_BEHIND_FSYNC = os.environ.get('WRITE_BEHIND_FSYNC', '1') not in ('0', 'false', 'no')
+# A save failing with a server error this many times is moved to the
+# dead-letter file, so it stops holding back the kit's later saves
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get('WRITE_BEHIND_MAX_ATTEMPTS', 5))
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+
+# Tokens of the buffers running in this process, whose spool files must be
+# left alone by any other buffer here
+_running = set()
+
+
+class BufferFull(Exception):
+    pass
+
+
+class WriteBehind:
+    """Acknowledge saves at once and apply them in batched transactions.
+
+    Every accepted save is appended to a spool file before it is queued.
+    The flusher thread applies the queue in one transaction, with each save
+    in its own savepoint, and deletes the spool file once that commits. A
+    process that dies leaves its spool behind, and the next process to
+    start replays it. Replays are safe because every save carries an
+    idempotency key recorded in SyncEvent. A save that keeps failing is
+    appended to the dead-letter file instead, for someone to look at.
+    """
+
+    def __init__(self, app, spool_dir=None, interval=WRITE_BEHIND_INTERVAL,
+                 batch_size=WRITE_BEHIND_BATCH,
+                 max_queue=WRITE_BEHIND_MAX_QUEUE, fsync=WRITE_BEHIND_FSYNC,
+                 max_attempts=WRITE_BEHIND_MAX_ATTEMPTS):
+        self.app = app
+        self.spool_dir = spool_dir or WRITE_BEHIND_SPOOL_DIR or os.path.join(
+            app.instance_path, 'write-behind')
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+        self.lock = threading.Condition()
+        # Only one flush at a time, so saves for a kit apply in order
+        self.flushing = threading.Lock()
+        self.pid = None
+        self.token = None
+        self.pending = deque()
+        # Spool files whose saves are queued again after a failed flush
+        self.unsettled = []
+        self.segment = None
+        self.segments = 0
+        self.thread = None
+        self.stopping = False
+
+    def accept(self, kit_id, kind, payload, event_id=None):
+        """Queue a save and return ``(body, status)`` for the client.
+
+        A key that has already been applied gets its stored result, the
+        same as a retried synchronous save.
+        """
+        if event_id:
+            sync_event = SyncEvent.lookup(kit_id, [event_id]).get(event_id)
+            if sync_event:
+                return tracking.replay(sync_event)
+        try:
+            event_id = self.submit(kit_id, kind, payload, event_id)
+        except tracking.TrackingError as e:
+            return {"success": False, "error": e.message}, e.status
+        except BufferFull:
+            return {"success": False, "error": "Server busy, retry shortly"}, 503
+        return {"success": True, "queued": True, "eventId": event_id}, 202
+
+    def submit(self, kit_id, kind, payload, event_id=None):
+        """Queue a save and return its idempotency key.
+
+        Raises TrackingError when the save is invalid on its face, and
+        BufferFull when too many saves are already waiting.
+        """
+        tracking.check_payload(kit_id, kind, payload)
+        event = {
+            'id': event_id or uuid.uuid4().hex,
+            'kit_id': kit_id,
+            'kind': kind,
+            'payload': payload,
+            # Applied as of this moment, however late the flush runs
+            'at': datetime.now().isoformat(),
+        }
+        line = json.dumps(event, default=str) + '\n'
+        with self.lock:
+            self._start()
+            if len(self.pending) >= self.max_queue:
+                raise BufferFull()
+            self.segment.write(line)
+            self.segment.flush()
+            if self.fsync:
+                os.fsync(self.segment.fileno())
+            self.pending.append(event)
+            if len(self.pending) >= self.batch_size:
+                self.lock.notify()
+        return event['id']
+
+    def _start(self):
+        # Called with the lock held, on first use in each process; a forked
+        # worker starts over with its own spool
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex[:12]
+        _running.add(self.token)
+        self.pending.clear()
+        self.unsettled = []
+        self.segments = 0
+        self.stopping = False
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._recover()
+        self.segment = self._open_segment()
+        self.thread = threading.Thread(target=self._run,
+                                       name='write-behind',
+                                       daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _recover(self):
+        # Spool files of processes that are gone, including a previous
+        # process that had this pid, are claimed by renaming them first
+        for path in sorted(
+                glob.glob(os.path.join(self.spool_dir, '[0-9]*-*.jsonl'))):
+            pid, token = os.path.basename(path).split('-')[:2]
+            if int(pid) == self.pid:
+                if token in _running:
+                    continue
+            elif alive(int(pid)):
+                continue
+            claimed = os.path.join(
+                self.spool_dir,
+                f'{self.pid}-{self.token}-recovered-{uuid.uuid4().hex}.jsonl')
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed) as f:
+                for line in f:
+                    try:
+                        self.pending.append(json.loads(line))
+                    except ValueError:
+                        # The last line of a process killed mid-write
+                        logging.warning("Skipping torn write-behind line in %s",
+                                        path)
+            self.unsettled.append(claimed)
+        if self.pending:
+            logging.info("Recovered %s write-behind saves", len(self.pending))
+
+    def _open_segment(self):
+        self.segments += 1
+        return open(
+            os.path.join(self.spool_dir,
+                         f'{self.pid}-{self.token}-{self.segments:08d}.jsonl'),
+            'a')
+
+    def _run(self):
+        stalled = False
+        while True:
+            with self.lock:
+                # After a flush that applied nothing, wait out the interval
+                # even with a full batch waiting, rather than spin on it
+                self.lock.wait_for(
+                    lambda: (len(self.pending) >= self.batch_size and
+                             not stalled) or self.stopping,
+                    timeout=self.interval)
+                if self.stopping:
+                    return
+            stalled = self.flush() == 0 and bool(self.pending)
+
+    def flush(self):
+        """Apply everything queued in one transaction; returns the count."""
+        with self.flushing:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                batch = list(self.pending)
+                self.pending.clear()
+                settled = self.unsettled
+                self.unsettled = []
+                # New saves go to a fresh file, so the old ones can be
+                # deleted as soon as this batch commits. A segment nothing
+                # was written to since the last flush is kept as it is
+                if self.segment.tell():
+                    self.segment.close()
+                    settled.append(self.segment.name)
+                    self.segment = self._open_segment()
+
+            try:
+                with self.app.app_context():
+                    try:
+                        deferred, dead = self._apply(batch)
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        raise
+            except Exception as e:
+                logging.error("Write-behind flush of %s saves failed: %s",
+                              len(batch), e)
+                with self.lock:
+                    self.pending.extendleft(reversed(batch))
+                    self.unsettled = settled + self.unsettled
+                return 0
+
+            if dead:
+                self._dead_letter(dead)
+            if deferred:
+                # Their spool files stay until a later flush applies them;
+                # saves that did commit are skipped on replay by their key
+                with self.lock:
+                    self.pending.extendleft(reversed(deferred))
+                    self.unsettled = settled + self.unsettled
+                return len(batch) - len(deferred) - len(dead)
+
+            for path in settled:
+                os.remove(path)
+            return len(batch) - len(dead)
+
+    def _apply(self, batch):
+        """Apply a batch; returns the saves to retry and the ones given up on.
+
+        Rejections (4xx) are final. A save that fails with a server error is
+        retried, and so is everything after it for the same kit, so the
+        kit's saves still apply in order. After ``max_attempts`` failures
+        the save is given up on and the kit's later saves go ahead.
+        """
+        by_kit = {}
+        for event in batch:
+            by_kit.setdefault(event['kit_id'], []).append(event)
+        retry = set()
+        dead = []
+        for kit_id, events in by_kit.items():
+            # Saves replayed from a spool may have committed before the crash
+            known = SyncEvent.lookup(kit_id, [event['id'] for event in events])
+            for position, event in enumerate(events):
+                if event['id'] in known:
+                    continue
+                body, status = tracking.apply_in_savepoint(
+                    kit_id, event['kind'], event['payload'], event['id'],
+                    datetime.fromisoformat(event['at']))
+                if status >= 500:
+                    event['attempts'] = event.get('attempts', 0) + 1
+                    if event['attempts'] >= self.max_attempts:
+                        dead.append(dict(event, error=body.get('error')))
+                        continue
+                    logging.error("Write-behind %s save %s for %s failed, "
+                                  "retrying: %s", event['kind'], event['id'],
+                                  kit_id, body.get('error'))
+                    retry.update(map(id, events[position:]))
+                    break
+                if status >= 400:
+                    logging.warning("Write-behind %s save %s for %s rejected: %s",
+                                    event['kind'], event['id'], kit_id,
+                                    body.get('error'))
+        return [event for event in batch if id(event) in retry], dead
+
+    def _dead_letter(self, events):
+        with open(os.path.join(self.spool_dir, DEAD_LETTER_FILE), 'a') as f:
+            for event in events:
+                logging.error("Write-behind %s save %s for %s failed %s times, "
+                              "moved to %s: %s", event['kind'], event['id'],
+                              event['kit_id'], event['attempts'],
+                              DEAD_LETTER_FILE, event['error'])
+                f.write(json.dumps(event, default=str) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        """Stop the flusher and apply what is left; unflushed saves stay spooled."""
+        with self.lock:
+            if self.pid != os.getpid() or self.thread is None:
+                return
+            self.stopping = True
+            self.lock.notify()
+        self.thread.join()
+        self.thread = None
+        self.flush()
+        with self.lock:
+            self.segment.close()
+            if not self.pending and os.path.getsize(self.segment.name) == 0:
+                os.remove(self.segment.name)
+            _running.discard(self.token)
+            self.pid = None
+
+    def drain(self):
+        """Replay spools left by processes that are gone, then stop."""
+        with self.lock:
+            self._start()
+        self.close()
+
+
+def headers(status):
+    return {'Retry-After': '1'} if status == 503 else {}
+
+
+def init_app(app):
+    if app.config.get('WRITE_BEHIND', WRITE_BEHIND):
+        app.extensions['write_behind'] = WriteBehind(app)